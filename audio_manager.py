@@ -1,81 +1,281 @@
 import os
+import heapq
+import itertools
 import pygame
 import time
-from threading import Thread
+from collections import OrderedDict
+from threading import Thread, Lock, Condition
 import logging
 
 logger = logging.getLogger('AudioManager')
 
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.ogg')
+
+# Rendered announcements are raw PCM, about 0.8 MB for 4-5 s of 44.1 kHz
+# 16-bit stereo, so this keeps roughly 20 of them
+MAX_PHRASE_BYTES = 16 * 1024 * 1024
+
+class AnnouncementQueue:
+    """Plays announcements one at a time from a single worker thread.
+
+    Higher priority announcements play first, equal priorities in arrival
+    order. Re-calling a number that is still pending does not queue it
+    again. When max_depth announcements are pending, drop_policy decides
+    whether the 'oldest' pending one or the 'newest' incoming one is lost.
+    """
+
+    def __init__(self, play, max_depth=50, drop_policy='oldest'):
+        if drop_policy not in ('oldest', 'newest'):
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.play = play
+        self.max_depth = max_depth
+        self.drop_policy = drop_policy
+        self.heap = []
+        self.pending = {}   # number -> heap entry
+        self.counter = itertools.count()
+        self.condition = Condition()
+        self.worker = None
+
+        self.enqueued = 0
+        self.played = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.max_depth_seen = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def enqueue(self, number, priority=0):
+        """Queue an announcement and return immediately.
+
+        Returns False if the announcement was dropped.
+        """
+        with self.condition:
+            if self.worker is None:
+                self.worker = Thread(target=self._run, daemon=True)
+                self.worker.start()
+
+            existing = self.pending.get(number)
+            if existing is not None:
+                self.coalesced += 1
+                if priority <= -existing[0]:
+                    return True
+                # Re-queue at the higher priority, keeping the original wait
+                existing[-1] = False
+                enqueued_at = existing[3]
+            else:
+                if len(self.pending) >= self.max_depth:
+                    if self.drop_policy == 'newest':
+                        self.dropped += 1
+                        logger.warning(f"Announcement queue full, dropped {number}")
+                        return False
+                    oldest = min(self.pending.values(), key=lambda entry: entry[1])
+                    oldest[-1] = False
+                    del self.pending[oldest[2]]
+                    self.dropped += 1
+                    logger.warning(f"Announcement queue full, dropped {oldest[2]}")
+                enqueued_at = time.monotonic()
+                self.enqueued += 1
+
+            entry = [-priority, next(self.counter), number, enqueued_at, True]
+            self.pending[number] = entry
+            heapq.heappush(self.heap, entry)
+            if len(self.heap) > 4 * self.max_depth:
+                # Drop entries invalidated by coalescing and drops
+                self.heap = list(self.pending.values())
+                heapq.heapify(self.heap)
+            self.max_depth_seen = max(self.max_depth_seen, len(self.pending))
+            self.condition.notify()
+            return True
+
+    def metrics(self):
+        """Get queue depth, drop/coalesce counts and wait times in seconds"""
+        with self.condition:
+            return {
+                'depth': len(self.pending),
+                'max_depth': self.max_depth_seen,
+                'enqueued': self.enqueued,
+                'played': self.played,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'avg_wait': self.total_wait / self.played if self.played else 0.0,
+                'max_wait': self.max_wait
+            }
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                entry = heapq.heappop(self.heap)
+                if not entry[-1]:
+                    continue
+                del self.pending[entry[2]]
+                wait = time.monotonic() - entry[3]
+                self.played += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+
+            try:
+                self.play(entry[2])
+            except Exception as e:
+                logger.error(f"Error playing announcement {entry[2]}: {e}")
+
 class AudioManager:
-    def __init__(self, audio_dir):
+    def __init__(self, audio_dir, preload=True, max_cached=128, max_phrase_bytes=MAX_PHRASE_BYTES,
+                 max_pending=50, drop_policy='oldest'):
+        """Set up the mixer and the decoded sample and phrase caches.
+
+        With preload the whole audio directory is decoded once at startup,
+        otherwise clips are decoded on first use. At most max_cached clips
+        and max_phrase_bytes of rendered announcements are kept, evicting
+        the least recently used ones. Announcements are played one at a
+        time, see AnnouncementQueue for max_pending and drop_policy.
+        """
         self.audio_dir = audio_dir
+        self.max_cached = max_cached
+        self.max_phrase_bytes = max_phrase_bytes
+        self.sounds = OrderedDict()
+        self.phrases = OrderedDict()  # key -> (Sound, PCM byte count)
+        self.phrase_bytes = 0
+        self.cache_lock = Lock()
+        self.announcements = AnnouncementQueue(self._announce, max_pending, drop_policy)
         pygame.mixer.init()
-        
-    def play_number(self, number):
-        """Play audio for a queue number (e.g., 'A001')"""
+
+        if preload:
+            self.preload()
+
+    def preload(self):
+        """Decode every clip in the audio directory into the cache"""
+        start = time.perf_counter()
         try:
-            # Create playlist of audio files to play
-            playlist = []
-            
-            # Add "Antrian" sound
-            playlist.append(os.path.join(self.audio_dir, "antrian.wav"))
-            
-            # Add counter letter sound (e.g., "A")
-            playlist.append(os.path.join(self.audio_dir, f"{number[0].lower()}.wav"))
-            
-            # Convert number to integer and create number sounds
-            num = int(number[1:])
-            if num == 0:
-                playlist.append(os.path.join(self.audio_dir, "0.wav"))
-            else:
-                # Handle hundreds
-                hundreds = num // 100
-                if hundreds > 0:
-                    playlist.append(os.path.join(self.audio_dir, f"{hundreds}.wav"))
-                    playlist.append(os.path.join(self.audio_dir, "ratus.wav"))
-                
-                # Handle remaining two digits
-                remainder = num % 100
-                if remainder > 0:
-                    if remainder < 20:  # Direct number
-                        playlist.append(os.path.join(self.audio_dir, f"{remainder}.wav"))
-                    else:
-                        # Handle tens
-                        tens = (remainder // 10) * 10
-                        ones = remainder % 10
-                        playlist.append(os.path.join(self.audio_dir, f"{tens}.wav"))
-                        if ones > 0:
-                            playlist.append(os.path.join(self.audio_dir, f"{ones}.wav"))
-            
-            # Add "Counter" sound
-            playlist.append(os.path.join(self.audio_dir, "counter.wav"))
-            
-            # Play the sequence in a separate thread
-            Thread(target=self._play_sequence, args=(playlist,), daemon=True).start()
-            
-        except Exception as e:
-            logger.error(f"Error playing audio for number {number}: {e}")
-    
-    def _play_sequence(self, playlist):
-        """Play a sequence of audio files"""
+            filenames = sorted(f for f in os.listdir(self.audio_dir)
+                               if f.lower().endswith(AUDIO_EXTENSIONS))
+        except OSError as e:
+            logger.error(f"Error listing audio directory: {e}")
+            return
+
+        for filename in filenames:
+            self.get_sound(filename)
+        logger.info(f"Preloaded {len(self.sounds)} audio clips in "
+                    f"{(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def get_sound(self, filename):
+        """Get a decoded clip from the cache, loading it on a miss"""
+        with self.cache_lock:
+            sound = self.sounds.get(filename)
+            if sound is not None:
+                self.sounds.move_to_end(filename)
+                return sound
+
+        audio_file = os.path.join(self.audio_dir, filename)
         try:
-            for audio_file in playlist:
-                if os.path.exists(audio_file):
-                    sound = pygame.mixer.Sound(audio_file)
-                    sound.play()
-                    # Wait for the sound to finish
-                    time.sleep(sound.get_length())
+            sound = pygame.mixer.Sound(audio_file)
+        except (pygame.error, FileNotFoundError) as e:
+            logger.warning(f"Audio file not available: {audio_file} ({e})")
+            return None
+
+        with self.cache_lock:
+            self.sounds[filename] = sound
+            if self.max_cached and len(self.sounds) > self.max_cached:
+                self.sounds.popitem(last=False)
+        return sound
+
+    def build_playlist(self, number):
+        """Get the clip names announcing a queue number (e.g., 'A001')"""
+        # Add "Antrian" sound
+        playlist = ["antrian.wav"]
+
+        # Add counter letter sound (e.g., "A")
+        playlist.append(f"{number[0].lower()}.wav")
+
+        # Convert number to integer and create number sounds
+        num = int(number[1:])
+        if num == 0:
+            playlist.append("0.wav")
+        else:
+            # Handle hundreds
+            hundreds = num // 100
+            if hundreds > 0:
+                playlist.append(f"{hundreds}.wav")
+                playlist.append("ratus.wav")
+
+            # Handle remaining two digits
+            remainder = num % 100
+            if remainder > 0:
+                if remainder < 20:  # Direct number
+                    playlist.append(f"{remainder}.wav")
                 else:
-                    logger.warning(f"Audio file not found: {audio_file}")
-        except Exception as e:
-            logger.error(f"Error playing audio sequence: {e}")
+                    # Handle tens
+                    tens = (remainder // 10) * 10
+                    ones = remainder % 10
+                    playlist.append(f"{tens}.wav")
+                    if ones > 0:
+                        playlist.append(f"{ones}.wav")
+
+        # Add "Counter" sound
+        playlist.append("counter.wav")
+        return playlist
+
+    def render_number(self, number):
+        """Get the announcement for a number as one gapless Sound.
+
+        The decoded clips share the mixer format, so their raw PCM can be
+        joined into a single buffer. Rendered phrases are cached per number.
+        """
+        key = f"{number[0].upper()}{int(number[1:])}"
+        with self.cache_lock:
+            cached = self.phrases.get(key)
+            if cached is not None:
+                self.phrases.move_to_end(key)
+                return cached[0]
+
+        clips = [self.get_sound(filename) for filename in self.build_playlist(number)]
+        pcm = b''.join(clip.get_raw() for clip in clips if clip)
+        if not pcm:
+            return None
+        phrase = pygame.mixer.Sound(buffer=pcm)
+
+        with self.cache_lock:
+            if key not in self.phrases:
+                self.phrases[key] = (phrase, len(pcm))
+                self.phrase_bytes += len(pcm)
+            # Always keep the newest phrase, even if it alone is too big
+            while (self.max_phrase_bytes and self.phrase_bytes > self.max_phrase_bytes
+                   and len(self.phrases) > 1):
+                _, (_, size) = self.phrases.popitem(last=False)
+                self.phrase_bytes -= size
+        return phrase
+
+    def prerender(self, service_codes, count=3):
+        """Render the first count numbers of each service in the background"""
+        def run():
+            for service_code in service_codes:
+                for num in range(1, count + 1):
+                    try:
+                        self.render_number(f"{service_code}{num}")
+                    except Exception as e:
+                        logger.error(f"Error pre-rendering {service_code}{num}: {e}")
+                        return
+            logger.info(f"Pre-rendered {count} announcements for {len(service_codes)} services")
+
+        Thread(target=run, daemon=True).start()
+
+    def play_number(self, number, priority=0):
+        """Queue the announcement for a queue number (e.g., 'A001')"""
+        return self.announcements.enqueue(number, priority)
+
+    def _announce(self, number):
+        """Play one announcement and block until it has finished"""
+        phrase = self.render_number(number)
+        if phrase:
+            phrase.play()
+            time.sleep(phrase.get_length())
 
     def play_notification(self):
         """Play a simple notification sound"""
         try:
-            sound_file = os.path.join(self.audio_dir, "simple_notification.wav")
-            if os.path.exists(sound_file):
-                sound = pygame.mixer.Sound(sound_file)
+            sound = self.get_sound("simple_notification.wav")
+            if sound:
                 sound.play()
         except Exception as e:
             logger.error(f"Error playing notification: {e}")
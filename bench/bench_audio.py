@@ -0,0 +1,59 @@
+"""AudioManager startup time versus per-call latency (user-007).
+
+Startup is timed with and without preloading the audio directory. Per
+call, decoding every clip of an announcement from disk, as playback used
+to, is compared with cached clips and with rendered phrases. Needs
+pygame; the mixer runs on SDL's dummy audio driver if none is set.
+"""
+import os
+import sys
+import time
+
+from bench_util import ROOT, summary
+
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+try:
+    import pygame
+except ImportError:
+    sys.exit("pygame is not installed, see requirements.txt")
+
+from audio_manager import AudioManager
+
+AUDIO_DIR = os.path.join(ROOT, 'audio')
+NUMBERS = [f"{code}{num:03d}" for code in 'AB' for num in range(1, 200)]
+
+def startup(preload):
+    began = time.perf_counter()
+    manager = AudioManager(AUDIO_DIR, preload=preload)
+    return manager, time.perf_counter() - began
+
+def per_call(play, numbers=NUMBERS):
+    durations = []
+    for number in numbers:
+        began = time.perf_counter()
+        play(number)
+        durations.append(time.perf_counter() - began)
+    return durations
+
+if __name__ == '__main__':
+    _, lazy_startup = startup(preload=False)
+    pygame.mixer.quit()
+    manager, preload_startup = startup(preload=True)
+    print(f"startup lazy {lazy_startup * 1000:.1f} ms, preloaded {preload_startup * 1000:.1f} ms")
+
+    def decode_from_disk(number):
+        for filename in manager.build_playlist(number):
+            audio_file = os.path.join(AUDIO_DIR, filename)
+            if os.path.exists(audio_file):
+                pygame.mixer.Sound(audio_file)
+
+    def cached_clips(number):
+        for filename in manager.build_playlist(number):
+            manager.get_sound(filename)
+
+    print(f"{'decode from disk':<18} {summary(per_call(decode_from_disk))}")
+    print(f"{'cached clips':<18} {summary(per_call(cached_clips))}")
+    print(f"{'render phrase':<18} {summary(per_call(manager.render_number))}")
+    # Far fewer phrases than NUMBERS fit in max_phrase_bytes
+    recent = NUMBERS[-10:] * 40
+    print(f"{'cached phrase':<18} {summary(per_call(manager.render_number, recent))}")
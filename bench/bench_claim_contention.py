@@ -0,0 +1,48 @@
+"""Claim throughput with 16 counters on one waiting line (user-004).
+
+The same race as tests/test_claim_contention.py, against the SQL path
+and the in-memory QueueEngine.
+"""
+import threading
+import time
+
+from bench_util import temp_queue
+import database
+
+COUNTERS = 16
+TICKETS = 10000
+
+def measure(engine):
+    with temp_queue(counters={'A': COUNTERS}):
+        conn = database.get_connection()
+        conn.executemany("INSERT INTO queue (number, service_code) VALUES (?, 'A')",
+                         [(f"A{i:05d}",) for i in range(1, TICKETS + 1)])
+        conn.commit()
+        if engine:
+            database.start_engine()
+        start = threading.Barrier(COUNTERS + 1)
+        claims = {}
+
+        def claim(counter_id):
+            start.wait()
+            count = 0
+            while database.get_next_number(counter_id):
+                count += 1
+            claims[counter_id] = count
+
+        threads = [threading.Thread(target=claim, args=(counter['id'],))
+                   for counter in database.get_counter_list()]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        began = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - began, claims
+
+if __name__ == '__main__':
+    for engine in (False, True):
+        elapsed, claims = measure(engine)
+        print(f"{'engine' if engine else 'sql':<7} {sum(claims.values())} claims by {COUNTERS} "
+              f"counters in {elapsed:.2f} s, {TICKETS / elapsed:.0f} claims/s, "
+              f"busiest counter {max(claims.values())}")
@@ -0,0 +1,59 @@
+"""Claim latency with mixed priorities and appointments (user-024).
+
+The line is held at N waiting tickets: 10% high priority, 1% appointments
+already due and 2% booked for later in the day. Each claim is preceded by
+a new ticket so the line does not shrink. Runs on the database and on the
+in-memory QueueEngine.
+"""
+import random
+import time
+from datetime import datetime, timedelta
+
+from bench_util import temp_queue, summary
+import database
+
+SIZES = (100, 1000, 10000)
+CLAIMS = 200
+
+def fill(size, rng):
+    due = database.utc_timestamp(datetime.now() - timedelta(minutes=5))
+    later = database.utc_timestamp(datetime.now() + timedelta(hours=3))
+    rows = []
+    for i in range(size):
+        r = rng.random()
+        if r < 0.01:
+            priority, appointment_at = database.PRIORITY_APPOINTMENT, due
+        elif r < 0.03:
+            priority, appointment_at = database.PRIORITY_APPOINTMENT, later
+        elif r < 0.13:
+            priority, appointment_at = database.PRIORITY_HIGH, None
+        else:
+            priority, appointment_at = database.PRIORITY_NORMAL, None
+        rows.append((f"A{i + 1:05d}", priority, appointment_at))
+    conn = database.get_connection()
+    conn.executemany('''
+        INSERT INTO queue (number, service_code, status, priority, appointment_at)
+        VALUES (?, 'A', 'waiting', ?, ?)
+    ''', rows)
+    conn.commit()
+
+def measure(size, engine):
+    rng = random.Random(size)
+    with temp_queue():
+        fill(size, rng)
+        if engine:
+            database.start_engine()
+        times = []
+        for _ in range(CLAIMS):
+            priority = database.PRIORITY_HIGH if rng.random() < 0.1 else database.PRIORITY_NORMAL
+            database.create_new_number('A', priority)
+            began = time.perf_counter()
+            assert database.get_next_number(1)
+            times.append(time.perf_counter() - began)
+        return times
+
+if __name__ == '__main__':
+    for size in SIZES:
+        for engine in (False, True):
+            times = measure(size, engine)
+            print(f"{size:>6} waiting, {'engine' if engine else 'sql':<6} {summary(times)}")
@@ -0,0 +1,58 @@
+"""Latency of sends from a button click through WebSocketClient (user-015).
+
+A counter and a display client talk to a WebSocketServer on loopback,
+running in a thread as the GUIs would. Reports how long send_nowait()
+blocks the clicking thread, the time until the display's handler sees
+the event, and the round trip of a claim call.
+"""
+import threading
+import time
+
+from bench_util import temp_queue, summary, serve, wait_connected
+import database
+from websocket_client import WebSocketClient
+
+CLICKS = 500
+INTERVAL = 0.01  # seconds between clicks
+
+if __name__ == '__main__':
+    with temp_queue():
+        for i in range(CLICKS):
+            database.create_new_number('A')
+        uri, stop = serve()
+        counter = WebSocketClient(uri=uri)
+        display = WebSocketClient(uri=uri)
+        received = {}
+        arrived = threading.Semaphore(0)
+
+        async def on_message(data):
+            received[data.get('number')] = time.perf_counter()
+            arrived.release()
+
+        display.add_message_handler(on_message)
+        counter.start()
+        display.start()
+        wait_connected(counter, display)
+
+        clicked, blocked = {}, []
+        for i in range(CLICKS):
+            number = f"A{i + 1:03d}"
+            clicked[number] = began = time.perf_counter()
+            counter.send_nowait({'type': 'call_number', 'number': number, 'counter_id': 1})
+            blocked.append(time.perf_counter() - began)
+            time.sleep(INTERVAL)
+        for _ in range(CLICKS):
+            arrived.acquire(timeout=5)
+        delivered = [received[number] - clicked[number] for number in clicked if number in received]
+
+        calls = []
+        for _ in range(CLICKS):
+            began = time.perf_counter()
+            counter.call('claim', {'counter_id': 1})
+            calls.append(time.perf_counter() - began)
+        stop()
+
+    print(f"{len(delivered)} of {CLICKS} events delivered")
+    print(f"{'click blocked':<16} {summary(blocked)}")
+    print(f"{'click to display':<16} {summary(delivered, unit=1e3, suffix='ms')}")
+    print(f"{'claim round trip':<16} {summary(calls, unit=1e3, suffix='ms')}")
@@ -0,0 +1,40 @@
+"""Calls per second with a connection per call versus the per-thread
+connection of database.get_connection() (user-001).
+
+"Per call" closes the thread's connection after every call, so each call
+opens queue.db again, as create_connection() per call used to.
+"""
+import time
+
+from bench_util import temp_queue
+import database
+
+CALLS = 2000
+
+OPERATIONS = {
+    'get_queue_stats': lambda: database.get_queue_stats('A'),
+    'get_counter_list': database.get_counter_list,
+    'has_waiting_numbers': lambda: database.has_waiting_numbers(1),
+    'get_queue_list': lambda: database.get_queue_list(1),
+}
+
+def calls_per_second(operation, reopen):
+    began = time.perf_counter()
+    for _ in range(CALLS):
+        operation()
+        if reopen:
+            database.close_connection()
+    return CALLS / (time.perf_counter() - began)
+
+if __name__ == '__main__':
+    with temp_queue():
+        for i in range(500):
+            database.create_new_number('AB'[i % 2])
+        for _ in range(100):
+            database.get_next_number(1)
+
+        print(f"{'operation':<22} {'per call':>10} {'per thread':>11} {'speedup':>8}   (calls/s)")
+        for name, operation in OPERATIONS.items():
+            before = calls_per_second(operation, reopen=True)
+            after = calls_per_second(operation, reopen=False)
+            print(f"{name:<22} {before:>10.0f} {after:>11.0f} {after / before:>7.1f}x")
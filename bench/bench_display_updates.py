@@ -0,0 +1,66 @@
+"""Replay 10k call events into the board (user-006).
+
+Compares the per-message cost of the old display path, which queried
+get_queue_stats() on a fresh connection for every message, with the
+server keeping running totals in apply_event(). With an X server (e.g.
+under xvfb-run) the events are then applied to a real QueueDisplay.
+"""
+import os
+import time
+
+from bench_util import temp_queue, summary
+import database
+from websocket_server import WebSocketServer
+
+EVENTS = 10000
+
+def call_events(server):
+    """Issue EVENTS tickets and build the call events that clear them"""
+    events = []
+    for i in range(EVENTS):
+        service_code = 'AB'[i % 2]
+        number = database.create_new_number(service_code)
+        server.apply_event({'type': 'new_number', 'number': number, 'service_code': service_code})
+        counter_id = 1 + 2 * (i % 2) + (i // 2) % 2  # A1, B1, A2, B2
+        events.append({'type': 'call_number', 'number': number, 'service_code': service_code,
+                       'counter_id': counter_id, 'counter_name': f"Loket {counter_id}"})
+    return events
+
+def timed(apply, events):
+    durations = []
+    for data in events:
+        began = time.perf_counter()
+        apply(data)
+        durations.append(time.perf_counter() - began)
+    return durations
+
+def query_stats(data):
+    database.get_queue_stats(data['service_code'])
+    database.close_connection()
+
+def display_updates(events):
+    import tkinter as tk
+    from display import QueueDisplay
+
+    root = tk.Tk()
+    try:
+        display = QueueDisplay(root)
+        durations = timed(display.handle_message, events)
+        root.update()
+        return durations
+    finally:
+        root.destroy()
+
+if __name__ == '__main__':
+    with temp_queue(number_width=5):
+        server = WebSocketServer()
+        events = call_events(server)
+        before = timed(query_stats, events)
+        after = timed(server.apply_event, events)
+    print(f"{'stats query per message':<26} {summary(before)}  total {sum(before):.2f} s")
+    print(f"{'server apply_event':<26} {summary(after)}  total {sum(after):.2f} s")
+    if os.environ.get('DISPLAY'):
+        applied = display_updates(events)
+        print(f"{'QueueDisplay update':<26} {summary(applied)}  total {sum(applied):.2f} s")
+    else:
+        print("No X server, QueueDisplay updates skipped (run under xvfb-run)")
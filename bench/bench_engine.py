@@ -0,0 +1,30 @@
+"""Issue and claim latency of the SQL path versus the in-memory
+QueueEngine (user-005)"""
+import time
+
+from bench_util import temp_queue, summary
+import database
+
+OPERATIONS = 2000
+
+def measure(engine):
+    with temp_queue():
+        if engine:
+            database.start_engine()
+        issue, claim = [], []
+        for i in range(OPERATIONS):
+            began = time.perf_counter()
+            database.create_new_number('AB'[i % 2])
+            issue.append(time.perf_counter() - began)
+        for i in range(OPERATIONS):
+            began = time.perf_counter()
+            database.get_next_number(1 + 2 * (i % 2))  # counters A1 and B1
+            claim.append(time.perf_counter() - began)
+        return issue, claim
+
+if __name__ == '__main__':
+    for engine in (False, True):
+        issue, claim = measure(engine)
+        name = 'engine' if engine else 'sql'
+        print(f"{name:<7} issue  {summary(issue)}")
+        print(f"{name:<7} claim  {summary(claim)}")
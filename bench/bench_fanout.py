@@ -0,0 +1,84 @@
+"""Delivery latency to 500 display clients over loopback (user-010).
+
+A counter client sends call events to a WebSocketServer on 127.0.0.1,
+each display client notes when every event arrives. A few stalled
+displays never read, they must not delay the rest. They are dropped
+once the socket buffers and their send queue are full, which takes more
+than EVENTS small frames on loopback.
+
+The displays run in the same process, so on a small machine their own
+decoding shows up in the latency.
+"""
+import asyncio
+import logging
+import time
+
+import websockets
+
+from bench_util import summary
+import protocol
+from websocket_server import WebSocketServer
+
+CLIENTS = 500
+STALLED = 5
+EVENTS = 200
+INTERVAL = 0.1  # seconds between calls
+
+async def display(uri, sent_at, latencies, ready, done):
+    async with websockets.connect(uri) as websocket:
+        ready.release()
+        seen = 0
+        async for message in websocket:
+            latencies.append(time.perf_counter() - sent_at[protocol.decode(message)['number']])
+            seen += 1
+            if seen == EVENTS:
+                break
+    done.release()
+
+async def stalled(uri, ready, stop):
+    # The client library buffers a single frame, then TCP backs up
+    async with websockets.connect(uri, max_queue=1):
+        ready.release()
+        await stop.wait()
+
+async def run():
+    server = WebSocketServer()
+    async with websockets.serve(server.handler, '127.0.0.1', 0) as ws_server:
+        uri = f"ws://127.0.0.1:{ws_server.sockets[0].getsockname()[1]}"
+        sent_at, latencies = {}, []
+        ready, done, stop = asyncio.Semaphore(0), asyncio.Semaphore(0), asyncio.Event()
+        tasks = [asyncio.create_task(display(uri, sent_at, latencies, ready, done))
+                 for _ in range(CLIENTS)]
+        tasks += [asyncio.create_task(stalled(uri, ready, stop)) for _ in range(STALLED)]
+        for _ in tasks:
+            await ready.acquire()
+
+        async with websockets.connect(uri) as counter:
+            for i in range(EVENTS):
+                number = f"A{i + 1:03d}"
+                sent_at[number] = time.perf_counter()
+                await counter.send(protocol.encode({'type': 'call_number', 'number': number,
+                                                    'counter_id': 1, 'counter_name': 'Loket 1'}))
+                await asyncio.sleep(INTERVAL)
+            completed = 0
+            try:
+                for _ in range(CLIENTS):
+                    await asyncio.wait_for(done.acquire(), 30)
+                    completed += 1
+            except asyncio.TimeoutError:
+                pass
+            await asyncio.sleep(0.5)  # let the finished displays unregister
+            dropped = STALLED - (len(server.clients) - 1)  # minus the counter
+        stop.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        server.stop()
+    return latencies, completed, dropped
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    latencies, completed, dropped = asyncio.run(run())
+    print(f"{CLIENTS} displays, {EVENTS} events: {completed} got every event, "
+          f"{dropped} of {STALLED} stalled dropped")
+    print(f"delivery latency  {summary(latencies, unit=1e3, suffix='ms')}")
@@ -0,0 +1,63 @@
+"""Ticket issuance throughput from several kiosk processes (user-003).
+
+Each process issues tickets against the same queue.db while claimer
+threads call them, as in tests/test_issuance.py.
+"""
+import multiprocessing
+import sys
+import threading
+import time
+
+from bench_util import temp_queue, use_queue_dir
+import database
+
+PROCESSES = 6
+CLAIMERS = 8
+TICKETS = int(sys.argv[1]) if len(sys.argv) > 1 else 30000
+
+def issue_tickets(directory, count, start, results):
+    use_queue_dir(directory)
+    start.wait()
+    for i in range(count):
+        database.create_new_number('AB'[i % 2])
+    results.put(count)
+
+def claim(counter_id, issuing):
+    while database.get_next_number(counter_id) or issuing.is_set():
+        pass
+
+if __name__ == '__main__':
+    with temp_queue(counters={'A': 4, 'B': 4}) as directory:
+        counter_ids = [counter['id'] for counter in database.get_counter_list()]
+        context = multiprocessing.get_context('spawn')
+        start = context.Barrier(PROCESSES + 1)  # once every kiosk is up
+        results = context.Queue()
+        per_process = TICKETS // PROCESSES
+        workers = [context.Process(target=issue_tickets,
+                                   args=(directory, per_process, start, results))
+                   for _ in range(PROCESSES)]
+        for worker in workers:
+            worker.start()
+
+        issuing = threading.Event()
+        issuing.set()
+        claimers = [threading.Thread(target=claim, args=(counter_ids[i % len(counter_ids)], issuing))
+                    for i in range(CLAIMERS)]
+        start.wait()
+        began = time.perf_counter()
+        for claimer in claimers:
+            claimer.start()
+        for _ in workers:
+            results.get(timeout=600)
+        for worker in workers:
+            worker.join()
+        issued = time.perf_counter() - began
+        issuing.clear()
+        for claimer in claimers:
+            claimer.join()
+        drained = time.perf_counter() - began
+
+    total = per_process * PROCESSES
+    print(f"{total} tickets by {PROCESSES} processes with {CLAIMERS} claimers")
+    print(f"issued in {issued:.2f} s ({total / issued:.0f} tickets/s), "
+          f"all called after {drained:.2f} s")
@@ -0,0 +1,43 @@
+"""JSON versus binary wire encoding of queue events (user-013).
+
+Payload sizes and encode/decode time for call_number and new_number
+events as the server broadcasts them, totals attached.
+"""
+import timeit
+
+from bench_util import percentile
+import protocol
+
+ROUNDS = 4000
+REPEAT = 5
+
+EVENTS = {
+    'call_number': {
+        'type': 'call_number', 'counter_id': 3, 'number': 'B042',
+        'counter_name': 'Loket B1', 'service_code': 'B', 'total': 87,
+        'waiting': 12, 'next_number': 'B043', 'eta': 540, 'seq': 1532
+    },
+    'new_number': {
+        'type': 'new_number', 'number': 'A088', 'service_code': 'A',
+        'total': 88, 'waiting': 13, 'next_number': 'A076', 'eta': 610,
+        'seq': 1533
+    }
+}
+EVENTS['batch'] = {'type': 'batch', 'events': [EVENTS['call_number']] * 4
+                   + [EVENTS['new_number']] * 4}
+
+def per_call_us(func, *args):
+    """Median time per call over REPEAT runs of ROUNDS calls"""
+    runs = sorted(timeit.repeat(lambda: func(*args), number=ROUNDS, repeat=REPEAT))
+    return percentile(runs, 50) / ROUNDS * 1e6
+
+if __name__ == '__main__':
+    print(f"{'event':<12} {'encoding':<8} {'bytes':>6} {'encode':>10} {'decode':>10}")
+    for name, data in EVENTS.items():
+        for encoding in protocol.ENCODINGS:
+            payload = protocol.encode(data, encoding)
+            assert protocol.decode(payload) == data
+            size = len(payload.encode('utf-8') if isinstance(payload, str) else payload)
+            encode = per_call_us(protocol.encode, data, encoding)
+            decode = per_call_us(protocol.decode, payload)
+            print(f"{name:<12} {encoding:<8} {size:>6} {encode:>7.2f} us {decode:>7.2f} us")
@@ -0,0 +1,69 @@
+"""Queue service throughput for 50 terminals over loopback (user-025).
+
+40 kiosks issue and 10 counters claim through RemoteQueue as fast as the
+server answers, each terminal on its own WebSocketClient. The server
+runs on the database and on the in-memory QueueEngine, as with
+remote_queue enabled.
+"""
+import threading
+import time
+
+from bench_util import temp_queue, summary, serve, wait_connected
+import database
+from remote_queue import RemoteQueue
+from websocket_client import WebSocketClient
+
+TERMINALS = 50
+KIOSKS = 40
+DURATION = 5.0  # seconds
+
+def terminal(i, uri, ready, start, stop, latencies):
+    client = WebSocketClient(topics=[], uri=uri)  # RPC replies only
+    client.start()
+    wait_connected(client)
+    queue = RemoteQueue(client)
+    counters = queue.get_counter_list()
+    ready.release()
+    start.wait()
+    kind = 'issue' if i < KIOSKS else 'claim'
+    mine = []
+    while not stop.is_set():
+        began = time.perf_counter()
+        if kind == 'issue':
+            queue.create_new_number('AB'[i % 2])
+        else:
+            queue.get_next_number(counters[i % len(counters)]['id'])
+        mine.append(time.perf_counter() - began)
+    latencies[kind].extend(mine)
+
+def measure(engine):
+    with temp_queue(remote_queue=True):
+        if engine:
+            database.start_engine()
+        uri, stop_server = serve()
+        latencies = {'issue': [], 'claim': []}
+        ready, start, stop = threading.Semaphore(0), threading.Event(), threading.Event()
+        threads = [threading.Thread(target=terminal, args=(i, uri, ready, start, stop, latencies),
+                                    daemon=True)
+                   for i in range(TERMINALS)]
+        for thread in threads:
+            thread.start()
+        for _ in threads:
+            ready.acquire()
+        start.set()
+        time.sleep(DURATION)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        stop_server()
+        return latencies
+
+if __name__ == '__main__':
+    for engine in (False, True):
+        latencies = measure(engine)
+        total = sum(len(values) for values in latencies.values())
+        print(f"{'engine' if engine else 'sql'}: {total / DURATION:.0f} requests/s "
+              f"from {TERMINALS} terminals")
+        for kind, values in latencies.items():
+            print(f"  {kind:<6} {len(values) / DURATION:6.0f}/s  "
+                  f"{summary(values, unit=1e3, suffix='ms')}")
@@ -0,0 +1,74 @@
+"""NumPy reports over a year of history under a memory ceiling (user-022).
+
+Fills queue_archive with 5M synthetic tickets over 365 days, 4 services
+and 12 counters, then builds the daily report and writes its CSV files
+in a fresh process, so the peak RSS is the report's own. Pass a smaller
+row count for a quick run, e.g. python bench/bench_reports.py 500000.
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from datetime import date, timedelta
+
+from bench_util import temp_queue, use_queue_dir
+import database
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000_000
+DAYS = 365
+FIRST_DAY = date(2025, 1, 1)
+MEMORY_CEILING_MB = 160
+
+# Tickets taken 08:00-17:00 UTC, called within the hour, every 20th expired
+FILL_QUERY = '''
+    INSERT INTO queue_archive (id, number, service_code, counter_id, status,
+                               created_at, called_at, archive_month)
+    WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < :rows - 1),
+    t AS (
+        SELECT i, char(65 + i % 4) AS service_code,
+               CAST(strftime('%s', :first_day) AS INTEGER) + i * :days / :rows * 86400
+               + 28800 + abs(random()) % 32400 AS created
+        FROM n
+    )
+    SELECT i + 1, service_code || printf('%03d', i % 1000), service_code,
+           CASE WHEN i % 20 THEN 1 + i % 12 END,
+           CASE WHEN i % 20 THEN 'called' ELSE 'expired' END,
+           datetime(created, 'unixepoch'),
+           CASE WHEN i % 20 THEN datetime(created + abs(random()) % 3600, 'unixepoch') END,
+           strftime('%Y-%m', created, 'unixepoch')
+    FROM t
+'''
+
+def report(directory, out_dir, results):
+    import reports
+
+    use_queue_dir(directory)
+    began = time.perf_counter()
+    daily = reports.build_report(FIRST_DAY, FIRST_DAY + timedelta(days=DAYS - 1))
+    daily.write_csv(out_dir, reports.get_counter_names())
+    elapsed = time.perf_counter() - began
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+    results.put((daily.rows, elapsed, peak_mb))
+
+if __name__ == '__main__':
+    with temp_queue(counters={'A': 3, 'B': 3, 'C': 3, 'D': 3}) as directory:
+        began = time.perf_counter()
+        conn = database.get_connection()
+        conn.execute(FILL_QUERY, {'rows': ROWS, 'days': DAYS, 'first_day': FIRST_DAY.isoformat()})
+        conn.commit()
+        database.close_connection()
+        print(f"Generated {ROWS} rows in {time.perf_counter() - began:.1f} s")
+
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        worker = context.Process(target=report,
+                                 args=(directory, os.path.join(directory, 'reports'), results))
+        worker.start()
+        rows, elapsed, peak_mb = results.get()
+        worker.join()
+
+    print(f"report over {rows} rows: {elapsed:.1f} s ({rows / elapsed:.0f} rows/s), "
+          f"peak RSS {peak_mb:.0f} MB (ceiling {MEMORY_CEILING_MB} MB)")
+    assert rows == ROWS
+    assert peak_mb <= MEMORY_CEILING_MB, f"peak RSS {peak_mb:.0f} MB over the ceiling"
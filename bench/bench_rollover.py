@@ -0,0 +1,71 @@
+"""Hot-path latency before and after the daily rollover (user-020).
+
+Seeds a year of history into the queue table, 365 days x 400 tickets,
+times issuing, claiming and the board queries, then archives the closed
+days and runs the maintenance as rollover() does, and times them again.
+"""
+import time
+
+from bench_util import temp_queue, summary
+import database
+
+DAYS = 365
+TICKETS_PER_DAY = 400
+CALLS = 300
+
+# Past tickets, all called, 08:00 onwards UTC, ids growing with created_at
+SEED_QUERY = '''
+    INSERT INTO queue (number, service_code, counter_id, status, created_at, called_at)
+    WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < :rows - 1),
+    t AS (
+        SELECT i, char(65 + i % 2) AS service_code,
+               datetime('now', 'start of day', -(:days - i / :per_day) || ' days',
+                        '+8 hours', '+' || ((i % :per_day) * 60) || ' seconds') AS created
+        FROM n
+    )
+    SELECT service_code || printf('%03d', i % :per_day / 2 + 1), service_code, 1 + i % 2,
+           'called', created, datetime(created, '+5 minutes')
+    FROM t
+'''
+
+def timed(function, *args):
+    times = []
+    for _ in range(CALLS):
+        began = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - began)
+    return times
+
+def measure():
+    return {
+        'create_new_number': timed(database.create_new_number, 'A'),
+        'get_next_number': timed(database.get_next_number, 1),
+        'get_queue_stats': timed(database.get_queue_stats, 'A'),
+        'get_current_numbers': timed(database.get_current_numbers),
+        'get_service_stats': timed(database.get_service_stats),
+    }
+
+def report(title, results):
+    print(title)
+    for name, times in results.items():
+        print(f"  {name:<20} {summary(times)}")
+
+if __name__ == '__main__':
+    with temp_queue():
+        conn = database.get_connection()
+        conn.execute(SEED_QUERY, {'rows': DAYS * TICKETS_PER_DAY, 'days': DAYS,
+                                  'per_day': TICKETS_PER_DAY})
+        conn.commit()
+        report(f"{DAYS} days x {TICKETS_PER_DAY} tickets in the queue table", measure())
+
+        cutoff = database.business_day_start(database.business_date())
+        began = time.perf_counter()
+        archived, expired = database.archive_closed_days(cutoff)
+        archive_time = time.perf_counter() - began
+        began = time.perf_counter()
+        database.run_maintenance()
+        maintenance_time = time.perf_counter() - began
+        print(f"archive_closed_days: {archived} rows ({expired} expired) in {archive_time:.2f} s, "
+              f"run_maintenance in {maintenance_time:.2f} s")
+
+        report("after rollover", measure())
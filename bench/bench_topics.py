@@ -0,0 +1,47 @@
+"""Broadcast cost as displays spread over more topics (user-011).
+
+1000 fake clients are split evenly over the service topics, each event
+is for one service. Without subscriptions every client gets every event.
+"""
+import asyncio
+import logging
+import time
+
+from bench_util import summary
+from websocket_server import WebSocketServer
+
+CLIENTS = 1000
+EVENTS = 500
+SERVICE_COUNTS = (1, 2, 5, 10, 20, 50)
+
+class FakeClient:
+    """Stands in for a websocket, broadcast() only queues for it"""
+
+async def measure(services):
+    server = WebSocketServer()
+    for i in range(CLIENTS):
+        client = FakeClient()
+        server.clients[client] = asyncio.Queue()
+        server.unfiltered.add(client)
+        if services:
+            server.subscribe(client, [f"service:S{i % services}"])
+
+    durations = []
+    for i in range(EVENTS):
+        data = {'type': 'call_number', 'number': f"S{i:03d}", 'counter_id': i % 8,
+                'service_code': f"S{i % (services or 1)}"}
+        topics = server.message_topics(data)
+        began = time.perf_counter()
+        await server.broadcast(data, topics=topics)
+        durations.append(time.perf_counter() - began)
+    delivered = sum(queue.qsize() for queue in server.clients.values())
+    server.stop()
+    return durations, delivered / EVENTS
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    print(f"{CLIENTS} clients, {EVENTS} events")
+    for services in (0,) + SERVICE_COUNTS:
+        durations, recipients = asyncio.run(measure(services))
+        name = f"{services} topics" if services else 'unsubscribed'
+        print(f"{name:<13} {recipients:6.0f} recipients  {summary(durations)}")
@@ -0,0 +1,97 @@
+"""Shared setup for the benchmark scripts in this directory.
+
+Run them from anywhere, e.g. python bench/bench_connections.py. They work
+on a throwaway queue.db and queue_config.json in a temporary directory.
+"""
+import asyncio
+import copy
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import websockets
+
+import config
+import database
+from websocket_server import WebSocketServer
+
+def use_queue_dir(directory):
+    """Point this process at the queue.db and config in directory"""
+    logging.disable(logging.INFO)
+    os.chdir(directory)
+    database.close_connection()
+    database.DB_FILE = os.path.join(directory, 'queue.db')
+
+@contextmanager
+def temp_queue(**overrides):
+    """Run the enclosed code against a fresh database and config.
+
+    Keyword arguments override config settings. Logging below WARNING is
+    silenced so it does not distort the timings.
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        use_queue_dir(directory)
+        try:
+            settings = copy.deepcopy(config.DEFAULT_CONFIG)
+            settings.update(overrides)
+            config.save_config(settings)
+            database.init_database()
+            yield directory
+        finally:
+            database.stop_engine()
+            database.close_connection()
+            os.chdir(cwd)
+
+def percentile(sorted_values, p):
+    """Get the p-th percentile of an already sorted list"""
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+def summary(values, unit=1e6, suffix='us'):
+    """Format p50/p95/p99 of durations in seconds"""
+    values = sorted(values)
+    return '  '.join(f"p{p} {percentile(values, p) * unit:8.1f} {suffix}" for p in (50, 95, 99))
+
+def serve():
+    """Start a WebSocketServer on a free loopback port in a thread.
+
+    Returns (uri, stop), call stop() to shut it down.
+    """
+    started = threading.Event()
+    state = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = WebSocketServer()
+        ws_server = loop.run_until_complete(websockets.serve(server.handler, '127.0.0.1', 0))
+        state['uri'] = f"ws://127.0.0.1:{ws_server.sockets[0].getsockname()[1]}"
+        state['stop'] = stop = asyncio.Event()
+        state['loop'] = loop
+        started.set()
+        loop.run_until_complete(stop.wait())
+        ws_server.close()
+        loop.run_until_complete(ws_server.wait_closed())
+        server.stop()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    started.wait()
+
+    def stop():
+        state['loop'].call_soon_threadsafe(state['stop'].set)
+        thread.join()
+    return state['uri'], stop
+
+def wait_connected(*clients):
+    """Block until every started WebSocketClient is connected"""
+    while not all(client.connected for client in clients):
+        time.sleep(0.01)
@@ -0,0 +1,94 @@
+"""WaitEstimator accuracy and speed on a synthetic day (user-021).
+
+About 20k tickets over 10 hours, 2 services with 6 counters each.
+Arrivals vary by hour, service times are exponential around 20 s. Each
+ticket's predicted wait, taken when it is issued, is compared with the
+wait it really had.
+"""
+import heapq
+import random
+import timeit
+
+from bench_util import percentile
+from wait_estimator import WaitEstimator
+
+SERVICES = ('A', 'B')
+COUNTERS_PER_SERVICE = 6
+HOURS = 10
+TICKETS_PER_HOUR = 1000  # per service, on average
+SERVICE_TIME = 20.0      # seconds, mean
+# Arrival rate per hour relative to the mean, a morning and afternoon peak
+HOURLY_LOAD = (0.6, 0.9, 1.2, 1.3, 1.1, 0.8, 0.9, 1.2, 1.1, 0.8)
+
+def arrivals(rng):
+    """Get (time, service_code) of the day's tickets in time order"""
+    events = []
+    for service_code in SERVICES:
+        for hour, load in enumerate(HOURLY_LOAD):
+            rate = TICKETS_PER_HOUR * load / 3600
+            t = hour * 3600 + rng.expovariate(rate)
+            while t < (hour + 1) * 3600:
+                events.append((t, service_code))
+                t += rng.expovariate(rate)
+    return sorted(events)
+
+def simulate(seed=1):
+    """Replay the day, returns [(predicted, actual)] waits in seconds"""
+    rng = random.Random(seed)
+    estimator = WaitEstimator()
+    lines = {service_code: [] for service_code in SERVICES}  # (taken at, predicted)
+    heads = {service_code: 0 for service_code in SERVICES}
+    # Events are (time, kind, detail): kind 0 = counter free, 1 = arrival
+    events = [(t, 1, service_code) for t, service_code in arrivals(rng)]
+    counters = [(i, SERVICES[i // COUNTERS_PER_SERVICE])
+                for i in range(len(SERVICES) * COUNTERS_PER_SERVICE)]
+    events += [(0.0, 0, counter) for counter in counters]
+    heapq.heapify(events)
+    idle = {service_code: [] for service_code in SERVICES}
+    results = []
+
+    def serve(now, counter):
+        counter_id, service_code = counter
+        line = lines[service_code]
+        if heads[service_code] == len(line):
+            idle[service_code].append(counter)
+            return
+        taken_at, predicted = line[heads[service_code]]
+        heads[service_code] += 1
+        results.append((predicted, now - taken_at))
+        estimator.record_call(service_code, counter_id, len(line) - heads[service_code], now=now)
+        heapq.heappush(events, (now + rng.expovariate(1 / SERVICE_TIME), 0, counter))
+
+    while events:
+        now, kind, detail = heapq.heappop(events)
+        if kind == 1:
+            line = lines[detail]
+            position = len(line) - heads[detail]
+            line.append((now, estimator.eta(detail, position, now=now)))
+            if idle[detail]:
+                serve(now, idle[detail].pop())
+        else:
+            serve(now, detail)
+    return results
+
+def throughput():
+    """Get record_call() and eta() calls per second"""
+    estimator = WaitEstimator()
+    now = iter(range(10 ** 9))
+    rounds = 200000
+    record = timeit.timeit(lambda: estimator.record_call('A', 1, 5, now=next(now)), number=rounds)
+    eta = timeit.timeit(lambda: estimator.eta('A', 12, now=10 ** 9), number=rounds)
+    return rounds / record, rounds / eta
+
+if __name__ == '__main__':
+    results = simulate()
+    errors = sorted(abs(predicted - actual) for predicted, actual in results)
+    long_waits = [(predicted, actual) for predicted, actual in results if actual > 600]
+    relative = sum(abs(p - a) / a for p, a in long_waits) / len(long_waits) if long_waits else 0
+    mean_wait = sum(actual for _, actual in results) / len(results)
+    print(f"{len(results)} tickets, mean wait {mean_wait / 60:.1f} min")
+    print(f"absolute error  median {percentile(errors, 50) / 60:.1f} min, "
+          f"p90 {percentile(errors, 90) / 60:.1f} min, MAE {sum(errors) / len(errors) / 60:.1f} min")
+    print(f"relative MAE for waits over 10 min: {relative:.1%}")
+    record_rate, eta_rate = throughput()
+    print(f"record_call {record_rate:,.0f}/s, eta {eta_rate:,.0f}/s")
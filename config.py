@@ -1,5 +1,8 @@
+import copy
 import json
 import os
+import tempfile
+import threading
 import logging
 
 logger = logging.getLogger('Config')
@@ -21,45 +24,243 @@ DEFAULT_CONFIG = {
             "name": "Pelayanan B",
             "description": "Layanan administrasi B"
         }
-    ]
+    ],
+    "number_width": 3,   # A001
+    "daily_reset": True,  # restart numbering every day
+    "batch_window_ms": 0,  # server batches display updates when > 0
+    "rollover_time": "00:00",  # local time a new queue day starts
+    "archive_after_days": 0,   # closed days kept in the queue table
+    "counter_services": {},    # e.g. {"A1": {"A": 2, "B": 1}}, default own service only
+    "dispatch_policy": "oldest_wait",  # longest_queue, oldest_wait, weighted_round_robin
+    "server_host": "localhost",  # queue server address, e.g. "0.0.0.0" on the server itself
+    "server_port": 8765,
+    "remote_queue": False  # GUIs issue and claim through the server, which owns queue.db
 }
 
 CONFIG_FILE = 'queue_config.json'
 
-def load_config():
+# Parsed config, reused until the file's mtime, inode or size changes
+_cache_lock = threading.Lock()
+_cache_key = None
+_cached = None
+_listeners = []
+_watcher = None
+
+def _file_key():
+    st = os.stat(CONFIG_FILE)
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+def _parse_time(value):
+    """Parse 'HH:MM' into (hour, minute), None if invalid"""
     try:
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
+        hour, minute = (int(part) for part in value.split(':'))
+    except ValueError:
+        return None
+    if 0 <= hour < 24 and 0 <= minute < 60:
+        return hour, minute
+    return None
+
+def validate_config(config):
+    """Fill in missing settings and replace invalid ones with the defaults"""
+    if not isinstance(config, dict):
+        logger.error("Config is not a JSON object, using defaults")
+        return copy.deepcopy(DEFAULT_CONFIG)
+
+    valid = copy.deepcopy(DEFAULT_CONFIG)
+    checks = {
+        'office_name': lambda v: isinstance(v, str),
+        'counters': lambda v: isinstance(v, dict) and all(
+            isinstance(code, str) and isinstance(count, int) and count >= 0
+            for code, count in v.items()),
+        'services': lambda v: isinstance(v, list) and all(
+            isinstance(s, dict) and {'code', 'name', 'description'} <= s.keys() for s in v),
+        'number_width': lambda v: isinstance(v, int) and 1 <= v <= 9,
+        'daily_reset': lambda v: isinstance(v, bool),
+        'batch_window_ms': lambda v: isinstance(v, (int, float)) and v >= 0,
+        'rollover_time': lambda v: isinstance(v, str) and _parse_time(v) is not None,
+        'archive_after_days': lambda v: isinstance(v, int) and v >= 0,
+        'counter_services': lambda v: isinstance(v, dict) and all(
+            isinstance(weights, dict) and all(
+                isinstance(code, str) and isinstance(weight, int) and weight >= 0
+                for code, weight in weights.items())
+            for weights in v.values()),
+        'dispatch_policy': lambda v: v in ('longest_queue', 'oldest_wait', 'weighted_round_robin'),
+        'server_host': lambda v: isinstance(v, str) and v != '',
+        'server_port': lambda v: isinstance(v, int) and 0 < v < 65536,
+        'remote_queue': lambda v: isinstance(v, bool),
+    }
+    for key, value in config.items():
+        check = checks.get(key)
+        if check is None or check(value):
+            valid[key] = value
         else:
-            save_config(DEFAULT_CONFIG)
-            return DEFAULT_CONFIG
-    except Exception as e:
-        logger.error(f"Error loading config: {e}")
+            logger.warning(f"Invalid config value for {key!r}, using default")
+    return valid
+
+def _get():
+    """Get the cached config, re-reading the file only when it changed"""
+    global _cache_key, _cached
+    try:
+        key = _file_key()
+    except FileNotFoundError:
+        save_config(DEFAULT_CONFIG)
         return DEFAULT_CONFIG
+    except OSError as e:
+        logger.error(f"Error checking config file: {e}")
+        return _cached or DEFAULT_CONFIG
+
+    changed = False
+    with _cache_lock:
+        if key == _cache_key:
+            return _cached
+        try:
+            with open(CONFIG_FILE, 'r') as f:
+                config = validate_config(json.load(f))
+        except Exception as e:
+            logger.error(f"Error loading config: {e}")
+            return _cached or DEFAULT_CONFIG
+        changed = _cached is not None and config != _cached
+        _cache_key, _cached = key, config
+
+    if changed:
+        logger.info("Config file changed, reloaded")
+        for listener in list(_listeners):
+            try:
+                listener(config)
+            except Exception as e:
+                logger.error(f"Error in config listener: {e}")
+    return config
+
+def load_config():
+    """Get a copy of the current config that the caller may modify"""
+    return copy.deepcopy(_get())
 
 def save_config(config):
+    """Write the config atomically, returns False if it could not be saved.
+
+    The JSON goes to a temporary file in the same directory which is then
+    renamed over the config, so readers and crashes never see a partial
+    file.
+    """
+    global _cache_key
+    directory = os.path.dirname(os.path.abspath(CONFIG_FILE))
+    saved = False
+    tmp_path = None
     try:
-        with open(CONFIG_FILE, 'w') as f:
+        fd, tmp_path = tempfile.mkstemp(prefix='.queue_config.', suffix='.tmp', dir=directory)
+        with os.fdopen(fd, 'w') as f:
             json.dump(config, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, CONFIG_FILE)
+        tmp_path = None
+        saved = True
     except Exception as e:
         logger.error(f"Error saving config: {e}")
+    finally:
+        if tmp_path is not None:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+    with _cache_lock:
+        _cache_key = None  # re-read on next access even within one mtime tick
+    return saved
+
+def check_for_changes():
+    """Reload the config if the file changed, notifying the listeners"""
+    _get()
+
+def add_config_listener(listener):
+    """Call listener(config) whenever a changed config file is loaded.
+
+    Listeners run on whichever thread noticed the change, usually the
+    watcher thread started by start_watcher().
+    """
+    _listeners.append(listener)
+
+def remove_config_listener(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+def start_watcher(interval=2.0):
+    """Poll the config file in a daemon thread so running processes pick
+    up changes, e.g. from ConfigManager, without a restart"""
+    global _watcher
+    if _watcher is not None:
+        return
+
+    def watch():
+        stop = threading.Event()
+        while not stop.wait(interval):
+            check_for_changes()
+
+    _get()
+    _watcher = threading.Thread(target=watch, daemon=True)
+    _watcher.start()
 
 def get_counter_list():
     """Generate list of counters from config"""
-    config = load_config()
     counters = []
-    for letter, count in config['counters'].items():
+    for letter, count in _get()['counters'].items():
         for num in range(1, count + 1):
             counters.append(f"{letter}{num}")
     return counters
 
+def get_counter_counts():
+    """Get the number of counters per service code"""
+    return dict(_get()['counters'])
+
 def get_service_list():
     """Get list of services from config"""
-    config = load_config()
-    return config['services']
+    return copy.deepcopy(_get()['services'])
 
 def get_office_name():
     """Get office name from config"""
-    config = load_config()
-    return config['office_name']
+    return _get()['office_name']
+
+def get_number_width():
+    """Get minimum digit count for ticket numbers"""
+    return _get()['number_width']
+
+def get_daily_reset():
+    """Check whether ticket numbering restarts every day"""
+    return _get()['daily_reset']
+
+def get_batch_window_ms():
+    """Get the server's display update batching window in milliseconds"""
+    return _get()['batch_window_ms']
+
+def get_rollover_time():
+    """Get the local (hour, minute) at which a new queue day starts"""
+    return _parse_time(_get()['rollover_time'])
+
+def get_archive_after_days():
+    """Get how many closed days stay in the queue table before archiving"""
+    return _get()['archive_after_days']
+
+def get_counter_services(counter, service_code):
+    """Get {service_code: weight} of the services a counter (e.g. 'A1') serves.
+
+    Counters not listed in counter_services only serve their own service.
+    """
+    weights = _get()['counter_services'].get(counter)
+    return dict(weights) if weights else {service_code: 1}
+
+def get_dispatch_policy():
+    """Get how counters serving several services choose the next ticket"""
+    return _get()['dispatch_policy']
+
+def get_server_address():
+    """Get the (host, port) of the WebSocket and queue server"""
+    config = _get()
+    return config['server_host'], config['server_port']
+
+def get_server_uri():
+    """Get the URI clients connect to the server at"""
+    host, port = get_server_address()
+    return f"ws://{host}:{port}"
+
+def get_remote_queue():
+    """Check whether the GUIs use the queue service instead of a local queue.db"""
+    return _get()['remote_queue']
@@ -1,10 +1,22 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import string
-from config import load_config, save_config
+import logging
+from config import load_config, save_config, get_remote_queue
+from database import sync_counters
+from websocket_client import WebSocketClient
+
+logger = logging.getLogger('ConfigManager')
 
 class ConfigManager:
-    def __init__(self, root):
+    def __init__(self, root, ws_client=None):
+        # Running GUIs and displays are told about saved changes through
+        # the WebSocket server
+        if ws_client is None:
+            ws_client = WebSocketClient(topics=[])  # send only
+            ws_client.start()
+        self.ws_client = ws_client
+        
         self.window = tk.Toplevel(root)
         self.window.title('Pengaturan Sistem Antrian')
         self.window.geometry('600x400')
@@ -126,7 +138,21 @@ class ConfigManager:
         self.config['counters'] = new_counters
         
         # Save config
-        save_config(self.config)
+        if not save_config(self.config):
+            messagebox.showerror("Error", "Gagal menyimpan pengaturan")
+            return
+        
+        # Apply the counters to the database and reload running clients.
+        # With remote_queue the server owns the database and syncs itself.
+        try:
+            if not get_remote_queue():
+                sync_counters()
+        except Exception as e:
+            logger.error(f"Failed to sync counters: {e}")
+            messagebox.showerror("Error", "Gagal memperbarui daftar loket")
+            return
+        self.ws_client.send_nowait({'type': 'config_changed'})
+        
         messagebox.showinfo("Sukses", "Pengaturan berhasil disimpan!")
         self.window.destroy()
 
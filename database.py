@@ -1,5 +1,4 @@
 import logging
-import json
 
 # Configure logging
 logging.basicConfig(
@@ -8,20 +7,117 @@ logging.basicConfig(
 )
 logger = logging.getLogger('Database')
 
+import heapq
+import itertools
+import os
 import sqlite3
-from config import get_counter_list
+import threading
+import time
+from datetime import datetime, time as dt_time, timedelta, timezone
+from config import (get_counter_counts, get_number_width, get_daily_reset, get_rollover_time,
+                    get_counter_services, get_dispatch_policy)
+from scheduler import Scheduler, LONGEST_QUEUE
+
+DB_FILE = 'queue.db'
+
+# Applied to every new connection. WAL lets the displays read while a
+# counter or kiosk is writing, and NORMAL sync is safe under WAL.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-8000",      # 8 MB page cache
+    "PRAGMA mmap_size=67108864",    # 64 MB memory-mapped I/O
+    "PRAGMA busy_timeout=5000",
+)
+
+# Number of compiled statements kept per connection
+STATEMENT_CACHE_SIZE = 128
+
+# Claim retries when the database stays locked; delay doubles each time
+CLAIM_RETRIES = 5
+CLAIM_BACKOFF = 0.05  # seconds
+
+# Ticket priorities, higher is served first. Appointment tickets only
+# become claimable at their appointment time.
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 1          # elderly, disabled and pregnant visitors
+PRIORITY_APPOINTMENT = 2
+
+# Rows moved to queue_archive per transaction, keeps the write lock short
+ARCHIVE_CHUNK_SIZE = 5000
+
+# Free pages returned to the filesystem per maintenance run
+VACUUM_PAGES = 2000
+
+_local = threading.local()
+
+# Optional in-memory QueueEngine, see start_engine()
+_engine = None
+
+# Picks the service of the next ticket for counters serving several
+_scheduler = None
 
 def create_connection():
+    """Open a new, tuned connection to the queue database"""
     try:
-        conn = sqlite3.connect('queue.db')
+        new = not os.path.exists(DB_FILE) or os.path.getsize(DB_FILE) == 0
+        conn = sqlite3.connect(DB_FILE, cached_statements=STATEMENT_CACHE_SIZE)
+        if new:
+            # Must precede journal_mode=WAL, which writes the file header.
+            # run_maintenance() converts databases created without it.
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
         return conn
     except Exception as e:
         logger.error(f"Error connecting to database: {e}")
         raise
 
+def get_connection():
+    """Get the long-lived connection for the current thread.
+
+    The connection is opened on first use and reused afterwards, so the
+    schema and compiled statements stay cached between calls.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = create_connection()
+        _local.conn = conn
+        logger.debug(f"Opened database connection for thread {threading.current_thread().name}")
+    return conn
+
+def close_connection():
+    """Close the current thread's connection, if any"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+def start_engine(**kwargs):
+    """Serve queue operations from an in-memory QueueEngine.
+
+    Only the process that owns queue.db should do this: the engine keeps
+    the authoritative state in memory and writes it back in batches.
+    """
+    global _engine
+    from queue_engine import QueueEngine
+    if _engine is None:
+        _engine = QueueEngine(**kwargs)
+        _engine.start()
+        logger.info("Queue engine started")
+    return _engine
+
+def stop_engine():
+    """Flush and stop the in-memory QueueEngine, if running"""
+    global _engine
+    if _engine is not None:
+        _engine.stop()
+        _engine = None
+        logger.info("Queue engine stopped")
+
 def init_database():
     """Initialize database with tables and default data"""
-    conn = create_connection()
+    conn = get_connection()
     cursor = conn.cursor()
     
     logger.info("Creating database tables...")
@@ -46,58 +142,168 @@ def init_database():
         status TEXT DEFAULT 'waiting',
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         called_at TIMESTAMP,
+        priority INTEGER NOT NULL DEFAULT 0,
+        appointment_at TIMESTAMP,
         FOREIGN KEY (counter_id) REFERENCES counter(id)
     )
     ''')
     
-    # Load configuration
+    migrate_schema(cursor)
+    
+    conn.commit()
+    
+    # Bring the counter table in line with the configuration
+    sync_counters()
+    logger.info("Database initialization completed")
+
+def sync_counters():
+    """Reconcile the counter table with the configured counters.
+
+    Counters are named "Loket <code><n>". Missing ones are inserted,
+    deactivated ones that are configured again are reactivated, and active
+    ones that are no longer configured are deactivated. A row of the right
+    service with a name that is not configured is renamed before a new one
+    is inserted. Everything runs in one transaction. Returns a summary of
+    the changes.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    changes = {'added': [], 'renamed': [], 'reactivated': [], 'deactivated': []}
+    
     try:
-        with open('queue_config.json', 'r') as f:
-            config = json.load(f)
-            
-        # Insert counters from configuration if they don't exist
-        cursor.execute("SELECT COUNT(*) FROM counter")
-        count = cursor.fetchone()[0]
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT id, name, service_code, status FROM counter ORDER BY id')
+        rows = cursor.fetchall()
         
-        if count == 0:
-            logger.info("Adding counters from configuration...")
-            counter_list = []
-            
-            for service_code, count in config['counters'].items():
-                for i in range(1, count + 1):
-                    counter_name = f"Loket {service_code}{i}"
-                    counter_list.append((counter_name, service_code))
+        configured = get_counter_counts()
+        for service_code in sorted(set(configured) | {row[2] for row in rows}):
+            wanted = [f"Loket {service_code}{i}" for i in range(1, configured.get(service_code, 0) + 1)]
+            existing = [row for row in rows if row[2] == service_code]
+            by_name = {row[1]: row for row in existing}
+            # Spare rows can be renamed, active ones first
+            spare = sorted((row for row in existing if row[1] not in wanted),
+                           key=lambda row: (row[3] != 1, row[0]))
             
-            cursor.executemany(
-                'INSERT INTO counter (name, service_code) VALUES (?, ?)',
-                counter_list
-            )
-            logger.info(f"Added {len(counter_list)} counters from configuration")
+            for name in wanted:
+                row = by_name.get(name)
+                if row is None and spare:
+                    row = spare.pop(0)
+                    cursor.execute('UPDATE counter SET name = ?, status = 1 WHERE id = ?', (name, row[0]))
+                    changes['renamed'].append((row[1], name))
+                elif row is None:
+                    cursor.execute('INSERT INTO counter (name, service_code) VALUES (?, ?)',
+                                   (name, service_code))
+                    changes['added'].append(name)
+                elif row[3] != 1:
+                    cursor.execute('UPDATE counter SET status = 1 WHERE id = ?', (row[0],))
+                    changes['reactivated'].append(name)
             
-    except FileNotFoundError:
-        logger.warning("queue_config.json not found, using default configuration")
-        # Insert default counters if config not found
-        default_counters = [
-            ('Loket A1', 'A'),
-            ('Loket B1', 'B')
-        ]
-        cursor.executemany(
-            'INSERT INTO counter (name, service_code) VALUES (?, ?)',
-            default_counters
-        )
-        logger.info("Added default counters")
+            for row in spare:
+                if row[3] == 1:
+                    cursor.execute('UPDATE counter SET status = 0 WHERE id = ?', (row[0],))
+                    changes['deactivated'].append(row[1])
+        
+        conn.commit()
     except Exception as e:
-        logger.error(f"Error initializing counters: {e}")
+        logger.error(f"Error syncing counters: {e}")
+        conn.rollback()
         raise
     
-    conn.commit()
-    conn.close()
-    logger.info("Database initialization completed")
+    if any(changes.values()):
+        logger.info(f"Synced counters with configuration: {changes}")
+        if _engine:
+            _engine.reload_counters()
+    return changes
+
+def migrate_schema(cursor):
+    """Bring an existing queue table up to date and create lookup indexes"""
+    # Older builds never filled in service_code, derive it from the number
+    cursor.execute('''
+        UPDATE queue SET service_code = substr(number, 1, 1)
+        WHERE service_code IS NULL OR service_code = ''
+    ''')
+    if cursor.rowcount > 0:
+        logger.info(f"Backfilled service_code on {cursor.rowcount} queue rows")
+    
+    # Priority tickets and appointments, see create_new_number()
+    add_column(cursor, 'queue', 'priority', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(cursor, 'queue', 'appointment_at', 'TIMESTAMP')
+    
+    # Waiting/next lookups per service in claim order, and called history
+    # per counter. appointment_at makes the claim lookup covering, so
+    # appointments that are not due yet are skipped without a row fetch.
+    cursor.execute('DROP INDEX IF EXISTS idx_queue_service_status')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_queue_service_priority
+        ON queue (service_code, status, priority DESC, id, appointment_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_queue_counter_status
+        ON queue (counter_id, status, id)
+    ''')
+    
+    # Per-service ticket sequence, seeded from the highest issued number
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS queue_sequence (
+        service_code TEXT PRIMARY KEY,
+        last_value INTEGER NOT NULL,
+        seq_date TEXT NOT NULL DEFAULT ''
+    )
+    ''')
+    # The business date of the last ticket, see business_date()
+    hour, minute = get_rollover_time()
+    seq_date = (f"date(MAX(created_at), 'localtime', '-{hour} hours', '-{minute} minutes')"
+                if get_daily_reset() else "''")
+    cursor.execute(f'''
+        INSERT OR IGNORE INTO queue_sequence (service_code, last_value, seq_date)
+        SELECT service_code, MAX(CAST(substr(number, 2) AS INTEGER)), {seq_date}
+        FROM queue
+        GROUP BY service_code
+    ''')
+    
+    # Tickets of closed days, see archive_closed_days()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS queue_archive (
+        id INTEGER PRIMARY KEY,
+        number TEXT NOT NULL,
+        service_code TEXT NOT NULL,
+        counter_id INTEGER,
+        status TEXT,
+        created_at TIMESTAMP,
+        called_at TIMESTAMP,
+        archive_month TEXT NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 0,
+        appointment_at TIMESTAMP
+    )
+    ''')
+    add_column(cursor, 'queue_archive', 'priority', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(cursor, 'queue_archive', 'appointment_at', 'TIMESTAMP')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_queue_archive_month
+        ON queue_archive (archive_month, service_code)
+    ''')
+    
+    # Queue days that were rolled over, newest last
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS queue_rollover (
+        business_date TEXT PRIMARY KEY,
+        archived INTEGER NOT NULL,
+        expired INTEGER NOT NULL,
+        finished_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+def add_column(cursor, table, column, definition):
+    """Add a column to an existing table unless it is already there"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        logger.info(f"Added column {table}.{column}")
 
 def get_counter_list():
     """Get list of all active counters"""
     try:
-        conn = create_connection()
+        conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -125,89 +331,215 @@ def get_counter_list():
     except Exception as e:
         logger.error(f"Error getting counter list: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
+
+# Waiting tickets that may be called now, appointments only from their time
+CLAIMABLE = "(appointment_at IS NULL OR appointment_at <= CURRENT_TIMESTAMP)"
+
+# Appointments still to come at the archive cutoff, bound as a parameter
+BOOKED = "(status = 'waiting' AND appointment_at IS NOT NULL AND appointment_at >= ?)"
+
+def counter_label(name):
+    """Get the config label of a counter from its name, e.g. Loket A1 -> A1"""
+    return name.split(' ')[-1]
+
+def get_scheduler():
+    """Get the shared Scheduler, recreated when the dispatch policy changes"""
+    global _scheduler
+    policy = get_dispatch_policy()
+    if _scheduler is None or _scheduler.policy != policy:
+        _scheduler = Scheduler(policy)
+    return _scheduler
+
+def pick_service(cursor, counter_id, weights):
+    """Choose the service a counter serves next from the waiting lines.
+
+    Each line costs one indexed lookup of its first claimable ticket, the
+    lines are only counted for the longest_queue policy. Without the
+    QueueEngine this runs on every claim, the engine keeps a heap per
+    service in memory and picks in O(log n).
+    """
+    if len(weights) == 1:
+        return next(iter(weights))
+    
+    scheduler = get_scheduler()
+    codes = [code for code, weight in weights.items() if weight > 0]
+    counts = None
+    if scheduler.policy == LONGEST_QUEUE and codes:
+        cursor.execute(f'''
+            SELECT service_code, COUNT(*) FROM queue
+            WHERE service_code IN ({', '.join('?' * len(codes))})
+            AND status = 'waiting' AND {CLAIMABLE}
+            GROUP BY service_code
+        ''', codes)
+        counts = dict(cursor.fetchall())
+    queues = {}
+    for service_code in codes:
+        if counts is not None and not counts.get(service_code):
+            continue
+        cursor.execute(f'''
+            SELECT priority, id FROM queue
+            WHERE service_code = ? AND status = 'waiting' AND {CLAIMABLE}
+            ORDER BY priority DESC, id ASC
+            LIMIT 1
+        ''', (service_code,))
+        head = cursor.fetchone()
+        if head:
+            # Only longest_queue looks at the length, the others need a
+            # non-empty line
+            count = counts[service_code] if counts is not None else 1
+            queues[service_code] = (count, (-head[0], head[1]))
+    return scheduler.pick(counter_id, weights, queues)
+
+def claim_next_number(conn, counter_id, service_code):
+    """Atomically mark the next waiting ticket of a service as called.
+
+    Tickets go by priority, then by arrival; appointments are skipped until
+    their time. The lookup walks idx_queue_service_priority in order.
+    The select and the update run as one statement keyed on the row id, so
+    two counters can never claim the same ticket. Retries with exponential
+    backoff if the database stays locked past the busy timeout.
+    """
+    delay = CLAIM_BACKOFF
+    for attempt in range(CLAIM_RETRIES):
+        try:
+            cursor = conn.execute(f'''
+                UPDATE queue
+                SET status = 'called', counter_id = ?, called_at = CURRENT_TIMESTAMP
+                WHERE id = (
+                    SELECT id FROM queue
+                    WHERE service_code = ? AND status = 'waiting' AND {CLAIMABLE}
+                    ORDER BY priority DESC, id ASC
+                    LIMIT 1
+                )
+                RETURNING number
+            ''', (counter_id, service_code))
+            row = cursor.fetchone()
+            conn.commit()
+            return row[0] if row else None
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            if 'locked' not in str(e) and 'busy' not in str(e):
+                raise
+            logger.warning(f"Database busy claiming for counter {counter_id}, retry {attempt + 1}")
+            time.sleep(delay)
+            delay *= 2
+    raise sqlite3.OperationalError(f"database still locked after {CLAIM_RETRIES} claim attempts")
 
 def get_next_number(counter_id):
     """Get next waiting number for a specific counter"""
+    if _engine:
+        return _engine.claim(counter_id)
+    
+    conn = get_connection()
     try:
-        conn = create_connection()
-        if not conn:
-            logger.error("Failed to create database connection")
-            return None
-            
         cursor = conn.cursor()
         
-        # Get the service code for this counter
-        cursor.execute("SELECT service_code FROM counter WHERE id = ?", (counter_id,))
+        # Get the services this counter serves
+        cursor.execute("SELECT name, service_code FROM counter WHERE id = ?", (counter_id,))
         result = cursor.fetchone()
         if not result:
             logger.error(f"Counter ID {counter_id} not found")
             return None
-            
-        service_code = result[0]
-        logger.debug(f"Found service code {service_code} for counter {counter_id}")
         
-        # Get the next waiting number for this service
-        cursor.execute("""
-            SELECT number 
-            FROM queue 
-            WHERE number LIKE ? AND status = 'waiting'
-            ORDER BY id ASC 
-            LIMIT 1
-        """, (f"{service_code}%",))
+        weights = get_counter_services(counter_label(result[0]), result[1])
+        logger.debug(f"Counter {counter_id} serves {weights}")
         
-        result = cursor.fetchone()
-        if result:
-            number = result[0]
-            logger.debug(f"Found next number: {number}")
-            
-            # Update the status and counter_id
-            cursor.execute("""
-                UPDATE queue 
-                SET status = 'called', counter_id = ?, called_at = CURRENT_TIMESTAMP
-                WHERE number = ?
-            """, (counter_id, number))
-            
-            conn.commit()
-            logger.info(f"Updated number {number} status to 'called' for counter {counter_id}")
-            return number
-        else:
-            logger.debug(f"No waiting numbers found for service {service_code}")
-            return None
+        # Another counter may take the last ticket of the chosen line first
+        for _ in range(len(weights)):
+            service_code = pick_service(cursor, counter_id, weights)
+            if service_code is None:
+                break
+            number = claim_next_number(conn, counter_id, service_code)
+            if number:
+                logger.info(f"Updated number {number} status to 'called' for counter {counter_id}")
+                return number
+        
+        logger.debug(f"No waiting numbers found for counter {counter_id}")
+        return None
             
     except Exception as e:
         logger.error(f"Error in get_next_number: {e}")
-        if conn:
-            conn.rollback()
+        conn.rollback()
         return None
-    finally:
-        if conn:
-            conn.close()
 
-def create_new_number(service_code):
-    """Create a new queue number for a service"""
-    conn = create_connection()
+def next_sequence_value(cursor, service_code):
+    """Advance the ticket sequence for a service and return the new value.
+
+    Must run inside a write transaction. The sequence restarts at 1 when
+    daily reset is enabled and the stored date is not the current
+    business day.
+    """
+    seq_date = business_date().isoformat() if get_daily_reset() else ''
+    cursor.execute('''
+        INSERT INTO queue_sequence (service_code, last_value, seq_date)
+        VALUES (?, 1, ?)
+        ON CONFLICT (service_code) DO UPDATE SET
+            last_value = CASE WHEN seq_date = excluded.seq_date
+                              THEN last_value + 1 ELSE 1 END,
+            seq_date = excluded.seq_date
+        RETURNING last_value
+    ''', (service_code, seq_date))
+    return cursor.fetchone()[0]
+
+def business_date(now=None):
+    """Get the queue day a local time belongs to.
+
+    Queue days start at the configured rollover time, so with 05:00 a
+    ticket taken at 02:00 still counts towards the previous day.
+    """
+    hour, minute = get_rollover_time()
+    return ((now or datetime.now()) - timedelta(hours=hour, minutes=minute)).date()
+
+def business_day_start(day):
+    """Get the UTC timestamp, in SQLite's format, at which a queue day starts"""
+    hour, minute = get_rollover_time()
+    start = datetime.combine(day, dt_time(hour, minute)).astimezone(timezone.utc)
+    return start.strftime('%Y-%m-%d %H:%M:%S')
+
+def last_ticket_id(cursor):
+    """Get the highest ticket id ever issued, archived tickets included.
+
+    queue.id is a plain INTEGER PRIMARY KEY, so SQLite would reuse ids once
+    a rollover emptied the queue table; new tickets continue from here.
+    """
+    cursor.execute('''
+        SELECT MAX((SELECT COALESCE(MAX(id), 0) FROM queue),
+                   (SELECT COALESCE(MAX(id), 0) FROM queue_archive))
+    ''')
+    return cursor.fetchone()[0]
+
+def format_number(service_code, num):
+    """Format a ticket number, e.g. ('A', 5) -> 'A005'"""
+    return f"{service_code}{num:0{get_number_width()}d}"
+
+def utc_timestamp(value):
+    """Convert a local datetime to SQLite's UTC text format, None stays None"""
+    if value is None:
+        return None
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def create_new_number(service_code, priority=PRIORITY_NORMAL, appointment_at=None):
+    """Create a new queue number for a service.
+
+    Higher priority tickets are called first. A ticket with an appointment
+    datetime (local time) becomes an appointment ticket: it is called
+    ahead of the others, but not before its time.
+    """
+    if appointment_at is not None:
+        priority = max(priority, PRIORITY_APPOINTMENT)
+    appointment_at = utc_timestamp(appointment_at)
+    if _engine:
+        return _engine.issue(service_code, priority, appointment_at)
+    
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
-        # Get the last number for this service
-        cursor.execute('''
-            SELECT number FROM queue 
-            WHERE number LIKE ?
-            ORDER BY id DESC LIMIT 1
-        ''', (f"{service_code}%",))
+        # Take the write lock up front so concurrent kiosks serialize here
+        cursor.execute('BEGIN IMMEDIATE')
         
-        last_number = cursor.fetchone()
-        if last_number:
-            # Extract the numeric part and increment
-            num = int(last_number[0][1:]) + 1
-        else:
-            num = 1
-        
-        # Format new number (e.g., A001)
-        new_number = f"{service_code}{num:03d}"
+        num = next_sequence_value(cursor, service_code)
+        new_number = format_number(service_code, num)
         
         # Get counter ID for this service
         cursor.execute('''
@@ -220,98 +552,286 @@ def create_new_number(service_code):
         
         # Insert new number into queue
         cursor.execute('''
-            INSERT INTO queue (number, counter_id, status)
-            VALUES (?, ?, 'waiting')
-        ''', (new_number, counter_id))
+            INSERT INTO queue (id, number, service_code, counter_id, status, priority, appointment_at)
+            VALUES (?, ?, ?, ?, 'waiting', ?, ?)
+        ''', (last_ticket_id(cursor) + 1, new_number, service_code, counter_id, priority, appointment_at))
         
         conn.commit()
         return new_number
-    finally:
-        conn.close()
+    except Exception:
+        conn.rollback()
+        raise
 
 def get_queue_stats(service_code):
     """Get total and next queue numbers for a service"""
-    conn = create_connection()
+    if _engine:
+        return _engine.stats(service_code)
+    
+    conn = get_connection()
     cursor = conn.cursor()
     
     # Get total queue count
     cursor.execute('''
         SELECT COUNT(*) FROM queue 
-        WHERE counter_id IN (
-            SELECT id FROM counter WHERE service_code = ?
-        )
+        WHERE service_code = ?
     ''', (service_code,))
     total = cursor.fetchone()[0]
     
     # Get next number in queue
-    cursor.execute('''
+    cursor.execute(f'''
         SELECT number FROM queue 
-        WHERE counter_id IN (
-            SELECT id FROM counter WHERE service_code = ?
-        )
-        AND status = 'waiting'
-        ORDER BY id LIMIT 1
+        WHERE service_code = ? AND status = 'waiting' AND {CLAIMABLE}
+        ORDER BY priority DESC, id LIMIT 1
     ''', (service_code,))
     next_row = cursor.fetchone()
     next_number = next_row[0] if next_row else None
     
-    conn.close()
     return total, next_number
 
+def get_service_stats():
+    """Get issued total and waiting numbers for every service.
+
+    Waiting numbers are in claim order, followed by the appointments that
+    are not due yet in order of their time. 'priorities' maps the numbers
+    of priority tickets to their priority.
+    """
+    if _engine:
+        return _engine.service_stats()
+    
+    cursor = get_connection().cursor()
+    stats = {}
+    
+    cursor.execute('SELECT service_code, COUNT(*) FROM queue GROUP BY service_code')
+    for service_code, total in cursor.fetchall():
+        stats[service_code] = {'total': total, 'waiting': [], 'priorities': {}}
+    
+    cursor.execute(f'''
+        SELECT service_code, number, priority FROM queue 
+        WHERE status = 'waiting'
+        ORDER BY NOT {CLAIMABLE}, CASE WHEN {CLAIMABLE} THEN NULL ELSE appointment_at END,
+                 priority DESC, id ASC
+    ''')
+    for service_code, number, priority in cursor.fetchall():
+        service = stats.setdefault(service_code, {'total': 0, 'waiting': [], 'priorities': {}})
+        service['waiting'].append(number)
+        if priority:
+            service['priorities'][number] = priority
+    
+    return stats
+
+def get_current_numbers():
+    """Get the number each active counter called last in the current queue day.
+
+    Returns (counter_id, counter_name, service_code, number) tuples, number
+    is None for counters that have not called anyone yet.
+    """
+    if _engine:
+        _engine.flush()
+    
+    cursor = get_connection().cursor()
+    cursor.execute('''
+        SELECT c.id, c.name, c.service_code, (
+            SELECT q.number FROM queue q
+            WHERE q.counter_id = c.id AND q.status = 'called'
+            AND q.called_at >= ?
+            ORDER BY q.id DESC LIMIT 1
+        )
+        FROM counter c
+        WHERE c.status = 1
+        ORDER BY c.id
+    ''', (business_day_start(business_date()),))
+    return cursor.fetchall()
+
+def get_calls_since(since):
+    """Get (service_code, counter_id, called_at) of the calls since a UTC
+    timestamp, oldest first"""
+    if _engine:
+        _engine.flush()
+    
+    cursor = get_connection().cursor()
+    cursor.execute('''
+        SELECT service_code, counter_id, called_at FROM queue
+        WHERE status = 'called' AND called_at >= ?
+        ORDER BY called_at, id
+    ''', (since,))
+    return cursor.fetchall()
+
 def get_queue_list(counter_id, limit=10):
-    """Get list of called and upcoming queue numbers for a counter"""
-    conn = create_connection()
-    cursor = conn.cursor()
+    """Get list of called and upcoming queue numbers for a counter.
+
+    Upcoming numbers come from every service the counter serves, merged
+    by priority and arrival. That is the order it claims them in under
+    the oldest_wait policy; the other policies may interleave the
+    services differently.
+    """
+    if _engine:
+        return _engine.queue_list(counter_id, limit)
     
-    try:
-        # Get counter's service code
-        cursor.execute('SELECT service_code FROM counter WHERE id = ?', (counter_id,))
-        service_code = cursor.fetchone()[0]
-        
-        # Get recently called numbers
-        cursor.execute('''
-            SELECT number, status, created_at 
-            FROM queue 
-            WHERE counter_id = ? AND status = 'called'
-            ORDER BY id DESC LIMIT ?
-        ''', (counter_id, limit))
-        called_numbers = cursor.fetchall()
-        
-        # Get upcoming numbers for this service
-        cursor.execute('''
-            SELECT number, created_at 
+    cursor = get_connection().cursor()
+    
+    # Get the services this counter serves
+    cursor.execute('SELECT name, service_code FROM counter WHERE id = ?', (counter_id,))
+    name, service_code = cursor.fetchone()
+    weights = get_counter_services(counter_label(name), service_code)
+    
+    # Get recently called numbers
+    cursor.execute('''
+        SELECT number, status, created_at 
+        FROM queue 
+        WHERE counter_id = ? AND status = 'called'
+        ORDER BY id DESC LIMIT ?
+    ''', (counter_id, limit))
+    called_numbers = cursor.fetchall()
+    
+    # Get the first upcoming numbers of each service, appointments once
+    # they are due, and merge them
+    lines = []
+    for code, weight in weights.items():
+        if weight <= 0:
+            continue
+        cursor.execute(f'''
+            SELECT -priority, id, number, created_at 
             FROM queue 
-            WHERE number LIKE ? 
-            AND status = 'waiting'
-            ORDER BY id ASC LIMIT ?
-        ''', (f"{service_code}%", limit))
-        upcoming_numbers = cursor.fetchall()
-        
-        return called_numbers, upcoming_numbers
-    finally:
-        conn.close()
+            WHERE service_code = ? 
+            AND status = 'waiting' AND {CLAIMABLE}
+            ORDER BY priority DESC, id ASC LIMIT ?
+        ''', (code, limit))
+        lines.append(cursor.fetchall())
+    upcoming_numbers = [(number, created_at) for _, _, number, created_at
+                        in itertools.islice(heapq.merge(*lines), limit)]
+    
+    return called_numbers, upcoming_numbers
 
 def has_waiting_numbers(counter_id):
-    """Check if there are waiting numbers for this counter's service"""
-    conn = create_connection()
+    """Check if there are waiting numbers for any service this counter serves"""
+    if _engine:
+        return _engine.has_waiting(counter_id)
+    
+    cursor = get_connection().cursor()
+    
+    # Get counter's services
+    cursor.execute('SELECT name, service_code FROM counter WHERE id = ?', (counter_id,))
+    name, service_code = cursor.fetchone()
+    weights = get_counter_services(counter_label(name), service_code)
+    
+    # Check for numbers that could be claimed now
+    for service_code, weight in weights.items():
+        if weight <= 0:
+            continue
+        cursor.execute(f'''
+            SELECT 1 FROM queue 
+            WHERE service_code = ? 
+            AND status = 'waiting' AND {CLAIMABLE}
+            LIMIT 1
+        ''', (service_code,))
+        if cursor.fetchone():
+            return True
+    return False
+
+def archive_closed_days(cutoff, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """Move tickets created before cutoff from queue to queue_archive.
+
+    cutoff is a UTC timestamp as returned by business_day_start(). Tickets
+    still waiting from those days can no longer be served and are archived
+    as 'expired', except appointments booked for cutoff or later, which
+    stay in the queue. Rows move in id ranges of chunk_size, one transaction
+    each, so counters and kiosks only wait for a single chunk. With the
+    queue engine running, issuing and claiming pause for the whole run.
+    Returns (archived, expired) row counts.
+    """
+    if _engine:
+        return _engine.run_exclusive(_archive_closed_days, cutoff, chunk_size)
+    return _archive_closed_days(cutoff, chunk_size)
+
+def _archive_closed_days(cutoff, chunk_size):
+    conn = get_connection()
     cursor = conn.cursor()
     
-    try:
-        # Get counter's service code
-        cursor.execute('SELECT service_code FROM counter WHERE id = ?', (counter_id,))
-        service_code = cursor.fetchone()[0]
-        
-        # Check for waiting numbers
-        cursor.execute('''
-            SELECT COUNT(*) FROM queue 
-            WHERE number LIKE ? 
-            AND status = 'waiting'
-        ''', (f"{service_code}%",))
-        
-        count = cursor.fetchone()[0]
-        return count > 0
-    finally:
-        conn.close()
+    # Ids grow with created_at, so everything up to this id is archived,
+    # except appointments booked for a slot that is still to come
+    cursor.execute('SELECT MIN(id), MAX(id) FROM queue WHERE created_at < ?', (cutoff,))
+    first_id, last_id = cursor.fetchone()
+    if last_id is None:
+        return 0, 0
+    
+    archived = expired = 0
+    start_id = first_id - 1
+    while start_id < last_id:
+        end_id = min(start_id + chunk_size, last_id)
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            # Ids are never reused, a collision is a bug and must fail
+            cursor.execute(f'''
+                INSERT INTO queue_archive
+                    (id, number, service_code, counter_id, status, created_at, called_at,
+                     archive_month, priority, appointment_at)
+                SELECT id, number, service_code, counter_id,
+                       CASE WHEN status = 'waiting' THEN 'expired' ELSE status END,
+                       created_at, called_at, strftime('%Y-%m', created_at, 'localtime'),
+                       priority, appointment_at
+                FROM queue
+                WHERE id > ? AND id <= ? AND NOT {BOOKED}
+            ''', (start_id, end_id, cutoff))
+            archived += cursor.rowcount
+            cursor.execute(f'''
+                SELECT COUNT(*) FROM queue
+                WHERE id > ? AND id <= ? AND status = 'waiting' AND NOT {BOOKED}
+            ''', (start_id, end_id, cutoff))
+            expired += cursor.fetchone()[0]
+            cursor.execute(f'DELETE FROM queue WHERE id > ? AND id <= ? AND NOT {BOOKED}',
+                           (start_id, end_id, cutoff))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Error archiving queue rows {start_id + 1}-{end_id}: {e}")
+            conn.rollback()
+            raise
+        start_id = end_id
+    
+    logger.info(f"Archived {archived} tickets created before {cutoff} UTC, {expired} expired")
+    return archived, expired
+
+def run_maintenance(vacuum_pages=VACUUM_PAGES):
+    """Return free pages to the filesystem and refresh planner statistics.
+
+    Databases created before incremental auto-vacuum was enabled are
+    converted once with a full VACUUM. After that every run frees at most
+    vacuum_pages pages, so it never blocks writers for long.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('PRAGMA auto_vacuum')
+    if cursor.fetchone()[0] != 2:
+        logger.info("Enabling incremental auto-vacuum, running a one-time VACUUM")
+        cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        cursor.execute('VACUUM')
+    
+    cursor.execute('PRAGMA freelist_count')
+    free_pages = cursor.fetchone()[0]
+    if free_pages:
+        cursor.execute(f'PRAGMA incremental_vacuum({int(vacuum_pages)})')
+        cursor.fetchall()
+    
+    # Bounded ANALYZE of the tables whose statistics are stale
+    cursor.execute('PRAGMA analysis_limit=1000')
+    cursor.execute('PRAGMA optimize')
+    conn.commit()
+    logger.info(f"Database maintenance done, {min(free_pages, vacuum_pages)} of {free_pages} free pages released")
+
+def get_last_rollover():
+    """Get the business date (ISO string) of the last rollover, or None"""
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT MAX(business_date) FROM queue_rollover')
+    return cursor.fetchone()[0]
+
+def record_rollover(day, archived, expired):
+    """Remember that the queue days before day have been rolled over"""
+    conn = get_connection()
+    conn.execute('''
+        INSERT OR REPLACE INTO queue_rollover (business_date, archived, expired)
+        VALUES (?, ?, ?)
+    ''', (day.isoformat(), archived, expired))
+    conn.commit()
 
 if __name__ == '__main__':
     init_database()
@@ -1,9 +1,10 @@
+import sys
 import tkinter as tk
 from tkinter import ttk
-import asyncio
-import websockets
-import json
-from threading import Thread
+import protocol
+from websocket_client import WebSocketClient
+from ui_tasks import UIDispatcher
+from wait_estimator import format_eta
 import logging
 from datetime import datetime
 
@@ -34,8 +35,10 @@ class CounterDisplay(tk.Frame):
         self.number_var.set(str(number))
 
 class QueueDisplay:
-    def __init__(self, root):
+    def __init__(self, root, services=None):
         self.root = root
+        # Only show these service codes, None shows every service
+        self.services = services
         self.root.title('Queue Display')
         
         # Make it fullscreen
@@ -67,9 +70,21 @@ class QueueDisplay:
         # Dictionary to store counter frames
         self.counter_frames = {}
 
-        # Start websocket connection
-        self.ws_thread = Thread(target=self.start_websocket_client, daemon=True)
-        self.ws_thread.start()
+        # Updates from the client thread are applied once per frame
+        self.dispatcher = UIDispatcher(root)
+
+        # Connect to the server on the shared client's background loop
+        topics = None
+        if services:
+            topics = [f"service:{code}" for code in services]
+            topics += ['type:config_changed', 'type:day_rollover']
+        self.ws_client = WebSocketClient(
+            topics=topics,
+            encoding=protocol.BINARY,  # events as compact binary frames
+            sync=True)                 # snapshot on connect, replay on reconnect
+        self.ws_client.add_message_handler(self.on_events, batch=True)
+        self.ws_client.add_status_handler(self.on_status)
+        self.ws_client.start()
 
     def toggle_fullscreen(self, event=None):
         self.root.attributes('-fullscreen', not self.root.attributes('-fullscreen'))
@@ -77,59 +92,94 @@ class QueueDisplay:
     def end_fullscreen(self, event=None):
         self.root.attributes('-fullscreen', False)
 
-    def start_websocket_client(self):
-        asyncio.run(self.websocket_client())
-
-    async def websocket_client(self):
-        uri = "ws://localhost:8765"
-        while True:
-            try:
-                async with websockets.connect(uri) as websocket:
-                    logger.info("Connected to WebSocket server")
-                    self.status_var.set("Terhubung")
-                    
-                    while True:
-                        try:
-                            message = await websocket.recv()
-                            logger.debug(f"Received message: {message}")
-                            data = json.loads(message)
-                            
-                            # Update display in the main thread
-                            self.root.after(0, self.update_display, 
-                                          data['counter_id'], 
-                                          data['number'],
-                                          data.get('counter_name', f"Counter {data['counter_id']}"))
-                        except json.JSONDecodeError as e:
-                            logger.error(f"Invalid JSON received: {e}")
-                        except Exception as e:
-                            logger.error(f"Error processing message: {e}")
-                            break
-                            
-            except Exception as e:
-                logger.error(f"WebSocket connection error: {e}")
-                self.status_var.set("Terputus - Mencoba menghubungkan kembali...")
-                await asyncio.sleep(5)  # Wait before reconnecting
-
-    def update_display(self, counter_id, number, counter_name):
+    async def on_events(self, events):
+        # Runs on the client thread, only the newest event per counter
+        # and per service is applied when the board falls behind
+        for data in events:
+            msg_type = data.get('type')
+            if msg_type == 'call_number':
+                key = ('counter', data.get('counter_id'))
+            elif msg_type == 'new_number':
+                key = ('service', data.get('service_code'))
+            elif msg_type in ('config_changed', 'day_rollover'):
+                key = ('config',)
+            else:
+                key = None
+            self.dispatcher.post(self.handle_message, data, key=key)
+
+    def on_status(self, connected):
+        status = "Terhubung" if connected else "Terputus - Mencoba menghubungkan kembali..."
+        self.dispatcher.set_var(self.status_var, status)
+
+    def handle_message(self, data):
+        msg_type = data.get('type')
+        if msg_type == 'call_number':
+            self.update_display(data['counter_id'],
+                                data['number'],
+                                data.get('counter_name', f"Counter {data['counter_id']}"),
+                                data)
+        elif msg_type == 'new_number':
+            self.update_stats(data)
+        elif msg_type == 'snapshot':
+            self.apply_snapshot(data)
+        elif msg_type in ('config_changed', 'day_rollover'):
+            # Counters changed or a new queue day started, ask for a fresh board
+            self.ws_client.send_nowait({'type': 'sync'})
+
+    def apply_snapshot(self, data):
+        """Show the full board state sent by the server.
+
+        The snapshot lists every active counter, frames of counters that
+        are no longer in it are removed.
+        """
+        counter_ids = {counter['counter_id'] for counter in data.get('counters', [])}
+        removed = [counter_id for counter_id in self.counter_frames if counter_id not in counter_ids]
+        for counter_id in removed:
+            self.counter_frames.pop(counter_id)['frame'].destroy()
+        if removed:
+            self.layout_counters()
+        for counter in data.get('counters', []):
+            self.update_display(counter['counter_id'],
+                                counter['number'] or '-',
+                                counter['counter_name'])
+        for service_code, stats in data.get('services', {}).items():
+            self.update_stats(dict(stats, service_code=service_code))
+
+    def update_display(self, counter_id, number, counter_name, data=None):
         try:
             if counter_id not in self.counter_frames:
                 self.create_counter_display(counter_id, counter_name)
             
             counter_frame = self.counter_frames[counter_id]
+            if counter_frame['frame'].cget('text') != counter_name:
+                counter_frame['frame'].configure(text=counter_name)
             counter_frame['number_var'].set(str(number))
             
-            # Update queue stats
-            from database import get_queue_stats
-            service_code = counter_name.split(' ')[-1][0]  # Get first letter of counter name
-            total, next_number = get_queue_stats(service_code)
-            
-            counter_frame['total_var'].set(f"Total: {total}")
-            counter_frame['next_var'].set(f"Berikutnya: {next_number or '-'}")
+            # Queue stats are pushed by the server with every event
+            if data:
+                self.update_stats(data)
             
             logger.debug(f"Updated display for counter {counter_id} with number {number}")
         except Exception as e:
             logger.error(f"Error updating display: {e}")
 
+    def update_stats(self, data):
+        """Apply the server's running totals to every counter of the service"""
+        if 'total' not in data:
+            return
+        service_code = data.get('service_code')
+        for counter_frame in self.counter_frames.values():
+            if counter_frame['service_code'] == service_code:
+                counter_frame['total_var'].set(f"Total: {data['total']}")
+                counter_frame['next_var'].set(f"Berikutnya: {data.get('next_number') or '-'}")
+                counter_frame['eta_var'].set(f"Estimasi tunggu: {format_eta(data.get('eta'))}")
+
+    def layout_counters(self):
+        """Grid the counter frames two per row in counter order"""
+        for i, counter_id in enumerate(sorted(self.counter_frames)):
+            self.counter_frames[counter_id]['frame'].grid(
+                row=i // 2, column=i % 2, padx=10, pady=10, sticky='nsew')
+
     def create_counter_display(self, counter_id, counter_name):
         try:
             if counter_id in self.counter_frames:
@@ -165,12 +215,19 @@ class QueueDisplay:
                      font=('Helvetica', 12)).pack(side='left', padx=5)
             ttk.Label(stats_frame, textvariable=next_var,
                      font=('Helvetica', 12)).pack(side='right', padx=5)
+            
+            # Predicted wait for a ticket taken now
+            eta_var = tk.StringVar(value="Estimasi tunggu: -")
+            ttk.Label(frame, textvariable=eta_var,
+                     font=('Helvetica', 12)).pack(pady=(0, 5))
 
             self.counter_frames[counter_id] = {
+                'service_code': counter_name.split(' ')[-1][0],  # "Loket A1" -> "A"
                 'frame': frame,
                 'number_var': number_var,
                 'total_var': total_var,
-                'next_var': next_var
+                'next_var': next_var,
+                'eta_var': eta_var
             }
             logger.debug(f"Created new counter display for {counter_name}")
         except Exception as e:
@@ -178,5 +235,6 @@ class QueueDisplay:
 
 if __name__ == '__main__':
     root = tk.Tk()
-    app = QueueDisplay(root)
+    # Optional service codes to show, e.g. "python display.py B"
+    app = QueueDisplay(root, sys.argv[1:] or None)
     root.mainloop()
@@ -1,13 +1,14 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-import json
 import logging
 import asyncio
 import os
-from database import create_connection, get_next_number, init_database
-from config import get_counter_list
+from database import create_connection
+from config import get_service_list
 from audio_manager import AudioManager
 from websocket_client import WebSocketClient
+from remote_queue import get_queue, RemoteQueue
+from ui_tasks import UIExecutor, UIDispatcher
 
 # Configure logging
 logging.basicConfig(
@@ -16,6 +17,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger('MainGUI')
 
+# Milliseconds between attempts to load the counters while the queue
+# server cannot be reached
+COUNTER_RETRY_MS = 5000
+
 class CounterManager(tk.Toplevel):
     def __init__(self, parent):
         super().__init__(parent)
@@ -116,38 +121,39 @@ class QueueApp:
         self.root = root
         self.root.title('Queue Management System')
         
+        # Initialize WebSocket client, only listening for config changes
+        self.ws_client = WebSocketClient(topics=['type:config_changed'])
+        self.ws_client.add_message_handler(self.on_message)
+        self.ws_client.start()
+        logger.info("WebSocket client initialized")
+        
+        # Numbers are claimed from the local database or the queue server
+        self.queue = get_queue(self.ws_client)
+        
         # Initialize database first
         try:
-            init_database()
+            self.queue.init_database()
             logger.info("Database initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize database: {e}")
             messagebox.showerror("Error", "Gagal menginisialisasi database")
             raise
         
-        # Load counter list
-        try:
-            self.counters = get_counter_list()
-            if not self.counters:
-                logger.warning("No active counters found")
-                messagebox.showwarning("Warning", "Tidak ada loket aktif ditemukan")
-            else:
-                logger.info(f"Loaded {len(self.counters)} active counters")
-        except Exception as e:
-            logger.error(f"Failed to load counter list: {e}")
-            messagebox.showerror("Error", "Gagal memuat daftar loket")
-            raise
+        # Counters are loaded on a worker thread once the UI is up
+        self.counters = []
         
-        # Initialize WebSocket client
-        self.ws_client = WebSocketClient()
-        self.ws_client.start()
-        logger.info("WebSocket client initialized")
+        # Database work runs off the Tk thread
+        self.executor = UIExecutor(self.root)
+        self.dispatcher = UIDispatcher(self.root)
         
         # Initialize audio manager
         audio_dir = os.path.join(os.path.dirname(__file__), 'audio')
         self.audio_manager = AudioManager(audio_dir)
+        # Only the first few numbers, others are rendered when first called
+        self.audio_manager.prerender([service['code'] for service in get_service_list()])
         
         self.setup_ui()
+        self.load_counters()
     
     def setup_ui(self):
         # Create main frame
@@ -160,19 +166,12 @@ class QueueApp:
         self.counter_var = tk.StringVar()
         self.counter_select = ttk.Combobox(main_frame, textvariable=self.counter_var)
         
-        # Create list of counter names for combobox
-        counter_names = []
-        for counter in self.counters:
-            counter_names.append(counter[1])  # counter[1] is the name field
-        
-        self.counter_select['values'] = counter_names
         self.counter_select.grid(row=0, column=1, padx=5, pady=5)
-        if counter_names:
-            self.counter_select.set(counter_names[0])
+        self.set_counters(self.counters)
         
         # Next number button
-        next_btn = ttk.Button(main_frame, text="Nomor Berikutnya", command=self.next_number)
-        next_btn.grid(row=1, column=0, columnspan=2, pady=10)
+        self.next_btn = ttk.Button(main_frame, text="Nomor Berikutnya", command=self.next_number)
+        self.next_btn.grid(row=1, column=0, columnspan=2, pady=10)
         
         # Current number display
         self.current_number = tk.StringVar(value="---")
@@ -182,55 +181,97 @@ class QueueApp:
         # Counter management button
         manage_btn = ttk.Button(main_frame, text="Kelola Loket", command=self.open_counter_manager)
         manage_btn.grid(row=3, column=0, columnspan=2, pady=10)
+        if isinstance(self.queue, RemoteQueue):
+            # Counters live in the server's database
+            manage_btn.state(['disabled'])
+    
+    def set_counters(self, counters):
+        """Fill the counter combobox, keeping the selection if it still exists"""
+        self.counters = counters
+        counter_names = [counter['name'] for counter in counters]
+        self.counter_select['values'] = counter_names
+        if self.counter_var.get() not in counter_names:
+            self.counter_select.set(counter_names[0] if counter_names else '')
+    
+    async def on_message(self, data):
+        # Runs on the client thread
+        if data.get('type') == 'config_changed':
+            self.dispatcher.post(self.reload_counters, key='reload_counters')
+    
+    def load_counters(self):
+        """Fetch the active counters off the Tk thread, retrying on failure"""
+        self.executor.submit('load_counters', self.queue.get_counter_list,
+                             on_success=self.on_counters_loaded,
+                             on_error=self.on_counters_failed)
+    
+    def on_counters_loaded(self, counters):
+        if not counters:
+            logger.warning("No active counters found")
+            self.executor.dialog(messagebox.showwarning, "Warning", "Tidak ada loket aktif ditemukan")
+        else:
+            logger.info(f"Loaded {len(counters)} active counters")
+        self.set_counters(counters)
+    
+    def on_counters_failed(self, error):
+        # E.g. the queue server is down, keep the window usable and retry
+        logger.error(f"Failed to load counter list: {error}, retrying")
+        self.root.after(COUNTER_RETRY_MS, self.load_counters)
+    
+    def reload_counters(self):
+        """Pick up counters added, renamed or removed in the configuration"""
+        logger.info("Configuration changed, reloading counters")
+        self.load_counters()
     
     def next_number(self):
         """Handle next number button click"""
-        try:
-            current_counter = self.counter_var.get()
-            if not current_counter:
-                messagebox.showwarning("Peringatan", "Silakan pilih loket terlebih dahulu")
-                return
+        current_counter = self.counter_var.get()
+        if not current_counter:
+            messagebox.showwarning("Peringatan", "Silakan pilih loket terlebih dahulu")
+            return
+        
+        # Find counter ID from selected counter name
+        counter_id = None
+        for counter in self.counters:
+            if counter['name'] == current_counter:
+                counter_id = counter['id']
+                break
+        
+        if counter_id is None:
+            logger.error(f"Counter not found: {current_counter}")
+            messagebox.showerror("Error", "Loket tidak ditemukan")
+            return
+        
+        # Claim the next number on a worker thread, the result comes back here
+        self.executor.submit(
+            'next_number', self.queue.get_next_number, counter_id,
+            on_success=lambda number: self.on_number_called(counter_id, current_counter, number),
+            on_error=lambda e: self.executor.dialog(
+                messagebox.showerror, "Error", "Terjadi kesalahan sistem"),
+            button=self.next_btn, pending_text="Memproses...")
+    
+    def on_number_called(self, counter_id, counter_name, next_number):
+        """Show and announce a claimed number, runs on the Tk thread"""
+        if next_number:
+            self.current_number.set(next_number)
             
-            # Find counter ID from selected counter name
-            counter_id = None
-            for counter in self.counters:
-                if counter[1] == current_counter:  # counter[1] is the name field
-                    counter_id = counter[0]  # counter[0] is the id field
-                    service_code = counter[2]  # counter[2] is the service_code field
-                    break
+            # Prepare WebSocket message
+            message = {
+                'type': 'call_number',
+                'counter_id': counter_id,
+                'number': next_number,
+                'counter_name': counter_name
+            }
             
-            if counter_id is None:
-                logger.error(f"Counter not found: {current_counter}")
-                messagebox.showerror("Error", "Loket tidak ditemukan")
-                return
+            # Send WebSocket message asynchronously
+            self.ws_client.send_nowait(message)
             
-            # Get next number
-            next_number = get_next_number(counter_id)
-            if next_number:
-                self.current_number.set(next_number)
-                
-                # Prepare WebSocket message
-                message = {
-                    'type': 'call_number',
-                    'counter_id': counter_id,
-                    'number': next_number,
-                    'counter_name': current_counter
-                }
-                
-                # Send WebSocket message asynchronously
-                asyncio.run(self.ws_client.send_message(json.dumps(message)))
-                
-                # Play audio
-                self.audio_manager.play_notification()
-                self.audio_manager.play_number(next_number)
-            else:
-                logger.warning("No waiting numbers available")
-                self.current_number.set("---")
-                messagebox.showinfo("Info", "Tidak ada antrian yang menunggu")
-        
-        except Exception as e:
-            logger.error(f"Error in next_number: {e}")
-            messagebox.showerror("Error", "Terjadi kesalahan sistem")
+            # Play audio
+            self.audio_manager.play_notification()
+            self.audio_manager.play_number(next_number)
+        else:
+            logger.warning("No waiting numbers available")
+            self.current_number.set("---")
+            self.executor.dialog(messagebox.showinfo, "Info", "Tidak ada antrian yang menunggu")
     
     def open_counter_manager(self):
         counter_manager = CounterManager(self.root)
@@ -244,7 +285,12 @@ if __name__ == "__main__":
         
         root = tk.Tk()
         app = QueueApp(root)
-        root.protocol("WM_DELETE_WINDOW", lambda: root.destroy())
+        
+        def on_close():
+            logger.info(f"UI thread blocking per action: {app.executor.histogram.snapshot()}")
+            app.executor.shutdown()
+            root.destroy()
+        root.protocol("WM_DELETE_WINDOW", on_close)
         root.mainloop()
     except Exception as e:
         logger.error(f"Application error: {e}")
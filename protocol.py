@@ -0,0 +1,167 @@
+import json
+import struct
+import logging
+
+logger = logging.getLogger('Protocol')
+
+# Wire encodings a client can ask for in its hello message
+JSON = 'json'
+BINARY = 'binary'
+ENCODINGS = (JSON, BINARY)
+
+# Binary frame layout version, sent in the hello. Hellos without one come
+# from version 1 clients, which predate the eta field.
+PROTOCOL_VERSION = 2
+FIRST_VERSION = 1
+
+# Binary frames start with the protocol version and an event type code.
+# Integers are unsigned big-endian, strings are UTF-8 with a one-byte
+# length prefix and an empty string stands for None. NO_ETA stands for
+# an unknown wait time.
+HEADER = struct.Struct('!BB')
+CALL_NUMBER = struct.Struct('!HIIII')  # counter_id, seq, total, waiting, eta
+NEW_NUMBER = struct.Struct('!IIII')    # seq, total, waiting, eta
+NO_ETA = 0xFFFFFFFF
+
+BATCH = struct.Struct('!H')            # event count, then per event:
+FRAME_LENGTH = struct.Struct('!H')     # frame length, frame bytes
+
+EVENT_CODES = {
+    'call_number': 1,
+    'new_number': 2,
+    'batch': 3
+}
+EVENT_TYPES = {code: name for name, code in EVENT_CODES.items()}
+
+# Queue service calls are always JSON: {'type': 'rpc', 'id', 'method',
+# 'params'} answered to the caller only with {'type': 'rpc_result', 'id',
+# 'result'} or {'type': 'rpc_result', 'id', 'error'}
+RPC = 'rpc'
+RPC_RESULT = 'rpc_result'
+
+class RemoteError(Exception):
+    """A queue service call failed on the server"""
+
+def _pack_str(value):
+    data = (value or '').encode('utf-8')
+    if len(data) > 255:
+        raise ValueError(f"String too long for binary frame: {value!r}")
+    return bytes((len(data),)) + data
+
+def _unpack_strs(buffer, offset, count):
+    values = []
+    for _ in range(count):
+        length = buffer[offset]
+        offset += 1
+        values.append(buffer[offset:offset + length].decode('utf-8') or None)
+        offset += length
+    return values
+
+def _pack_eta(value):
+    return NO_ETA if value is None else max(0, min(int(value), NO_ETA - 1))
+
+def _unpack_eta(value):
+    return None if value == NO_ETA else value
+
+def encode_binary(data):
+    """Pack a queue event into a binary frame.
+
+    Returns None for events that have no binary form, the caller should
+    send those as JSON.
+    """
+    code = EVENT_CODES.get(data.get('type'))
+    if code == EVENT_CODES['batch']:
+        frames = [encode_binary(event) for event in data['events']]
+        if None in frames:
+            return None
+        return (HEADER.pack(PROTOCOL_VERSION, code) + BATCH.pack(len(frames))
+                + b''.join(FRAME_LENGTH.pack(len(frame)) + frame for frame in frames))
+    if code is None or 'seq' not in data:
+        return None
+    try:
+        header = HEADER.pack(PROTOCOL_VERSION, code)
+        if code == EVENT_CODES['call_number']:
+            return (header
+                    + CALL_NUMBER.pack(data['counter_id'], data['seq'],
+                                       data.get('total', 0), data.get('waiting', 0),
+                                       _pack_eta(data.get('eta')))
+                    + _pack_str(data['number'])
+                    + _pack_str(data.get('counter_name'))
+                    + _pack_str(data.get('service_code'))
+                    + _pack_str(data.get('next_number')))
+        return (header
+                + NEW_NUMBER.pack(data['seq'], data.get('total', 0), data.get('waiting', 0),
+                                  _pack_eta(data.get('eta')))
+                + _pack_str(data['number'])
+                + _pack_str(data.get('service_code'))
+                + _pack_str(data.get('next_number')))
+    except (KeyError, TypeError, ValueError, struct.error) as e:
+        logger.debug(f"Event not encodable as binary, using JSON: {e}")
+        return None
+
+def decode_binary(buffer):
+    """Unpack a binary frame into the same dict the JSON form decodes to"""
+    version, code = HEADER.unpack_from(buffer)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version: {version}")
+    msg_type = EVENT_TYPES.get(code)
+    offset = HEADER.size
+
+    if msg_type == 'call_number':
+        counter_id, seq, total, waiting, eta = CALL_NUMBER.unpack_from(buffer, offset)
+        number, counter_name, service_code, next_number = _unpack_strs(
+            buffer, offset + CALL_NUMBER.size, 4)
+        return {
+            'type': msg_type,
+            'counter_id': counter_id,
+            'number': number,
+            'counter_name': counter_name,
+            'service_code': service_code,
+            'total': total,
+            'waiting': waiting,
+            'next_number': next_number,
+            'eta': _unpack_eta(eta),
+            'seq': seq
+        }
+    if msg_type == 'new_number':
+        seq, total, waiting, eta = NEW_NUMBER.unpack_from(buffer, offset)
+        number, service_code, next_number = _unpack_strs(buffer, offset + NEW_NUMBER.size, 3)
+        return {
+            'type': msg_type,
+            'number': number,
+            'service_code': service_code,
+            'total': total,
+            'waiting': waiting,
+            'next_number': next_number,
+            'eta': _unpack_eta(eta),
+            'seq': seq
+        }
+    if msg_type == 'batch':
+        (count,) = BATCH.unpack_from(buffer, offset)
+        offset += BATCH.size
+        events = []
+        for _ in range(count):
+            (length,) = FRAME_LENGTH.unpack_from(buffer, offset)
+            offset += FRAME_LENGTH.size
+            events.append(decode_binary(buffer[offset:offset + length]))
+            offset += length
+        return {'type': msg_type, 'events': events}
+    raise ValueError(f"Unknown event type code: {code}")
+
+def encode(data, encoding=JSON):
+    """Serialize a message for the wire, falling back to JSON"""
+    if encoding == BINARY and isinstance(data, dict):
+        frame = encode_binary(data)
+        if frame is not None:
+            return frame
+    return json.dumps(data)
+
+def decode(message):
+    """Parse a text (JSON) or binary frame into a message dict"""
+    if isinstance(message, (bytes, bytearray)):
+        return decode_binary(message)
+    data = json.loads(message)
+    if isinstance(data, str):
+        # Some senders encode the payload twice
+        data = json.loads(data)
+    return data
@@ -0,0 +1,312 @@
+import heapq
+import itertools
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+import database
+from config import get_daily_reset, get_counter_services
+
+logger = logging.getLogger('QueueEngine')
+
+class QueueEngine:
+    """In-memory queue state with write-behind persistence to queue.db.
+
+    Waiting tickets are kept in a heap per service, ordered by priority
+    and then ticket id, and the recent calls in a deque per counter, so
+    issuing and claiming are O(log n). Appointments wait in a second heap
+    per service, ordered by time, until they are due. Counters serving
+    several services pick one through the shared Scheduler. Every change
+    is appended to a journal that a background thread commits in batches.
+
+    The engine assumes it is the only writer of queue.db, so it should be
+    run by the process that owns the database.
+    """
+
+    def __init__(self, flush_interval=0.2, recent_limit=10):
+        self.flush_interval = flush_interval
+        self.recent_limit = recent_limit
+        self.lock = threading.Lock()
+        # Held while journaled changes are written, taken before self.lock
+        self.flush_lock = threading.Lock()
+        self.journal = []
+        self.flush_event = threading.Event()
+        self.flush_thread = None
+        self.running = False
+
+        self.counters = {}     # counter_id -> service_code
+        self.labels = {}       # counter_id -> config label, e.g. 'A1'
+        self.waiting = {}      # service_code -> heap of (-priority, id, number, created_at)
+        self.booked = {}       # service_code -> heap of (appointment_at, -priority, id, number, created_at)
+        self.recent = {}       # counter_id -> deque of (number, status, created_at)
+        self.totals = {}       # service_code -> tickets issued
+        self.sequences = {}    # service_code -> (last_value, seq_date)
+        self.last_id = 0
+
+    def load(self):
+        """Rebuild the in-memory state from the database"""
+        state = self._read_state()
+        with self.lock:
+            self._apply_state(state)
+
+    def _read_state(self):
+        cursor = database.get_connection().cursor()
+
+        counters, labels = self._read_counters(cursor)
+
+        # Rows come in claim order, and a sorted list is already a heap
+        waiting = {}
+        booked = {}
+        now = self._timestamp()
+        cursor.execute('''
+            SELECT id, number, service_code, created_at, priority, appointment_at FROM queue
+            WHERE status = 'waiting'
+            ORDER BY priority DESC, id ASC
+        ''')
+        for ticket_id, number, service_code, created_at, priority, appointment_at in cursor.fetchall():
+            if appointment_at and appointment_at > now:
+                booked.setdefault(service_code, []).append(
+                    (appointment_at, -priority, ticket_id, number, created_at))
+            else:
+                waiting.setdefault(service_code, []).append((-priority, ticket_id, number, created_at))
+        for heap in booked.values():
+            heapq.heapify(heap)
+
+        recent = {}
+        for counter_id in counters:
+            cursor.execute('''
+                SELECT number, status, created_at FROM queue
+                WHERE counter_id = ? AND status = 'called'
+                ORDER BY id DESC LIMIT ?
+            ''', (counter_id, self.recent_limit))
+            recent[counter_id] = deque(cursor.fetchall(), maxlen=self.recent_limit)
+
+        cursor.execute('SELECT service_code, COUNT(*) FROM queue GROUP BY service_code')
+        totals = dict(cursor.fetchall())
+
+        cursor.execute('SELECT service_code, last_value, seq_date FROM queue_sequence')
+        sequences = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+        last_id = database.last_ticket_id(cursor)
+
+        return counters, labels, waiting, booked, recent, totals, sequences, last_id
+
+    @staticmethod
+    def _read_counters(cursor):
+        cursor.execute('SELECT id, name, service_code FROM counter WHERE status = 1 ORDER BY id')
+        rows = cursor.fetchall()
+        counters = {counter_id: service_code for counter_id, _, service_code in rows}
+        labels = {counter_id: database.counter_label(name) for counter_id, name, _ in rows}
+        return counters, labels
+
+    def _apply_state(self, state):
+        (self.counters, self.labels, self.waiting, self.booked, self.recent,
+         self.totals, self.sequences, self.last_id) = state
+        logger.info(f"Loaded queue state: {sum(len(q) for q in self.waiting.values())} waiting tickets")
+
+    def run_exclusive(self, func, *args):
+        """Run func(*args) against the database with the engine paused.
+
+        Pending changes are committed first and the state is reloaded
+        afterwards, so func may rewrite the queue tables freely. Issuing and
+        claiming block until it returns.
+        """
+        with self.flush_lock, self.lock:
+            pending, self.journal = self.journal, []
+            if not self._commit(pending):
+                self.journal = pending
+                raise RuntimeError("Could not commit pending queue changes")
+            try:
+                return func(*args)
+            finally:
+                self._apply_state(self._read_state())
+
+    def reload_counters(self):
+        """Re-read the active counters after the counter table changed"""
+        counters, labels = self._read_counters(database.get_connection().cursor())
+        with self.lock:
+            self.counters = counters
+            self.labels = labels
+            for counter_id in counters:
+                self.recent.setdefault(counter_id, deque(maxlen=self.recent_limit))
+
+    def start(self):
+        """Load state and start the background flush thread"""
+        self.load()
+        self.running = True
+        self.flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flush_thread.start()
+
+    def stop(self):
+        """Stop the flush thread after committing everything pending"""
+        self.running = False
+        self.flush_event.set()
+        if self.flush_thread:
+            self.flush_thread.join()
+            self.flush_thread = None
+        self.flush()
+
+    def issue(self, service_code, priority=0, appointment_at=None):
+        """Issue a new ticket number for a service.
+
+        appointment_at is a UTC timestamp in SQLite's format or None.
+        """
+        seq_date = database.business_date().isoformat() if get_daily_reset() else ''
+        created_at = self._timestamp()
+        with self.lock:
+            last_value, last_date = self.sequences.get(service_code, (0, seq_date))
+            num = last_value + 1 if last_date == seq_date else 1
+            self.sequences[service_code] = (num, seq_date)
+            number = database.format_number(service_code, num)
+
+            # Tickets are pre-assigned to the first counter of the service
+            counter_id = next(
+                (cid for cid, code in self.counters.items() if code == service_code), None)
+
+            self.last_id += 1
+            ticket_id = self.last_id
+            if appointment_at and appointment_at > created_at:
+                heapq.heappush(self.booked.setdefault(service_code, []),
+                               (appointment_at, -priority, ticket_id, number, created_at))
+            else:
+                heapq.heappush(self.waiting.setdefault(service_code, []),
+                               (-priority, ticket_id, number, created_at))
+            self.totals[service_code] = self.totals.get(service_code, 0) + 1
+
+            self.journal.append(('''
+                INSERT INTO queue_sequence (service_code, last_value, seq_date)
+                VALUES (?, ?, ?)
+                ON CONFLICT (service_code) DO UPDATE SET
+                    last_value = excluded.last_value,
+                    seq_date = excluded.seq_date
+            ''', (service_code, num, seq_date)))
+            self.journal.append(('''
+                INSERT INTO queue (id, number, service_code, counter_id, status, created_at,
+                                   priority, appointment_at)
+                VALUES (?, ?, ?, ?, 'waiting', ?, ?, ?)
+            ''', (ticket_id, number, service_code, counter_id, created_at,
+                  priority, appointment_at)))
+        return number
+
+    def _release_due(self, service_code, now):
+        """Move appointments whose time has come into the waiting heap"""
+        booked = self.booked.get(service_code)
+        while booked and booked[0][0] <= now:
+            _, priority, ticket_id, number, created_at = heapq.heappop(booked)
+            heapq.heappush(self.waiting.setdefault(service_code, []),
+                           (priority, ticket_id, number, created_at))
+
+    def _weights(self, counter_id):
+        return get_counter_services(self.labels.get(counter_id), self.counters[counter_id])
+
+    def claim(self, counter_id):
+        """Claim the next waiting ticket from the services a counter serves"""
+        scheduler = database.get_scheduler()
+        with self.lock:
+            if counter_id not in self.counters:
+                logger.error(f"Counter ID {counter_id} not found")
+                return None
+            weights = self._weights(counter_id)
+            now = self._timestamp()
+            for code in weights:
+                self._release_due(code, now)
+            queues = {code: (len(self.waiting[code]), self.waiting[code][0][:2])
+                      for code in weights if self.waiting.get(code)}
+            service_code = scheduler.pick(counter_id, weights, queues)
+            if service_code is None:
+                return None
+
+            _, ticket_id, number, created_at = heapq.heappop(self.waiting[service_code])
+            recent = self.recent.setdefault(counter_id, deque(maxlen=self.recent_limit))
+            recent.appendleft((number, 'called', created_at))
+
+            self.journal.append(('''
+                UPDATE queue
+                SET status = 'called', counter_id = ?, called_at = ?
+                WHERE id = ?
+            ''', (counter_id, self._timestamp(), ticket_id)))
+        return number
+
+    def stats(self, service_code):
+        """Get total and next queue numbers for a service"""
+        with self.lock:
+            self._release_due(service_code, self._timestamp())
+            waiting = self.waiting.get(service_code)
+            next_number = waiting[0][2] if waiting else None
+            return self.totals.get(service_code, 0), next_number
+
+    def service_stats(self):
+        """Get issued total and waiting numbers for every service, see
+        database.get_service_stats()"""
+        with self.lock:
+            stats = {}
+            for code in set(self.totals) | set(self.waiting) | set(self.booked):
+                tickets = sorted(self.waiting.get(code, ())) + [
+                    entry[1:] for entry in sorted(self.booked.get(code, ()))]
+                stats[code] = {
+                    'total': self.totals.get(code, 0),
+                    'waiting': [number for _, _, number, _ in tickets],
+                    'priorities': {number: -priority for priority, _, number, _ in tickets if priority}
+                }
+            return stats
+
+    def queue_list(self, counter_id, limit=10):
+        """Get recently called and upcoming numbers for a counter, see
+        database.get_queue_list()"""
+        with self.lock:
+            called = list(self.recent.get(counter_id, ()))[:limit]
+            now = self._timestamp()
+            lines = []
+            for code, weight in self._weights(counter_id).items():
+                if weight > 0:
+                    self._release_due(code, now)
+                    lines.append(heapq.nsmallest(limit, self.waiting.get(code, ())))
+            upcoming = [(number, created_at) for _, _, number, created_at
+                        in itertools.islice(heapq.merge(*lines), limit)]
+            return called, upcoming
+
+    def has_waiting(self, counter_id):
+        """Check if any service a counter serves has waiting numbers"""
+        with self.lock:
+            now = self._timestamp()
+            weights = self._weights(counter_id)
+            for code in weights:
+                self._release_due(code, now)
+            return any(weight > 0 and self.waiting.get(code) for code, weight in weights.items())
+
+    def flush(self):
+        """Commit all journaled changes in one transaction"""
+        with self.flush_lock:
+            with self.lock:
+                pending, self.journal = self.journal, []
+            if not self._commit(pending):
+                # Keep the changes so the next flush retries them in order
+                with self.lock:
+                    self.journal = pending + self.journal
+
+    def _commit(self, pending):
+        if not pending:
+            return True
+        conn = database.get_connection()
+        try:
+            for sql, params in pending:
+                conn.execute(sql, params)
+            conn.commit()
+            logger.debug(f"Flushed {len(pending)} queue changes")
+            return True
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error flushing queue journal: {e}")
+            return False
+
+    def _flush_loop(self):
+        while self.running:
+            self.flush_event.wait(self.flush_interval)
+            self.flush_event.clear()
+            self.flush()
+
+    @staticmethod
+    def _timestamp():
+        # Same UTC format SQLite uses for CURRENT_TIMESTAMP
+        return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
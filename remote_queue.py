@@ -0,0 +1,58 @@
+import logging
+
+import database
+from config import get_remote_queue
+
+logger = logging.getLogger('RemoteQueue')
+
+class RemoteQueue:
+    """Queue operations served by the queue server over a WebSocketClient.
+
+    The methods mirror the database functions the GUIs use, so either can
+    be passed around, see get_queue(). Calls block until the server
+    replies and must not run on the Tk thread. They raise TimeoutError or
+    ConnectionError when the server cannot be reached, and
+    protocol.RemoteError when the call failed on the server.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def init_database(self):
+        """Nothing to do, the server owns the database"""
+
+    def create_new_number(self, service_code, priority=database.PRIORITY_NORMAL, appointment_at=None):
+        if appointment_at is not None:
+            appointment_at = appointment_at.isoformat()
+        return self.client.call('issue', {'service_code': service_code, 'priority': priority,
+                                          'appointment_at': appointment_at})
+
+    def get_next_number(self, counter_id):
+        return self.client.call('claim', {'counter_id': counter_id})
+
+    def get_queue_stats(self, service_code):
+        return tuple(self.client.call('stats', {'service_code': service_code}))
+
+    def get_service_stats(self):
+        return self.client.call('service_stats')
+
+    def get_counter_list(self):
+        return self.client.call('counters')
+
+    def has_waiting_numbers(self, counter_id):
+        return self.client.call('has_waiting', {'counter_id': counter_id})
+
+    def get_queue_list(self, counter_id, limit=10):
+        called, upcoming = self.client.call('queue_list', {'counter_id': counter_id, 'limit': limit})
+        return [tuple(row) for row in called], [tuple(row) for row in upcoming]
+
+def get_queue(client):
+    """Get what the GUIs issue and claim tickets through.
+
+    That is the server, through the started client, when remote_queue is
+    configured, otherwise the local database module.
+    """
+    if get_remote_queue():
+        logger.info(f"Using the queue server at {client.uri}")
+        return RemoteQueue(client)
+    return database
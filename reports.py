@@ -0,0 +1,200 @@
+import argparse
+import csv
+import logging
+import os
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+
+import database
+
+logger = logging.getLogger('Reports')
+
+# History rows fetched and converted to an array at a time
+CHUNK_SIZE = 50000
+
+# Wait time histogram resolution; longer waits land in the last bin
+WAIT_BIN = 30         # seconds
+MAX_WAIT = 4 * 3600   # seconds
+
+PERCENTILES = (50, 90, 95)
+
+# Service codes are single letters, column SERVICE_INDEX of a chunk is
+# the code's offset from 'A'
+SERVICE_CODES = [chr(ord('A') + i) for i in range(26)]
+
+# Chunk columns, all integers so a chunk converts to one int64 array
+CREATED, CALLED, COUNTER, SERVICE_INDEX, SERVED = range(5)
+
+# Unix seconds via julianday(), noticeably cheaper than strftime('%s')
+HISTORY_QUERY = '''
+    SELECT CAST((julianday(created_at) - 2440587.5) * 86400 + 0.5 AS INTEGER),
+           COALESCE(CAST((julianday(called_at) - 2440587.5) * 86400 + 0.5 AS INTEGER), -1),
+           COALESCE(counter_id, 0),
+           unicode(service_code) - 65,
+           status = 'called'
+    FROM {table}
+    WHERE created_at >= ? AND created_at < ?
+'''
+
+def iter_history(start, end, chunk_size=CHUNK_SIZE):
+    """Stream the tickets created between two UTC timestamps.
+
+    Archived and current tickets are read with fetchmany and yielded as
+    int64 arrays of at most chunk_size rows, see the chunk column
+    constants. Timestamps are Unix seconds, a ticket not called has -1.
+    """
+    conn = database.get_connection()
+    for table in ('queue_archive', 'queue'):
+        cursor = conn.execute(HISTORY_QUERY.format(table=table), (start, end))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield np.array(rows, dtype=np.int64)
+
+def _timestamp(value):
+    # SQLite's UTC text format to Unix seconds
+    return int(datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+               .replace(tzinfo=timezone.utc).timestamp())
+
+class DailyReport:
+    """Per-day aggregates built incrementally from history chunks.
+
+    Memory depends on the number of days, services and counters, never on
+    the number of tickets: wait times are kept as fixed-width histograms,
+    so percentiles are accurate to WAIT_BIN seconds.
+    """
+
+    def __init__(self, first_day, days, wait_bin=WAIT_BIN, max_wait=MAX_WAIT):
+        self.first_day = first_day
+        self.days = days
+        self.wait_bin = wait_bin
+        self.bins = max_wait // wait_bin + 1
+        self.start = _timestamp(database.business_day_start(first_day))
+        # Local hours for the arrival curve, using today's UTC offset
+        self.utc_offset = int(datetime.now().astimezone().utcoffset().total_seconds())
+
+        services = len(SERVICE_CODES)
+        self.issued = np.zeros((days, services), dtype=np.int64)
+        self.served = np.zeros((days, services), dtype=np.int64)
+        self.wait_sum = np.zeros((days, services), dtype=np.float64)
+        self.wait_max = np.zeros((days, services), dtype=np.int64)
+        self.wait_hist = np.zeros((days, services, self.bins), dtype=np.int32)
+        self.arrivals = np.zeros((days, services, 24), dtype=np.int64)
+        self.throughput = np.zeros((days, 1), dtype=np.int64)  # grows per counter id
+        self.rows = 0
+
+    def add(self, chunk):
+        """Fold one history chunk into the aggregates"""
+        self.rows += len(chunk)
+        day = (chunk[:, CREATED] - self.start) // 86400
+        service = chunk[:, SERVICE_INDEX]
+        keep = (day >= 0) & (day < self.days) & (service >= 0) & (service < len(SERVICE_CODES))
+        chunk, day, service = chunk[keep], day[keep], service[keep]
+        cell = day * len(SERVICE_CODES) + service
+
+        self._count(self.issued, cell)
+        hour = (chunk[:, CREATED] + self.utc_offset) // 3600 % 24
+        self._count(self.arrivals, cell * 24 + hour)
+
+        served = (chunk[:, SERVED] == 1) & (chunk[:, CALLED] >= 0)
+        if not served.any():
+            return
+        chunk, day, cell = chunk[served], day[served], cell[served]
+        wait = np.maximum(chunk[:, CALLED] - chunk[:, CREATED], 0)
+
+        self._count(self.served, cell)
+        np.add.at(self.wait_sum.ravel(), cell, wait)
+        np.maximum.at(self.wait_max.ravel(), cell, wait)
+        self._count(self.wait_hist, cell * self.bins + np.minimum(wait // self.wait_bin, self.bins - 1))
+
+        counter = chunk[:, COUNTER]
+        if counter.max() >= self.throughput.shape[1]:
+            self.throughput = np.pad(self.throughput, ((0, 0), (0, counter.max() + 1 - self.throughput.shape[1])))
+        self._count(self.throughput, day * self.throughput.shape[1] + counter)
+
+    @staticmethod
+    def _count(target, flat_index):
+        # Sorting the chunk's keys is cheaper than a bincount over the
+        # whole target and than np.add.at with many repeats
+        keys, counts = np.unique(flat_index, return_counts=True)
+        target.ravel()[keys] += counts
+
+    def wait_percentiles(self, percentiles=PERCENTILES):
+        """Get waits in seconds per (percentile, day, service), -1 when nothing was served"""
+        cumulative = np.cumsum(self.wait_hist, axis=-1, dtype=np.int32)
+        total = cumulative[..., -1]
+        result = np.full((len(percentiles),) + total.shape, -1, dtype=np.int64)
+        for i, p in enumerate(percentiles):
+            target = np.ceil(total * p / 100).astype(np.int64)
+            index = (cumulative < target[..., None]).sum(axis=-1)
+            # Upper edge of the bin holding the percentile
+            result[i] = np.where(total > 0, (index + 1) * self.wait_bin, -1)
+        return result
+
+    def day_label(self, day):
+        return (self.first_day + timedelta(days=int(day))).isoformat()
+
+    def write_csv(self, out_dir, counter_names=None):
+        """Write throughput.csv, waits.csv and arrivals.csv to out_dir"""
+        os.makedirs(out_dir, exist_ok=True)
+        counter_names = counter_names or {}
+
+        with open(os.path.join(out_dir, 'throughput.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['date', 'counter_id', 'counter_name', 'served'])
+            for day, counter in zip(*np.nonzero(self.throughput)):
+                writer.writerow([self.day_label(day), int(counter),
+                                 counter_names.get(int(counter), ''),
+                                 int(self.throughput[day, counter])])
+
+        percentiles = self.wait_percentiles()
+        with open(os.path.join(out_dir, 'waits.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['date', 'service_code', 'issued', 'served', 'mean_wait_s']
+                            + [f"p{p}_wait_s" for p in PERCENTILES] + ['max_wait_s'])
+            for day, service in zip(*np.nonzero(self.issued)):
+                served = int(self.served[day, service])
+                mean = round(self.wait_sum[day, service] / served, 1) if served else ''
+                writer.writerow([self.day_label(day), SERVICE_CODES[service],
+                                 int(self.issued[day, service]), served, mean]
+                                + [int(p[day, service]) if served else '' for p in percentiles]
+                                + [int(self.wait_max[day, service]) if served else ''])
+
+        with open(os.path.join(out_dir, 'arrivals.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['date', 'service_code'] + [f"{hour:02d}:00" for hour in range(24)])
+            for day, service in zip(*np.nonzero(self.issued)):
+                writer.writerow([self.day_label(day), SERVICE_CODES[service]]
+                                + self.arrivals[day, service].tolist())
+        logger.info(f"Wrote reports for {self.rows} tickets to {out_dir}")
+
+def build_report(first_day, last_day, chunk_size=CHUNK_SIZE):
+    """Aggregate the queue history of the business days first_day..last_day"""
+    days = (last_day - first_day).days + 1
+    report = DailyReport(first_day, days)
+    start = database.business_day_start(first_day)
+    end = database.business_day_start(last_day + timedelta(days=1))
+    for chunk in iter_history(start, end, chunk_size):
+        report.add(chunk)
+    return report
+
+def get_counter_names():
+    """Get {counter_id: name} of all counters, active or not"""
+    cursor = database.get_connection().cursor()
+    cursor.execute('SELECT id, name FROM counter')
+    return dict(cursor.fetchall())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Laporan harian antrian')
+    parser.add_argument('first_day', type=date.fromisoformat, nargs='?',
+                        help='First business day (YYYY-MM-DD), default yesterday')
+    parser.add_argument('last_day', type=date.fromisoformat, nargs='?',
+                        help='Last business day (YYYY-MM-DD), default first_day')
+    parser.add_argument('--out', default='reports', help='Output directory')
+    args = parser.parse_args()
+
+    first_day = args.first_day or database.business_date() - timedelta(days=1)
+    report = build_report(first_day, args.last_day or first_day)
+    report.write_csv(args.out, get_counter_names())
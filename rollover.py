@@ -0,0 +1,77 @@
+import logging
+import threading
+from datetime import timedelta
+
+import database
+from config import get_archive_after_days
+
+logger = logging.getLogger('Rollover')
+
+# Seconds between checks whether a new queue day has started
+CHECK_INTERVAL = 60
+
+def rollover(day=None):
+    """Close the queue days before day and tidy up the database.
+
+    Tickets older than the configured archive_after_days are moved to
+    queue_archive, then free pages are released and statistics refreshed.
+    Ticket numbers need no reset here: the sequences restart by themselves
+    on the first ticket of a new business day. Returns (archived, expired).
+    """
+    day = day or database.business_date()
+    cutoff = database.business_day_start(day - timedelta(days=get_archive_after_days()))
+
+    archived, expired = database.archive_closed_days(cutoff)
+    database.run_maintenance()
+    database.record_rollover(day, archived, expired)
+    logger.info(f"Rolled over to {day}: {archived} tickets archived, {expired} expired")
+    return archived, expired
+
+class RolloverScheduler:
+    """Runs rollover() once per queue day from a background thread.
+
+    The day starts at the configured rollover_time. A rollover missed while
+    the process was down runs right after start(). on_rollover(day,
+    archived, expired) is called on the scheduler thread afterwards.
+    """
+
+    def __init__(self, interval=CHECK_INTERVAL, on_rollover=None):
+        self.interval = interval
+        self.on_rollover = on_rollover
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def check(self):
+        """Roll over if the current queue day has not been rolled over yet"""
+        day = database.business_date()
+        if database.get_last_rollover() == day.isoformat():
+            return False
+        archived, expired = rollover(day)
+        if self.on_rollover:
+            self.on_rollover(day, archived, expired)
+        return True
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Error during rollover: {e}")
+            self.stop_event.wait(self.interval)
+        database.close_connection()
+
+if __name__ == '__main__':
+    # Run a rollover now, e.g. from cron when the server is not running
+    database.init_database()
+    rollover()
@@ -0,0 +1,138 @@
+import heapq
+import logging
+import random
+
+logger = logging.getLogger('Scheduler')
+
+LONGEST_QUEUE = 'longest_queue'
+OLDEST_WAIT = 'oldest_wait'
+WEIGHTED_ROUND_ROBIN = 'weighted_round_robin'
+POLICIES = (LONGEST_QUEUE, OLDEST_WAIT, WEIGHTED_ROUND_ROBIN)
+
+class Scheduler:
+    """Chooses which service a counter serves next.
+
+    A counter serves the services it has a positive weight for. Given the
+    length and the claim order key of the first ticket of each waiting
+    line, (-priority, ticket id), the policy picks:
+
+    - longest_queue: the line with the most tickets, scaled by weight
+    - oldest_wait: the line whose first ticket comes first, so priority
+      tickets, then the one taken earliest
+    - weighted_round_robin: lines in turn, in proportion to their weights
+      (smooth round-robin, so a 2:1 split goes A, B, A rather than A, A, B)
+
+    Round-robin progress is kept per counter.
+    """
+
+    def __init__(self, policy=OLDEST_WAIT):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown dispatch policy: {policy}")
+        self.policy = policy
+        self.credits = {}  # counter_id -> {service_code: round-robin credit}
+
+    def pick(self, counter_id, weights, queues):
+        """Get the service to serve next, None if all its lines are empty.
+
+        weights maps service codes to weights, queues maps service codes to
+        (waiting count, claim order key of the first waiting ticket).
+        """
+        candidates = [service_code for service_code, weight in weights.items()
+                      if weight > 0 and queues.get(service_code, (0, None))[0] > 0]
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]
+
+        if self.policy == LONGEST_QUEUE:
+            return min(candidates, key=lambda code: (-queues[code][0] * weights[code], queues[code][1]))
+        if self.policy == OLDEST_WAIT:
+            return min(candidates, key=lambda code: queues[code][1])
+
+        credits = self.credits.setdefault(counter_id, {})
+        for service_code in candidates:
+            credits[service_code] = credits.get(service_code, 0) + weights[service_code]
+        chosen = max(candidates, key=lambda code: credits[code])
+        credits[chosen] -= sum(weights[code] for code in candidates)
+        return chosen
+
+def simulate(policy, counters, arrival_rates, service_time, hours=8.0, seed=1):
+    """Simulate a day under a policy and return wait statistics.
+
+    counters is a list of {service_code: weight} per counter, arrival_rates
+    maps service codes to tickets per hour and service_time is the mean
+    seconds per ticket. Arrivals and service times are exponential. Returns
+    {'served', 'mean_wait', 'p95_wait', 'per_service': {code: mean_wait}}
+    with waits in seconds.
+    """
+    rng = random.Random(seed)
+    scheduler = Scheduler(policy)
+    end = hours * 3600
+
+    # Events are (time, kind, detail): kind 0 = arrival, 1 = counter free
+    events = []
+    for service_code, rate in arrival_rates.items():
+        t = rng.expovariate(rate / 3600)
+        while t < end:
+            events.append((t, 0, service_code))
+            t += rng.expovariate(rate / 3600)
+    heapq.heapify(events)
+    for counter_id in range(len(counters)):
+        heapq.heappush(events, (0.0, 1, counter_id))
+
+    lines = {service_code: [] for service_code in arrival_rates}  # heaps of (ticket_id, taken at)
+    idle = set()
+    ticket_ids = iter(range(1, 1 << 62))
+    waits = {service_code: [] for service_code in arrival_rates}
+
+    def serve(now, counter_id):
+        queues = {code: (len(line), line[0][:1]) for code, line in lines.items() if line}
+        service_code = scheduler.pick(counter_id, counters[counter_id], queues)
+        if service_code is None:
+            idle.add(counter_id)
+            return
+        _, taken_at = heapq.heappop(lines[service_code])
+        waits[service_code].append(now - taken_at)
+        heapq.heappush(events, (now + rng.expovariate(1 / service_time), 1, counter_id))
+
+    while events:
+        now, kind, detail = heapq.heappop(events)
+        if kind == 0:
+            heapq.heappush(lines[detail], (next(ticket_ids), now))
+            for counter_id in sorted(idle):
+                if counters[counter_id].get(detail, 0) > 0:
+                    idle.discard(counter_id)
+                    serve(now, counter_id)
+                    break
+        else:
+            serve(now, detail)
+
+    all_waits = sorted(wait for service_waits in waits.values() for wait in service_waits)
+    return {
+        'served': len(all_waits),
+        'mean_wait': sum(all_waits) / len(all_waits) if all_waits else 0.0,
+        'p95_wait': all_waits[int(0.95 * (len(all_waits) - 1))] if all_waits else 0.0,
+        'per_service': {code: sum(w) / len(w) if w else 0.0 for code, w in waits.items()}
+    }
+
+if __name__ == '__main__':
+    # Unbalanced office: A has twice the arrivals of B, two counters each.
+    # "Dedicated" counters serve only their own letter, "shared" ones also
+    # help the other service at weight 1.
+    arrival_rates = {'A': 40, 'B': 20}
+    setups = {
+        'dedicated': [{'A': 1}, {'A': 1}, {'B': 1}, {'B': 1}],
+        'shared': [{'A': 2, 'B': 1}, {'A': 2, 'B': 1}, {'B': 2, 'A': 1}, {'B': 2, 'A': 1}],
+    }
+    print(f"{'setup':<10} {'policy':<22} {'served':>6} {'mean':>8} {'p95':>8}   mean per service")
+    for name, counters in setups.items():
+        for policy in POLICIES:
+            runs = [simulate(policy, counters, arrival_rates, service_time=200, seed=seed)
+                    for seed in range(20)]
+            mean = sum(run['mean_wait'] for run in runs) / len(runs)
+            p95 = sum(run['p95_wait'] for run in runs) / len(runs)
+            served = sum(run['served'] for run in runs) // len(runs)
+            per_service = ', '.join(
+                f"{code} {sum(run['per_service'][code] for run in runs) / len(runs) / 60:.1f}"
+                for code in arrival_rates)
+            print(f"{name:<10} {policy:<22} {served:>6} {mean / 60:>6.1f} m {p95 / 60:>6.1f} m   {per_service}")
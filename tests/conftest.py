@@ -0,0 +1,107 @@
+import asyncio
+import copy
+import os
+import sys
+import threading
+import time
+
+import pytest
+import websockets
+
+# The modules live at the top of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import config
+import database
+from websocket_client import WebSocketClient
+from websocket_server import WebSocketServer
+
+def use_queue_dir(directory):
+    """Point config and database at the queue_config.json and queue.db in
+    directory, e.g. in a worker process"""
+    os.chdir(directory)
+    database.close_connection()
+    database.DB_FILE = os.path.join(directory, 'queue.db')
+
+class StubRoot:
+    """Stands in for Tk: after() callbacks run when tick() is called"""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def after(self, ms, callback):
+        self.scheduled.append(callback)
+
+    def tick(self):
+        callbacks, self.scheduled = self.scheduled, []
+        for callback in callbacks:
+            callback()
+
+@pytest.fixture
+def queue_db(tmp_path, monkeypatch):
+    """Factory for a fresh queue database in tmp_path.
+
+    Call it with config overrides, e.g. queue_db(counters={'A': 16}); it
+    writes the config, creates the schema and returns the directory.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database, 'DB_FILE', str(tmp_path / 'queue.db'))
+    database.close_connection()
+
+    def make(**overrides):
+        settings = copy.deepcopy(config.DEFAULT_CONFIG)
+        settings.update(overrides)
+        assert config.save_config(settings)
+        database.init_database()
+        return str(tmp_path)
+
+    yield make
+    database.stop_engine()
+    database.close_connection()
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+@pytest.fixture
+def queue_server(queue_db):
+    """Serve a fresh queue on a free loopback port, yields the server and uri"""
+    queue_db(remote_queue=True)
+    started = threading.Event()
+    state = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = WebSocketServer()
+        server.load_state()
+        ws_server = loop.run_until_complete(websockets.serve(server.handler, '127.0.0.1', 0))
+        state.update(server=server, loop=loop, stop=asyncio.Event(),
+                     uri=f"ws://127.0.0.1:{ws_server.sockets[0].getsockname()[1]}")
+        started.set()
+        loop.run_until_complete(state['stop'].wait())
+        ws_server.close()
+        loop.run_until_complete(ws_server.wait_closed())
+        server.stop()
+        loop.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert started.wait(5)
+    yield state['server'], state['uri']
+    state['loop'].call_soon_threadsafe(state['stop'].set)
+    thread.join(5)
+
+@pytest.fixture
+def connect(queue_server):
+    """Factory for started clients connected to the server"""
+    def make():
+        client = WebSocketClient(uri=queue_server[1])
+        client.start()
+        wait_until(lambda: client.connected)
+        return client
+    return make
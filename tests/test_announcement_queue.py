@@ -0,0 +1,103 @@
+"""Flooding AnnouncementQueue with calls, played through a stub player"""
+import importlib
+import importlib.util
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+@pytest.fixture
+def AnnouncementQueue(monkeypatch):
+    """audio_manager.AnnouncementQueue, importable without pygame.
+
+    AnnouncementQueue only calls the play function it is given, so a stub
+    pygame is enough. The stub and the module loaded against it stay out
+    of sys.modules after the test.
+    """
+    if importlib.util.find_spec('pygame') is not None:
+        return importlib.import_module('audio_manager').AnnouncementQueue
+    monkeypatch.setitem(sys.modules, 'pygame', types.ModuleType('pygame'))
+    spec = importlib.util.find_spec('audio_manager')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.AnnouncementQueue
+
+class GatedPlayer:
+    """Records played numbers; blocks in play() until opened"""
+
+    def __init__(self):
+        self.played = []
+        self.started = threading.Event()
+        self.gate = threading.Event()
+        self.done = threading.Condition()
+
+    def __call__(self, number):
+        self.started.set()
+        self.gate.wait()
+        with self.done:
+            self.played.append(number)
+            self.done.notify_all()
+
+    def wait_for(self, count, timeout=5):
+        with self.done:
+            assert self.done.wait_for(lambda: len(self.played) >= count, timeout)
+
+def flood(AnnouncementQueue, drop_policy, calls=1000, max_depth=50):
+    player = GatedPlayer()
+    announcements = AnnouncementQueue(player, max_depth=max_depth, drop_policy=drop_policy)
+    # The first call goes straight to the (blocked) player
+    announcements.enqueue('A0000')
+    assert player.started.wait(5)
+    began = time.perf_counter()
+    accepted = [announcements.enqueue(f"A{i:04d}") for i in range(1, calls)]
+    enqueue_time = time.perf_counter() - began
+    return player, announcements, accepted, enqueue_time
+
+def test_flood_drops_oldest(AnnouncementQueue):
+    player, announcements, accepted, enqueue_time = flood(AnnouncementQueue, 'oldest')
+    assert all(accepted)
+    assert enqueue_time < 1.0  # never blocks on the player
+    metrics = announcements.metrics()
+    assert metrics['depth'] == 50
+    assert metrics['max_depth'] == 50
+    assert metrics['enqueued'] == 1000
+    assert metrics['dropped'] == 1000 - 1 - 50
+
+    player.gate.set()
+    player.wait_for(51)
+    # The newest 50 survive, in arrival order
+    assert player.played == ['A0000'] + [f"A{i:04d}" for i in range(950, 1000)]
+    metrics = announcements.metrics()
+    assert metrics['depth'] == 0
+    assert metrics['played'] == 51
+    assert metrics['max_wait'] >= metrics['avg_wait'] > 0
+
+def test_flood_drops_newest(AnnouncementQueue):
+    player, announcements, accepted, _ = flood(AnnouncementQueue, 'newest')
+    assert accepted == [True] * 50 + [False] * 949
+    assert announcements.metrics()['dropped'] == 949
+
+    player.gate.set()
+    player.wait_for(51)
+    assert player.played == [f"A{i:04d}" for i in range(51)]
+
+def test_recalls_coalesce_and_raise_priority(AnnouncementQueue):
+    player = GatedPlayer()
+    announcements = AnnouncementQueue(player, max_depth=50)
+    announcements.enqueue('A001')
+    assert player.started.wait(5)
+    for _ in range(500):
+        announcements.enqueue('B001')
+        announcements.enqueue('B002')
+    announcements.enqueue('B002', priority=1)
+
+    metrics = announcements.metrics()
+    assert metrics['depth'] == 2
+    assert metrics['coalesced'] == 999
+    assert metrics['dropped'] == 0
+
+    player.gate.set()
+    player.wait_for(3)
+    assert player.played == ['A001', 'B002', 'B001']
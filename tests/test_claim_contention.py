@@ -0,0 +1,52 @@
+"""16 counters claiming from one waiting line at the same time.
+
+Throughput is measured by bench/bench_claim_contention.py.
+"""
+import threading
+from collections import Counter
+
+import pytest
+
+import database
+
+COUNTERS = 16
+TICKETS = 2000
+
+@pytest.mark.parametrize('engine', [False, True], ids=['sql', 'engine'])
+def test_no_ticket_is_claimed_twice(queue_db, engine):
+    queue_db(counters={'A': COUNTERS})
+    conn = database.get_connection()
+    conn.executemany("INSERT INTO queue (number, service_code) VALUES (?, 'A')",
+                     [(f"A{i:04d}",) for i in range(1, TICKETS + 1)])
+    conn.commit()
+    if engine:
+        database.start_engine()
+    counter_ids = [counter['id'] for counter in database.get_counter_list()]
+    assert len(counter_ids) == COUNTERS
+
+    start = threading.Barrier(COUNTERS)
+    claims = {}
+
+    def counter(counter_id):
+        mine = []
+        start.wait()
+        while True:
+            number = database.get_next_number(counter_id)
+            if number is None:
+                break
+            mine.append(number)
+        claims[counter_id] = mine
+
+    threads = [threading.Thread(target=counter, args=(counter_id,)) for counter_id in counter_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    database.stop_engine()
+
+    claimed = [number for numbers in claims.values() for number in numbers]
+    assert not [number for number, count in Counter(claimed).items() if count > 1]
+    assert len(claimed) == TICKETS
+    rows = conn.execute("SELECT counter_id, number FROM queue WHERE status = 'called'").fetchall()
+    assert sorted(rows) == sorted((counter_id, number) for counter_id, numbers in claims.items()
+                                  for number in numbers)
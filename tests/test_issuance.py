@@ -0,0 +1,75 @@
+"""Concurrent ticket issuance from several processes.
+
+Each worker process is a kiosk issuing tickets against the same queue.db
+while claimer threads in the test process call them. Set
+QUEUE_STRESS_TICKETS to issue more, e.g. 100000 for the full stress run.
+Throughput is measured by bench/bench_issuance.py.
+"""
+import multiprocessing
+import os
+import threading
+from collections import Counter
+
+import database
+from conftest import use_queue_dir
+
+PROCESSES = 6
+CLAIMERS = 8
+TICKETS = int(os.environ.get('QUEUE_STRESS_TICKETS', 3000))
+
+def issue_tickets(directory, count, start, results):
+    use_queue_dir(directory)
+    start.wait()
+    numbers = [database.create_new_number('AB'[i % 2]) for i in range(count)]
+    results.put(numbers)
+
+def test_concurrent_issuance_has_no_duplicates(queue_db):
+    directory = queue_db(counters={'A': 4, 'B': 4})
+    counter_ids = [counter['id'] for counter in database.get_counter_list()]
+
+    context = multiprocessing.get_context('spawn')
+    start = context.Event()
+    results = context.Queue()
+    per_process = TICKETS // PROCESSES
+    workers = [context.Process(target=issue_tickets, args=(directory, per_process, start, results))
+               for _ in range(PROCESSES)]
+    for worker in workers:
+        worker.start()
+
+    issuing = True
+    claimed = []
+    lock = threading.Lock()
+
+    def claim(counter_id):
+        mine = []
+        while True:
+            still_issuing = issuing
+            number = database.get_next_number(counter_id)
+            if number:
+                mine.append(number)
+            elif not still_issuing:
+                break
+        with lock:
+            claimed.extend(mine)
+
+    claimers = [threading.Thread(target=claim, args=(counter_ids[i % len(counter_ids)],))
+                for i in range(CLAIMERS)]
+    start.set()
+    for claimer in claimers:
+        claimer.start()
+    issued = [number for _ in workers for number in results.get(timeout=120)]
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    issuing = False
+    for claimer in claimers:
+        claimer.join()
+
+    total = per_process * PROCESSES
+    assert len(issued) == total
+    assert not [number for number, count in Counter(issued).items() if count > 1]
+    assert sorted(claimed) == sorted(issued)
+
+    conn = database.get_connection()
+    assert conn.execute('SELECT COUNT(*), COUNT(DISTINCT number) FROM queue').fetchone() == (total, total)
+    assert conn.execute("SELECT COUNT(*) FROM queue WHERE status = 'called'").fetchone()[0] == total
@@ -0,0 +1,20 @@
+"""Incremental auto-vacuum on new and old databases"""
+import sqlite3
+
+import database
+
+def auto_vacuum():
+    return database.get_connection().execute('PRAGMA auto_vacuum').fetchone()[0]
+
+def test_new_database_uses_incremental_auto_vacuum(queue_db):
+    queue_db()
+    assert auto_vacuum() == 2
+
+def test_maintenance_converts_an_old_database(queue_db, tmp_path):
+    conn = sqlite3.connect(tmp_path / 'queue.db')
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.close()
+    queue_db()
+    assert auto_vacuum() == 0
+    database.run_maintenance()
+    assert auto_vacuum() == 2
@@ -0,0 +1,44 @@
+"""Wire encodings and their negotiation in the hello message"""
+import asyncio
+import json
+
+import pytest
+import websockets
+
+import protocol
+
+CALL = {'type': 'call_number', 'counter_id': 3, 'number': 'B042', 'counter_name': 'Loket B1',
+        'service_code': 'B', 'total': 87, 'waiting': 12, 'next_number': 'B043', 'eta': None,
+        'seq': 1532}
+
+@pytest.mark.parametrize('encoding', protocol.ENCODINGS)
+def test_round_trip(encoding):
+    assert protocol.decode(protocol.encode(CALL, encoding)) == CALL
+
+def test_other_versions_are_rejected():
+    frame = bytearray(protocol.encode(CALL, protocol.BINARY))
+    frame[0] = protocol.FIRST_VERSION
+    with pytest.raises(ValueError, match='version'):
+        protocol.decode(bytes(frame))
+
+async def receive_call(uri, hello):
+    """Connect with a hello, have another client call a number, get the frame"""
+    async with websockets.connect(uri) as display, websockets.connect(uri) as counter:
+        await display.send(json.dumps(hello))
+        # Messages are handled in order, the snapshot comes after the hello
+        await display.send(json.dumps({'type': 'sync'}))
+        assert json.loads(await display.recv())['type'] == 'snapshot'
+        await counter.send(json.dumps({'type': 'call_number', 'number': 'A001', 'counter_id': 1}))
+        return await asyncio.wait_for(display.recv(), 5)
+
+@pytest.mark.parametrize('hello, binary', [
+    ({'encoding': 'binary', 'version': protocol.PROTOCOL_VERSION}, True),
+    ({'encoding': 'binary'}, False),  # a version 1 client
+    ({'encoding': 'binary', 'version': protocol.PROTOCOL_VERSION + 1}, False),
+    ({'encoding': 'json', 'version': protocol.PROTOCOL_VERSION}, False),
+], ids=['current', 'version 1', 'newer', 'json'])
+def test_binary_only_for_the_same_version(queue_server, hello, binary):
+    frame = asyncio.run(receive_call(queue_server[1], dict(hello, type='hello')))
+    assert isinstance(frame, bytes) == binary
+    data = protocol.decode(frame)
+    assert (data['type'], data['number'], data['counter_id']) == ('call_number', 'A001', 1)
@@ -0,0 +1,74 @@
+"""EXPLAIN QUERY PLAN guard for the hot queue queries.
+
+The statements are captured from the real helpers with a trace callback,
+so a rewritten query is checked as soon as it ships.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import config
+import database
+from scheduler import POLICIES, LONGEST_QUEUE
+
+def traced(func, *args):
+    """Run func(*args) and return the statements it sent to SQLite"""
+    conn = database.get_connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        func(*args)
+    finally:
+        conn.set_trace_callback(None)
+    return [sql for sql in statements
+            if sql.lstrip().split(None, 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE')]
+
+def query_plan(sql):
+    cursor = database.get_connection().execute(f'EXPLAIN QUERY PLAN {sql}')
+    return [row[3] for row in cursor.fetchall()]
+
+@pytest.fixture
+def history(queue_db):
+    """A queue with a day of history, so a scan would be a real cost"""
+    queue_db(counters={'A': 2, 'B': 2}, counter_services={'A1': {'A': 2, 'B': 1}})
+    for i in range(200):
+        service_code = 'AB'[i % 2]
+        priority = database.PRIORITY_HIGH if i % 10 == 0 else database.PRIORITY_NORMAL
+        database.create_new_number(service_code, priority)
+    database.create_new_number('A', appointment_at=datetime.now() + timedelta(hours=1))
+    for _ in range(50):
+        database.get_next_number(1)
+        database.get_next_number(3)
+    conn = database.get_connection()
+    conn.execute('ANALYZE')
+    conn.commit()
+
+HOT_QUERIES = {
+    'claim': (database.get_next_number, 3),
+    'claim_multi_service': (database.get_next_number, 1),
+    'stats': (database.get_queue_stats, 'A'),  # issued total and next number
+    'queue_list': (database.get_queue_list, 1),
+    'has_waiting': (database.has_waiting_numbers, 1),
+}
+
+def assert_indexed(statements):
+    for sql in statements:
+        plan = query_plan(sql)
+        assert not [step for step in plan if step.startswith('SCAN')], (sql, plan)
+        assert any(step.startswith('SEARCH') for step in plan), (sql, plan)
+
+@pytest.mark.parametrize('name', sorted(HOT_QUERIES))
+def test_hot_query_uses_index(history, name):
+    func, arg = HOT_QUERIES[name]
+    statements = traced(func, arg)
+    assert statements, f"{name} ran no queries"
+    assert_indexed(statements)
+
+@pytest.mark.parametrize('policy', POLICIES)
+def test_multi_service_claim_counts_lines_only_for_longest_queue(history, policy):
+    settings = config.load_config()
+    settings['dispatch_policy'] = policy
+    assert config.save_config(settings)
+    statements = traced(database.get_next_number, 1)
+    assert bool([sql for sql in statements if 'COUNT(' in sql]) == (policy == LONGEST_QUEUE)
+    assert_indexed(statements)
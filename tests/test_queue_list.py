@@ -0,0 +1,21 @@
+"""The upcoming list of a counter serving several services"""
+import pytest
+
+import database
+
+@pytest.mark.parametrize('engine', [False, True], ids=['sql', 'engine'])
+def test_upcoming_list_matches_the_claim_order(queue_db, engine):
+    queue_db(counter_services={'A1': {'A': 2, 'B': 1}}, dispatch_policy='oldest_wait')
+    if engine:
+        database.start_engine()
+    normal, high = database.PRIORITY_NORMAL, database.PRIORITY_HIGH
+    for service_code, priority in [('A', normal), ('B', normal), ('A', normal),
+                                   ('B', high), ('C', normal), ('B', normal)]:
+        database.create_new_number(service_code, priority)
+
+    _, upcoming = database.get_queue_list(1, limit=4)
+    assert [number for number, _ in upcoming] == ['B002', 'A001', 'B001', 'A002']
+
+    claimed = [database.get_next_number(1) for _ in range(5)]
+    assert claimed == ['B002', 'A001', 'B001', 'A002', 'B003']
+    assert database.get_queue_list(1)[1] == []
@@ -0,0 +1,68 @@
+"""Queue service calls through RemoteQueue to a server on loopback"""
+import sqlite3
+import time
+
+import pytest
+
+import config
+import database
+import protocol
+from conftest import wait_until
+from remote_queue import RemoteQueue
+
+def test_config_change_does_not_stall_other_clients(queue_server, connect):
+    server, _ = queue_server
+    manager, counter, display = connect(), connect(), connect()
+    received = []
+
+    async def on_message(data):
+        received.append(data)
+    display.add_message_handler(on_message)
+
+    settings = config.load_config()
+    settings['counters'] = dict(settings['counters'], C=1)
+    assert config.save_config(settings)
+
+    # Reconciling the counters waits for this write lock
+    lock = sqlite3.connect(database.DB_FILE)
+    lock.execute('BEGIN IMMEDIATE')
+    try:
+        manager.send_nowait({'type': 'config_changed'})
+        time.sleep(0.2)
+        counter.send_nowait({'type': 'call_number', 'number': 'A001', 'counter_id': 1})
+        wait_until(lambda: any(data.get('number') == 'A001' for data in received), timeout=1)
+    finally:
+        lock.rollback()
+        lock.close()
+
+    queue = RemoteQueue(counter)
+    wait_until(lambda: 'Loket C1' in [row['name'] for row in queue.get_counter_list()])
+    wait_until(lambda: 'C' in {row['service_code'] for row in server.current.values()})
+
+@pytest.mark.parametrize('engine', [False, True], ids=['sql', 'engine'])
+def test_issue_claim_and_queue_list(queue_server, connect, engine):
+    if engine:
+        database.start_engine()
+    queue = RemoteQueue(connect())
+    assert [queue.create_new_number('A') for _ in range(3)] == ['A001', 'A002', 'A003']
+    assert queue.create_new_number('A', database.PRIORITY_HIGH) == 'A004'
+    assert queue.get_next_number(1) == 'A004'
+    assert queue.get_next_number(1) == 'A001'
+
+    called, upcoming = queue.get_queue_list(1)
+    assert sorted(row[0] for row in called) == ['A001', 'A004']
+    assert [row[0] for row in upcoming] == ['A002', 'A003']
+    assert all(isinstance(row, tuple) for row in called + upcoming)
+    assert queue.has_waiting_numbers(1)
+    assert queue.get_queue_stats('A')[0] == 4
+
+def test_failed_calls_raise_remote_error(queue_server, connect):
+    client = connect()
+    with pytest.raises(protocol.RemoteError, match='Unknown method'):
+        client.call('drop_table')
+    with pytest.raises(protocol.RemoteError):
+        client.call('claim', {'counter': 1})
+    with pytest.raises(protocol.RemoteError):
+        client.call('issue', {'service_code': 'A', 'appointment_at': 'not a time'})
+    # The connection survives failed calls
+    assert RemoteQueue(client).create_new_number('B') == 'B001'
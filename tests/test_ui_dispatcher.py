@@ -0,0 +1,102 @@
+"""UIDispatcher collapsing and frame budget.
+
+Frames are driven by hand through a stub root. With an X server (e.g.
+under xvfb-run) the stress test also runs against a real Tk root.
+"""
+import os
+import threading
+import time
+
+import pytest
+
+from conftest import StubRoot
+from ui_tasks import UIDispatcher, FRAME_RATE, FRAME_BUDGET
+
+def test_updates_with_a_key_collapse_to_the_latest():
+    root = StubRoot()
+    dispatcher = UIDispatcher(root)
+    applied = []
+    for i in range(100):
+        dispatcher.post(applied.append, ('counter 1', i), key=('counter', 1))
+        dispatcher.post(applied.append, ('counter 2', i), key=('counter', 2))
+    dispatcher.post(applied.append, ('status', 'connected'))
+
+    root.tick()
+    assert applied == [('counter 1', 99), ('counter 2', 99), ('status', 'connected')]
+    assert dispatcher.collapsed == 198
+
+def test_a_collapsed_update_moves_to_the_back():
+    root = StubRoot()
+    dispatcher = UIDispatcher(root)
+    applied = []
+    dispatcher.post(applied.append, 'a1', key='a')
+    dispatcher.post(applied.append, 'b1', key='b')
+    dispatcher.post(applied.append, 'a2', key='a')
+    root.tick()
+    assert applied == ['b1', 'a2']
+
+def test_frame_budget_defers_the_rest():
+    root = StubRoot()
+    dispatcher = UIDispatcher(root)
+    budget = FRAME_BUDGET / FRAME_RATE
+    cost = budget / 4
+    applied = []
+
+    def slow_update(i):
+        time.sleep(cost)
+        applied.append(i)
+
+    for i in range(40):
+        dispatcher.post(slow_update, i)
+    frames = 0
+    while len(applied) < 40:
+        began = time.perf_counter()
+        root.tick()
+        # At most one update may start just before the deadline
+        assert time.perf_counter() - began < budget + 2 * cost
+        frames += 1
+    assert frames >= 40 * cost / budget
+    assert applied == list(range(40))
+
+def stress(root, tick, seconds=1.0, rate=200, counters=10):
+    """Post rate events/s from a thread for seconds, driving frames with tick()"""
+    dispatcher = UIDispatcher(root)
+    shown = {}
+    posted = {}
+
+    def producer():
+        for i in range(int(seconds * rate)):
+            counter = i % counters
+            posted[counter] = i
+            dispatcher.post(shown.__setitem__, counter, i, key=('counter', counter))
+            time.sleep(1 / rate)
+
+    thread = threading.Thread(target=producer)
+    frame_times = []
+    thread.start()
+    while thread.is_alive():
+        began = time.perf_counter()
+        tick()
+        frame_times.append(time.perf_counter() - began)
+        time.sleep(1 / FRAME_RATE)
+    thread.join()
+    for _ in range(3):
+        tick()
+    return shown, posted, dispatcher, frame_times
+
+def test_stress_200_events_per_second():
+    root = StubRoot()
+    shown, posted, dispatcher, frame_times = stress(root, root.tick)
+    assert shown == posted
+    assert max(frame_times) < 1 / FRAME_RATE
+
+@pytest.mark.skipif(not os.environ.get('DISPLAY'), reason="needs an X server, e.g. xvfb-run")
+def test_stress_200_events_per_second_on_tk():
+    tk = pytest.importorskip('tkinter')
+    root = tk.Tk()
+    try:
+        shown, posted, dispatcher, frame_times = stress(root, root.update)
+        assert shown == posted
+        assert sorted(frame_times)[int(len(frame_times) * 0.99)] < 1 / FRAME_RATE
+    finally:
+        root.destroy()
@@ -0,0 +1,29 @@
+"""UIExecutor blocking measurements, driven through a stub root"""
+import time
+
+from conftest import StubRoot
+from ui_tasks import UIExecutor
+
+def run(executor, root, action, func, **callbacks):
+    assert executor.submit(action, func, **callbacks)
+    while action in executor.pending:
+        root.tick()
+        time.sleep(0.001)
+
+def test_dialogs_are_not_counted_as_blocking():
+    root = StubRoot()
+    executor = UIExecutor(root)
+    try:
+        def on_success(result):
+            time.sleep(0.02)  # updating the window
+            executor.dialog(time.sleep, 0.3)  # the user reading a message box
+
+        run(executor, root, 'take_number', lambda: 'A001', on_success=on_success)
+        run(executor, root, 'next_number', lambda: 1 / 0,
+            on_error=lambda e: executor.dialog(time.sleep, 0.3))
+    finally:
+        executor.shutdown()
+
+    max_ms = executor.histogram.max_ms
+    assert 20 <= max_ms['take_number'] < 250
+    assert max_ms['next_number'] < 250
@@ -2,12 +2,14 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 import json
 import logging
-import asyncio
-from database import create_connection, get_next_number, create_new_number
+from database import create_connection, get_next_number, PRIORITY_HIGH, PRIORITY_NORMAL
 from config import load_config, get_office_name, get_service_list
 from audio_manager import AudioManager
 import os
 from websocket_client import WebSocketClient
+from remote_queue import get_queue
+from ui_tasks import UIExecutor, UIDispatcher
+from wait_estimator import format_eta
 
 # Configure logging
 logging.basicConfig(
@@ -28,9 +30,9 @@ class TicketDisplay:
         # Load config
         self.config = load_config()
         
-        # Initialize WebSocket client
-        self.ws_client = WebSocketClient()
-        self.ws_client.start()
+        # Database work runs off the Tk thread
+        self.executor = UIExecutor(self.root)
+        self.dispatcher = UIDispatcher(self.root)
         
         # Main container
         main_container = ttk.Frame(self.root, padding="20")
@@ -40,64 +42,123 @@ class TicketDisplay:
         header_frame = ttk.Frame(main_container)
         header_frame.pack(fill=tk.X, pady=(0, 20))
         
-        office_name = get_office_name()
-        ttk.Label(header_frame, text=office_name, 
+        self.office_name = tk.StringVar(value=get_office_name())
+        ttk.Label(header_frame, textvariable=self.office_name, 
                  font=('Helvetica', 24, 'bold')).pack(side=tk.LEFT)
         
         # Services
-        services_frame = ttk.Frame(main_container)
-        services_frame.pack(fill=tk.BOTH, expand=True)
+        self.services_frame = ttk.Frame(main_container)
+        self.services_frame.pack(fill=tk.BOTH, expand=True)
+        self.buttons = {}
+        self.build_services()
+        
+        # Configure grid
+        self.services_frame.grid_columnconfigure(0, weight=1)
+        self.services_frame.grid_columnconfigure(1, weight=1)
+        
+        # Priority tickets go ahead of the normal ones of their service
+        self.priority = tk.BooleanVar(value=False)
+        ttk.Checkbutton(main_container, text="Prioritas (lansia/disabilitas/ibu hamil)",
+                        variable=self.priority).pack(pady=10)
         
-        # Create buttons for each service
+        # Initialize audio manager
+        audio_dir = os.path.join(os.path.dirname(__file__), 'audio')
+        self.audio_manager = AudioManager(audio_dir)
+        
+        # Predicted wait per service for a ticket taken now, pushed by the
+        # server with every queue event
+        self.etas = {}
+        
+        # Initialize WebSocket client, listening for queue events and
+        # config changes
+        self.ws_client = WebSocketClient(
+            topics=['type:new_number', 'type:call_number', 'type:config_changed'],
+            sync=True)  # snapshot with the current estimates on connect
+        self.ws_client.add_message_handler(self.on_message)
+        self.ws_client.start()
+        
+        # Tickets come from the local database or the queue server
+        self.queue = get_queue(self.ws_client)
+    
+    def build_services(self):
+        """Create a button for each configured service, replacing old ones"""
+        for child in self.services_frame.winfo_children():
+            child.destroy()
+        self.buttons = {}
         row = 0
         col = 0
         for service in get_service_list():
-            frame = ttk.LabelFrame(services_frame, text=service['name'])
+            frame = ttk.LabelFrame(self.services_frame, text=service['name'])
             frame.grid(row=row, column=col, padx=10, pady=10, sticky='nsew')
             
             ttk.Label(frame, text=service['description'],
                      wraplength=300).pack(pady=5)
             
-            ttk.Button(frame, text="Ambil Nomor Antrian",
-                      command=lambda s=service: self.take_number(s)).pack(pady=10)
+            button = ttk.Button(frame, text="Ambil Nomor Antrian",
+                                command=lambda s=service: self.take_number(s))
+            button.pack(pady=10)
+            self.buttons[service['code']] = button
             
             col += 1
             if col > 1:  # 2 columns
                 col = 0
                 row += 1
-        
-        # Configure grid
-        services_frame.grid_columnconfigure(0, weight=1)
-        services_frame.grid_columnconfigure(1, weight=1)
-        
-        # Initialize audio manager
-        audio_dir = os.path.join(os.path.dirname(__file__), 'audio')
-        self.audio_manager = AudioManager(audio_dir)
+    
+    async def on_message(self, data):
+        # Runs on the client thread
+        if data.get('type') == 'snapshot':
+            for service_code, stats in data.get('services', {}).items():
+                self.etas[service_code] = stats.get('eta')
+        elif 'eta' in data:
+            self.etas[data.get('service_code')] = data['eta']
+        elif data.get('type') == 'config_changed':
+            self.dispatcher.post(self.reload_config, key='reload_config')
+    
+    def reload_config(self):
+        """Show the office name and services from the changed configuration"""
+        logger.info("Configuration changed, rebuilding services")
+        self.config = load_config()
+        self.office_name.set(get_office_name())
+        self.build_services()
     
     def take_number(self, service):
-        number = None
-        try:
-            number = create_new_number(service['code'])
-            if number:
-                logger.info(f"Created new number: {number}")
-                messagebox.showinfo("Nomor Antrian", f"Nomor antrian anda: {number}")
-                
-                # Send WebSocket notification
-                message = {
-                    'type': 'new_number',
-                    'number': number,
-                    'service': service['code']
-                }
-                asyncio.run(self.ws_client.send_message(message))
-                
-                # Play notification
-                self.audio_manager.play_notification()
-            else:
-                logger.error("Failed to create new number")
-                messagebox.showerror("Error", "Gagal mengambil nomor antrian")
-        except Exception as e:
-            logger.error(f"Error taking number: {e}")
-            messagebox.showerror("Error", "Terjadi kesalahan sistem")
+        # Issue the number on a worker thread, the result comes back here
+        priority = PRIORITY_HIGH if self.priority.get() else PRIORITY_NORMAL
+        self.priority.set(False)  # one priority ticket per check
+        self.executor.submit(
+            f"take_number:{service['code']}", self.queue.create_new_number, service['code'], priority,
+            on_success=lambda number: self.on_number_taken(service, number, priority),
+            on_error=lambda e: self.executor.dialog(
+                messagebox.showerror, "Error", "Terjadi kesalahan sistem"),
+            button=self.buttons.get(service['code']), pending_text="Mencetak...")
+    
+    def on_number_taken(self, service, number, priority=PRIORITY_NORMAL):
+        """Show and announce an issued number, runs on the Tk thread"""
+        if number:
+            logger.info(f"Created new number: {number}")
+            
+            # Send WebSocket notification
+            message = {
+                'type': 'new_number',
+                'number': number,
+                'service': service['code'],
+                'priority': priority
+            }
+            self.ws_client.send_nowait(message)
+            
+            # Play notification
+            self.audio_manager.play_notification()
+            
+            message = f"Nomor antrian anda: {number}"
+            eta = self.etas.get(service['code'])
+            if priority:
+                message += "\nNomor prioritas, anda akan dipanggil lebih dahulu"
+            elif eta is not None:
+                message += f"\nPerkiraan waktu tunggu: {format_eta(eta)}"
+            self.executor.dialog(messagebox.showinfo, "Nomor Antrian", message)
+        else:
+            logger.error("Failed to create new number")
+            self.executor.dialog(messagebox.showerror, "Error", "Gagal mengambil nomor antrian")
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,190 @@
+import bisect
+import itertools
+import logging
+import queue
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger('UITasks')
+
+# Tk ticks per second for UIDispatcher and the share of a tick it may use
+FRAME_RATE = 60
+FRAME_BUDGET = 0.5
+
+# Upper bounds in milliseconds of the UI blocking histogram buckets
+BLOCK_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+class BlockingHistogram:
+    """Counts how long the Tk thread was blocked per action"""
+
+    def __init__(self, buckets_ms=BLOCK_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.counts = {}  # action -> count per bucket, the last one is overflow
+        self.max_ms = {}
+
+    def record(self, action, seconds):
+        ms = seconds * 1000
+        counts = self.counts.setdefault(action, [0] * (len(self.buckets_ms) + 1))
+        counts[bisect.bisect_left(self.buckets_ms, ms)] += 1
+        self.max_ms[action] = max(self.max_ms.get(action, 0.0), ms)
+
+    def snapshot(self):
+        """Get {action: {'<=N ms': count, ..., 'max_ms': ...}}"""
+        labels = [f"<={bound} ms" for bound in self.buckets_ms] + [f">{self.buckets_ms[-1]} ms"]
+        return {
+            action: dict(zip(labels, counts), max_ms=self.max_ms[action])
+            for action, counts in self.counts.items()
+        }
+
+class UIExecutor:
+    """Runs blocking work off the Tk thread and hands results back to it.
+
+    Work runs on a small thread pool. Results are put on a queue that the
+    Tk thread drains every poll_interval ms through root.after, so the
+    callbacks always run on the Tk thread.
+    """
+
+    def __init__(self, root, max_workers=4, poll_interval=20):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ui-worker')
+        self.results = queue.SimpleQueue()
+        self.pending = set()
+        self.histogram = BlockingHistogram()
+        self.dialog_time = 0.0  # seconds spent in modal dialogs, see dialog()
+        self.root.after(self.poll_interval, self._poll)
+
+    @contextmanager
+    def measure(self, action):
+        """Record how long the enclosed Tk-thread code blocks.
+
+        Time spent in dialogs opened through dialog() is left out, the
+        user reading a message box is not the UI being blocked.
+        """
+        start = time.perf_counter()
+        dialog_start = self.dialog_time
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start - (self.dialog_time - dialog_start)
+            self.histogram.record(action, elapsed)
+
+    def dialog(self, show, *args, **kwargs):
+        """Open a modal dialog, e.g. messagebox.showinfo, outside measure()"""
+        start = time.perf_counter()
+        try:
+            return show(*args, **kwargs)
+        finally:
+            self.dialog_time += time.perf_counter() - start
+
+    def submit(self, action, func, *args, on_success=None, on_error=None,
+               button=None, pending_text=None):
+        """Run func(*args) on the pool, then on_success(result) on the Tk thread.
+
+        While an action is running further submits of it are ignored, which
+        debounces double-clicks. The optional button is disabled and shows
+        pending_text until the work completes. Returns False if debounced.
+        """
+        if action in self.pending:
+            logger.debug(f"Ignoring repeated {action} while it is still running")
+            return False
+
+        with self.measure(action):
+            self.pending.add(action)
+            restore = self._set_pending(button, pending_text)
+            future = self.pool.submit(func, *args)
+            future.add_done_callback(
+                lambda f: self.results.put((action, f, on_success, on_error, restore)))
+        return True
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+    def _set_pending(self, button, pending_text):
+        if button is None:
+            return None
+        original_text = button.cget('text')
+        button.state(['disabled'])
+        if pending_text:
+            button.configure(text=pending_text)
+
+        def restore():
+            if not button.winfo_exists():
+                return  # rebuilt while the work was running
+            button.configure(text=original_text)
+            button.state(['!disabled'])
+        return restore
+
+    def _poll(self):
+        try:
+            while True:
+                action, future, on_success, on_error, restore = self.results.get_nowait()
+                self.pending.discard(action)
+                with self.measure(action):
+                    if restore:
+                        restore()
+                    error = future.exception()
+                    if error is not None:
+                        logger.error(f"Error in {action}: {error}")
+                        if on_error:
+                            on_error(error)
+                    elif on_success:
+                        on_success(future.result())
+        except queue.Empty:
+            pass
+        except Exception as e:
+            logger.error(f"Error delivering UI task result: {e}")
+        finally:
+            self.root.after(self.poll_interval, self._poll)
+
+class UIDispatcher:
+    """Applies updates from background threads on the Tk thread.
+
+    Producers append to a deque, which is safe without a lock. Once per
+    frame the Tk thread moves everything posted into an ordered pending
+    map and runs it until the frame budget is spent, leaving the rest for
+    the next frame. Updates posted with the same key collapse into the
+    latest one, which also moves to the back so newer state is applied
+    last.
+    """
+
+    def __init__(self, root, frame_rate=FRAME_RATE, budget=FRAME_BUDGET):
+        self.root = root
+        self.interval = max(1, int(1000 / frame_rate))
+        self.budget = budget / frame_rate  # seconds per frame
+        self.inbox = deque()
+        self.pending = OrderedDict()
+        self.sequence = itertools.count()
+        self.collapsed = 0
+        self.root.after(self.interval, self._drain)
+
+    def post(self, func, *args, key=None):
+        """Schedule func(*args) on the Tk thread, from any thread"""
+        self.inbox.append((key, func, args))
+
+    def set_var(self, var, value):
+        """Set a Tk variable from any thread, only the latest value is applied"""
+        self.post(var.set, value, key=('var', str(var)))
+
+    def _drain(self):
+        try:
+            while self.inbox:
+                key, func, args = self.inbox.popleft()
+                if key is None:
+                    key = ('seq', next(self.sequence))
+                elif key in self.pending:
+                    del self.pending[key]
+                    self.collapsed += 1
+                self.pending[key] = (func, args)
+
+            deadline = time.perf_counter() + self.budget
+            while self.pending and time.perf_counter() < deadline:
+                _, (func, args) = self.pending.popitem(last=False)
+                try:
+                    func(*args)
+                except Exception as e:
+                    logger.error(f"Error applying UI update: {e}")
+        finally:
+            self.root.after(self.interval, self._drain)
@@ -0,0 +1,124 @@
+import logging
+import time
+
+logger = logging.getLogger('WaitEstimator')
+
+class EWMA:
+    """Exponentially weighted moving average, None until the first sample"""
+    __slots__ = ('alpha', 'value')
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.value = None
+
+    def update(self, sample):
+        if self.value is None:
+            self.value = sample
+        else:
+            self.value += self.alpha * (sample - self.value)
+        return self.value
+
+class _Rate:
+    """Call interval statistics of one service or counter"""
+    __slots__ = ('interval', 'last_call', 'idle', 'service_code')
+
+    def __init__(self, alpha, service_code=None):
+        self.interval = EWMA(alpha)
+        self.last_call = None
+        self.idle = True
+        self.service_code = service_code
+
+class WaitEstimator:
+    """Streaming service rates and wait predictions from call events.
+
+    Every claim updates an EWMA of the time between calls, per service and
+    per counter, in O(1). Gaps that follow an empty queue are idle time and
+    are skipped, as are gaps longer than max_interval (breaks, closing).
+    The ETA of a waiting ticket is its position in line times the mean
+    call interval of its service, less the time since the last call.
+    Times are wall-clock seconds, see time.time().
+    """
+
+    def __init__(self, alpha=0.1, default_service_time=300.0, max_interval=1800.0,
+                 idle_after=900.0):
+        self.alpha = alpha
+        self.default_service_time = default_service_time
+        self.max_interval = max_interval
+        # Counters without a call for this long no longer count towards a
+        # service's rate while it has no statistics of its own
+        self.idle_after = idle_after
+        self.services = {}  # service_code -> _Rate
+        self.counters = {}  # counter_id -> _Rate
+
+    def record_call(self, service_code, counter_id=None, waiting=1, now=None):
+        """Update the rates from a claimed ticket.
+
+        waiting is the number of tickets still waiting after the claim, an
+        empty queue makes the next gap idle time.
+        """
+        now = time.time() if now is None else now
+        rate = self.services.get(service_code)
+        if rate is None:
+            rate = self.services[service_code] = _Rate(self.alpha)
+        self._update(rate, now, waiting)
+
+        if counter_id is not None:
+            rate = self.counters.get(counter_id)
+            if rate is None or rate.service_code != service_code:
+                rate = self.counters[counter_id] = _Rate(self.alpha, service_code)
+            self._update(rate, now, waiting)
+
+    def _update(self, rate, now, waiting):
+        if rate.last_call is not None and not rate.idle:
+            gap = now - rate.last_call
+            if 0 <= gap <= self.max_interval:
+                rate.interval.update(gap)
+        rate.last_call = now
+        rate.idle = waiting == 0
+
+    def service_interval(self, service_code, now=None):
+        """Get the mean seconds between two calls of a service.
+
+        Falls back to the combined rate of the service's recently active
+        counters, then to default_service_time.
+        """
+        rate = self.services.get(service_code)
+        if rate is not None and rate.interval.value:
+            return rate.interval.value
+
+        now = time.time() if now is None else now
+        calls_per_second = sum(
+            1 / counter.interval.value for counter in self.counters.values()
+            if counter.service_code == service_code and counter.interval.value
+            and now - counter.last_call <= self.idle_after)
+        if calls_per_second:
+            return 1 / calls_per_second
+        return self.default_service_time
+
+    def counter_interval(self, counter_id):
+        """Get the mean seconds a counter spends per ticket, None if unknown"""
+        rate = self.counters.get(counter_id)
+        return rate.interval.value if rate else None
+
+    def eta(self, service_code, position, now=None):
+        """Predict the seconds until a ticket with position tickets ahead is called"""
+        now = time.time() if now is None else now
+        interval = self.service_interval(service_code, now)
+        eta = (position + 1) * interval
+        rate = self.services.get(service_code)
+        if rate is not None and rate.last_call is not None and not rate.idle:
+            # Part of the current interval has already passed
+            eta -= min(now - rate.last_call, interval)
+        return eta
+
+    def etas(self, service_code, count, now=None):
+        """Predict the ETA of the first count waiting tickets of a service"""
+        now = time.time() if now is None else now
+        return [self.eta(service_code, position, now) for position in range(count)]
+
+def format_eta(seconds):
+    """Format an ETA for display, e.g. '± 12 menit'"""
+    if seconds is None:
+        return '-'
+    minutes = round(seconds / 60)
+    return f"± {minutes} menit" if minutes >= 1 else "< 1 menit"
@@ -1,8 +1,13 @@
 import asyncio
+import itertools
 import websockets
 import json
 import logging
+import random
+from collections import deque
 from threading import Thread
+import protocol
+from config import get_server_uri
 
 # Configure logging
 logging.basicConfig(
@@ -11,103 +16,275 @@ logging.basicConfig(
 )
 logger = logging.getLogger('WebSocketClient')
 
+# Messages held while disconnected, the oldest are dropped beyond this
+OUTBOX_SIZE = 100
+
+# Seconds a queue service call waits for a connection and for its reply
+REQUEST_TIMEOUT = 10
+
 class WebSocketClient:
-    def __init__(self):
+    def __init__(self, topics=None, encoding=protocol.JSON, sync=False, outbox_size=OUTBOX_SIZE,
+                 uri=None):
+        """Create a client subscribed to the given server topics.
+
+        None receives every message, an empty list receives none. The
+        encoding is the wire format asked from the server for events. With
+        sync the client asks for a board snapshot on connect, or for the
+        events it missed when reconnecting. The server is the configured
+        one unless uri is given.
+        """
+        self.topics = topics
+        self.encoding = encoding
+        self.sync = sync
         self.websocket = None
         self.connected = False
-        self.reconnect_interval = 5  # seconds
-        self.uri = "ws://localhost:8765"
+        self.uri = uri or get_server_uri()
+        # Reconnect delay doubles from min to max, with random jitter
+        self.reconnect_min = 0.5  # seconds
+        self.reconnect_max = 30   # seconds
+        self.loop = None
         self.connection_thread = None
+        self.outbox = deque(maxlen=outbox_size)
         self.message_handlers = []
+        self.batch_handlers = []
+        self.status_handlers = []
+        # Position in the server's event stream, used to resume on reconnect
+        self.epoch = None
+        self.last_seq = None
+        # Queue service calls awaiting their reply, by request id
+        self.requests = {}
+        self.request_ids = itertools.count(1)
+        self.ready = None  # asyncio.Event set while connected
         logger.debug("WebSocketClient initialized")
-    
+
     def start(self):
-        """Start WebSocket client in a separate thread"""
+        """Start the client's event loop in a background thread"""
         logger.debug("Starting WebSocket client")
         if not self.connection_thread:
+            self.loop = asyncio.new_event_loop()
             self.connection_thread = Thread(target=self._run_client, daemon=True)
             self.connection_thread.start()
             logger.info("WebSocket client thread started")
-    
+
     def _run_client(self):
         """Run the WebSocket client event loop"""
         logger.debug("Setting up client event loop")
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
+        asyncio.set_event_loop(self.loop)
+        self.ready = asyncio.Event()
+        self.loop.run_until_complete(self._reconnect_forever())
+
+    async def _reconnect_forever(self):
+        """Keep a connection open, backing off exponentially between attempts"""
+        attempt = 0
         while True:
-            try:
-                logger.debug("Attempting to connect to WebSocket server")
-                loop.run_until_complete(self._connect_and_listen())
-            except Exception as e:
-                logger.error(f"WebSocket connection error: {e}")
-            
-            # Wait before reconnecting
-            logger.debug(f"Waiting {self.reconnect_interval} seconds before reconnecting")
-            loop.run_until_complete(asyncio.sleep(self.reconnect_interval))
-    
+            logger.debug("Attempting to connect to WebSocket server")
+            if await self._connect_and_listen():
+                attempt = 0
+            delay = min(self.reconnect_max, self.reconnect_min * 2 ** attempt)
+            delay *= random.uniform(0.5, 1.0)
+            attempt += 1
+            logger.debug(f"Waiting {delay:.1f} seconds before reconnecting")
+            await asyncio.sleep(delay)
+
     async def _connect_and_listen(self):
-        """Connect to WebSocket server and listen for messages"""
+        """Connect to WebSocket server and listen for messages.
+
+        Returns True if a connection was established.
+        """
+        established = False
         try:
             logger.debug(f"Connecting to {self.uri}")
             async with websockets.connect(self.uri) as websocket:
+                if self.encoding != protocol.JSON:
+                    await websocket.send(json.dumps({'type': 'hello', 'encoding': self.encoding,
+                                                     'version': protocol.PROTOCOL_VERSION}))
+                if self.topics is not None:
+                    await websocket.send(json.dumps({'type': 'subscribe', 'topics': list(self.topics)}))
+                if self.sync:
+                    await websocket.send(json.dumps({
+                        'type': 'sync',
+                        'epoch': self.epoch,
+                        'last_seq': self.last_seq
+                    }))
+
                 self.websocket = websocket
                 self.connected = True
+                self.ready.set()
+                established = True
                 logger.info("Successfully connected to WebSocket server")
-                
+                self._notify_status(True)
+                await self._flush_outbox()
+
                 while True:
                     try:
                         message = await websocket.recv()
-                        logger.debug(f"Received message: {message}")
+                        logger.debug(f"Received message: {message!r}")
                         await self._handle_message(message)
                     except websockets.exceptions.ConnectionClosed:
                         logger.warning("WebSocket connection closed")
                         break
                     except Exception as e:
                         logger.error(f"Error handling message: {e}")
-        
+
         except Exception as e:
             logger.error(f"Connection error: {e}")
         finally:
             self.connected = False
             self.websocket = None
+            self.ready.clear()
+            # Replies to calls in flight are lost with the connection
+            for future in self.requests.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection to server lost"))
+            if established:
+                self._notify_status(False)
             logger.info("WebSocket connection cleaned up")
-    
+        return established
+
     async def _handle_message(self, message):
         """Handle incoming messages"""
         try:
-            data = json.loads(message)
+            data = protocol.decode(message)
             logger.debug(f"Processing message: {data}")
-            for handler in self.message_handlers:
-                await handler(data)
-        except json.JSONDecodeError:
-            logger.error(f"Invalid JSON received: {message}")
+            if data.get('type') == protocol.RPC_RESULT:
+                self._resolve(data)
+                return
+            # A batch is handed to the handlers event by event in one pass
+            events = data['events'] if data.get('type') == 'batch' else [data]
+            for event in events:
+                if event.get('type') == 'snapshot':
+                    self.epoch = event['epoch']
+                if 'seq' in event:
+                    self.last_seq = event['seq']
+                for handler in self.message_handlers:
+                    await handler(event)
+            for handler in self.batch_handlers:
+                await handler(events)
+        except (json.JSONDecodeError, ValueError):
+            logger.error(f"Invalid message received: {message!r}")
         except Exception as e:
             logger.error(f"Error in message handler: {e}")
-    
+
     async def send_message(self, message):
-        """Send a message to the WebSocket server"""
+        """Send a message to the WebSocket server, buffering it if disconnected.
+
+        Must run on the client's own event loop, other threads should use
+        send_nowait().
+        """
         if not self.connected or not self.websocket:
-            logger.warning("Not connected to server, cannot send message")
+            self._buffer(message)
             return False
-        
+
         try:
             await self.websocket.send(json.dumps(message))
             logger.debug(f"Message sent successfully: {message}")
             return True
         except Exception as e:
             logger.error(f"Error sending message: {e}")
-            self.connected = False
-            self.websocket = None
+            self._buffer(message)
             return False
-    
-    def add_message_handler(self, handler):
-        """Add a message handler function"""
-        self.message_handlers.append(handler)
-        logger.debug(f"Added message handler, total handlers: {len(self.message_handlers)}")
-    
+
+    def _resolve(self, data):
+        """Complete the call a queue service reply belongs to"""
+        future = self.requests.get(data.get('id'))
+        if future is None or future.done():
+            logger.warning(f"Reply to unknown or expired request {data.get('id')}")
+        elif 'error' in data:
+            future.set_exception(protocol.RemoteError(data['error']))
+        else:
+            future.set_result(data.get('result'))
+
+    async def request(self, method, params=None, timeout=REQUEST_TIMEOUT):
+        """Call a queue service method on the server and return its result.
+
+        Must run on the client's own event loop, other threads should use
+        call(). Unlike send_message() a call is never buffered: it waits up
+        to timeout for a connection, then for the reply, so a call that
+        timed out cannot reach the server later. Raises TimeoutError,
+        ConnectionError, or protocol.RemoteError if the server failed it.
+        """
+        return await asyncio.wait_for(self._request(method, params), timeout)
+
+    async def _request(self, method, params):
+        await self.ready.wait()
+        request_id = next(self.request_ids)
+        future = self.requests[request_id] = self.loop.create_future()
+        try:
+            await self.websocket.send(json.dumps({
+                'type': protocol.RPC,
+                'id': request_id,
+                'method': method,
+                'params': params or {}
+            }))
+            return await future
+        except websockets.exceptions.ConnectionClosed as e:
+            raise ConnectionError("Connection to server lost") from e
+        finally:
+            del self.requests[request_id]
+
+    def call(self, method, params=None, timeout=REQUEST_TIMEOUT):
+        """Blocking request() for other threads, e.g. UIExecutor workers"""
+        if self.loop is None:
+            raise ConnectionError("WebSocket client not started")
+        return asyncio.run_coroutine_threadsafe(
+            self.request(method, params, timeout), self.loop).result()
+
+    def send_nowait(self, message):
+        """Schedule a message from any thread without waiting for it.
+
+        Returns a concurrent.futures.Future resolving to whether the message
+        went out immediately, or None if the client was never started.
+        """
+        if self.loop is None:
+            logger.warning("WebSocket client not started, message dropped")
+            return None
+        return asyncio.run_coroutine_threadsafe(self.send_message(message), self.loop)
+
+    def _buffer(self, message):
+        if len(self.outbox) == self.outbox.maxlen:
+            logger.warning("Outbound buffer full, dropping oldest message")
+        self.outbox.append(message)
+        logger.debug(f"Not connected, buffered message ({len(self.outbox)} pending)")
+
+    async def _flush_outbox(self):
+        """Send the messages buffered while disconnected, oldest first"""
+        while self.outbox and self.connected:
+            message = self.outbox.popleft()
+            try:
+                await self.websocket.send(json.dumps(message))
+            except Exception as e:
+                logger.error(f"Error sending buffered message: {e}")
+                self.outbox.appendleft(message)
+                return
+        logger.debug("Outbound buffer flushed")
+
+    def _notify_status(self, connected):
+        for handler in self.status_handlers:
+            try:
+                handler(connected)
+            except Exception as e:
+                logger.error(f"Error in status handler: {e}")
+
+    def add_message_handler(self, handler, batch=False):
+        """Add a message handler function.
+
+        Handlers are called with each event. With batch the handler is
+        instead called once per received frame with the list of its events.
+        """
+        handlers = self.batch_handlers if batch else self.message_handlers
+        handlers.append(handler)
+        logger.debug(f"Added message handler, total handlers: {len(handlers)}")
+
     def remove_message_handler(self, handler):
         """Remove a message handler function"""
-        if handler in self.message_handlers:
-            self.message_handlers.remove(handler)
-            logger.debug(f"Removed message handler, remaining handlers: {len(self.message_handlers)}")
+        for handlers in (self.message_handlers, self.batch_handlers):
+            if handler in handlers:
+                handlers.remove(handler)
+                logger.debug(f"Removed message handler, remaining handlers: {len(handlers)}")
+
+    def add_status_handler(self, handler):
+        """Add a function called with True/False when the connection changes.
+
+        Handlers run on the client thread.
+        """
+        self.status_handlers.append(handler)
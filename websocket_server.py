@@ -1,10 +1,26 @@
+import argparse
 import asyncio
+import functools
 import websockets
 import json
 import logging
 import signal
 import sys
 import platform
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import protocol
+from database import (get_service_stats, get_current_numbers, get_calls_since,
+                      business_date, business_day_start, create_new_number,
+                      get_next_number, get_queue_stats, get_counter_list,
+                      has_waiting_numbers, get_queue_list, init_database,
+                      start_engine, stop_engine, sync_counters, PRIORITY_NORMAL)
+from wait_estimator import WaitEstimator
+from config import (get_batch_window_ms, add_config_listener, start_watcher,
+                    get_server_address, get_remote_queue)
+from rollover import RolloverScheduler
 
 # Set up logging
 logging.basicConfig(
@@ -13,57 +29,469 @@ logging.basicConfig(
 )
 logger = logging.getLogger('WebSocketServer')
 
+# Messages buffered per client before it counts as too slow
+SEND_QUEUE_SIZE = 100
+
+# Recent events kept for clients resuming after a reconnect
+HISTORY_SIZE = 1000
+
+# Threads running queue service calls, so the event loop never waits on
+# the database
+RPC_WORKERS = 4
+
+def issue(service_code, priority=PRIORITY_NORMAL, appointment_at=None):
+    """Issue a ticket, appointment_at is a local time in ISO format"""
+    if appointment_at is not None:
+        appointment_at = datetime.fromisoformat(appointment_at)
+    return create_new_number(service_code, priority, appointment_at)
+
+# Queue service methods clients may call, see WebSocketServer.rpc()
+RPC_METHODS = {
+    'issue': issue,
+    'claim': get_next_number,
+    'stats': get_queue_stats,
+    'service_stats': get_service_stats,
+    'counters': get_counter_list,
+    'has_waiting': has_waiting_numbers,
+    'queue_list': get_queue_list
+}
+
 class WebSocketServer:
-    def __init__(self):
-        self.clients = set()
+    def __init__(self, send_queue_size=SEND_QUEUE_SIZE, history_size=HISTORY_SIZE,
+                 batch_window=None):
+        self.clients = {}  # websocket -> outgoing message queue
+        self.topics = {}   # topic -> websockets subscribed to it
+        self.subscriptions = {}  # websocket -> its topics
+        self.unfiltered = set()  # clients without a subscription get everything
+        self.send_queue_size = send_queue_size
         self.lock = asyncio.Lock()
         self.running = True
+        # service_code -> {'total': issued count, 'waiting': deque of numbers
+        # in claim order, 'priorities': {number: priority} of priority tickets}
+        self.stats = {}
+        # counter_id -> {'counter_id', 'counter_name', 'service_code', 'number'}
+        self.current = {}
+        # Events are numbered within an epoch, which changes on every restart
+        self.epoch = uuid.uuid4().hex
+        self.seq = 0
+        self.history = deque(maxlen=history_size)  # (seq, data, topics)
+        self.encodings = {}  # websocket -> wire encoding, absent = JSON
+        # Optional batching: events within batch_window seconds go out as one
+        # frame, keeping only the latest call per counter
+        self.batch_window = batch_window
+        self.pending = {}  # coalescing key -> (data, sender, topics)
+        self.batch_handle = None
+        # Service rates from the calls seen, for wait time predictions
+        self.estimator = WaitEstimator()
+        self.rpc_executor = ThreadPoolExecutor(max_workers=RPC_WORKERS,
+                                               thread_name_prefix='rpc')
+        self.rpc_tasks = set()
+
+    def load_state(self):
+        """Load queue totals and current numbers from the database.
+
+        Runs at startup and again when the configuration changed, replacing
+        the state so removed counters disappear from the board.
+        """
+        try:
+            stats = {}
+            for service_code, service in get_service_stats().items():
+                stats[service_code] = {
+                    'total': service['total'],
+                    'waiting': deque(service['waiting']),
+                    'priorities': dict(service.get('priorities', {}))
+                }
+            current = {}
+            for counter_id, counter_name, service_code, number in get_current_numbers():
+                current[counter_id] = {
+                    'counter_id': counter_id,
+                    'counter_name': counter_name,
+                    'service_code': service_code,
+                    'number': number
+                }
+            # Learn today's service rates from the calls made so far
+            estimator = WaitEstimator()
+            for service_code, counter_id, called_at in get_calls_since(
+                    business_day_start(business_date())):
+                called = datetime.strptime(called_at, '%Y-%m-%d %H:%M:%S')
+                estimator.record_call(service_code, counter_id,
+                                      now=called.replace(tzinfo=timezone.utc).timestamp())
+            self.stats, self.current, self.estimator = stats, current, estimator
+            logger.info(f"Loaded queue state for {len(self.stats)} services "
+                        f"and {len(self.current)} counters")
+        except Exception as e:
+            logger.error(f"Error loading queue state: {str(e)}")
+
+    def snapshot(self, websocket=None):
+        """Build the full board state, limited to a client's subscription"""
+        topics = self.subscriptions.get(websocket)
+
+        def wanted(data):
+            return topics is None or not topics.isdisjoint(self.message_topics(data))
+
+        # Clients that do not filter by service, e.g. kiosks subscribed to
+        # event types only, get the stats of every service
+        all_services = topics is None or not any(topic.startswith('service:') for topic in topics)
+        services = {}
+        for service_code, stats in self.stats.items():
+            if all_services or f"service:{service_code}" in topics:
+                waiting = stats['waiting']
+                services[service_code] = {
+                    'total': stats['total'],
+                    'waiting': len(waiting),
+                    'next_number': waiting[0] if waiting else None,
+                    'eta': self.eta(service_code)
+                }
+        counters = [dict(counter, type='call_number') for counter in self.current.values()]
+        return {
+            'type': 'snapshot',
+            'epoch': self.epoch,
+            'seq': self.seq,
+            'counters': [counter for counter in counters if wanted(counter)],
+            'services': services
+        }
+
+    def sync(self, websocket, epoch=None, last_seq=None):
+        """Bring a (re)connecting client up to date.
+
+        A client resuming within the current epoch gets only the events it
+        missed, if they are still in the history and fit in its send queue.
+        Anyone else gets a snapshot.
+        """
+        if (epoch == self.epoch and last_seq is not None and last_seq <= self.seq
+                and (last_seq == self.seq or (self.history and self.history[0][0] <= last_seq + 1))):
+            topics = self.subscriptions.get(websocket)
+            encoding = self.encodings.get(websocket, protocol.JSON)
+            missed = [data for seq, data, message_topics in self.history
+                      if seq > last_seq and (topics is None or not topics.isdisjoint(message_topics))]
+            queue = self.clients.get(websocket)
+            # The queue cannot drain while we fill it, events beyond its
+            # free space would be dropped and the client left stale
+            if queue is not None and len(missed) <= queue.maxsize - queue.qsize():
+                logger.info(f"Replaying {len(missed)} missed events to client")
+                for data in missed:
+                    self.send_to(websocket, protocol.encode(data, encoding))
+                return
+            logger.info(f"{len(missed)} missed events do not fit the send queue, sending a snapshot")
+        self.send_to(websocket, json.dumps(self.snapshot(websocket)))
+
+    def set_encoding(self, websocket, encoding, version=protocol.FIRST_VERSION):
+        """Switch a client to the wire encoding it asked for in its hello.
+
+        Binary frames are only sent to clients of our protocol version,
+        others could not decode them and get JSON.
+        """
+        if encoding not in protocol.ENCODINGS:
+            logger.warning(f"Unknown encoding {encoding!r} requested, using JSON")
+            encoding = protocol.JSON
+        elif encoding == protocol.BINARY and version != protocol.PROTOCOL_VERSION:
+            logger.warning(f"Client speaks protocol version {version}, not "
+                           f"{protocol.PROTOCOL_VERSION}, using JSON")
+            encoding = protocol.JSON
+        self.encodings[websocket] = encoding
+        logger.info(f"Client uses {encoding} encoding")
+
+    def send_to(self, websocket, message):
+        """Queue a message for a single client"""
+        queue = self.clients.get(websocket)
+        if queue is None:
+            return
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.warning("Client send queue full, message dropped")
+
+    def eta(self, service_code):
+        """Get the predicted wait in whole seconds for a ticket taken now"""
+        waiting = self.stats.get(service_code, {}).get('waiting', ())
+        return round(self.estimator.eta(service_code, len(waiting)))
+
+    def apply_event(self, data):
+        """Update running state from an event and attach the totals to it"""
+        msg_type = data.get('type')
+        number = data.get('number')
+        if msg_type not in ('new_number', 'call_number') or not number:
+            return data
+
+        service_code = data.get('service') or data.get('service_code') or number[0]
+        stats = self.stats.setdefault(service_code, {'total': 0, 'waiting': deque(), 'priorities': {}})
+        waiting = stats['waiting']
+        priorities = stats['priorities']
+
+        if msg_type == 'new_number':
+            stats['total'] += 1
+            priority = data.get('priority') or 0
+            if priority:
+                # Ahead of every ticket with a lower priority
+                priorities[number] = priority
+                position = next((i for i, other in enumerate(waiting)
+                                 if priorities.get(other, 0) < priority), len(waiting))
+                waiting.insert(position, number)
+            else:
+                waiting.append(number)
+        elif waiting and waiting[0] == number:
+            waiting.popleft()
+            priorities.pop(number, None)
+        elif number in waiting:
+            waiting.remove(number)
+            priorities.pop(number, None)
+
+        if msg_type == 'call_number':
+            self.estimator.record_call(service_code, data.get('counter_id'), len(waiting))
+
+        if msg_type == 'call_number' and data.get('counter_id') is not None:
+            self.current[data['counter_id']] = {
+                'counter_id': data['counter_id'],
+                'counter_name': data.get('counter_name', f"Counter {data['counter_id']}"),
+                'service_code': service_code,
+                'number': number
+            }
+
+        data['service_code'] = service_code
+        data['total'] = stats['total']
+        data['waiting'] = len(waiting)
+        data['next_number'] = waiting[0] if waiting else None
+        data['eta'] = self.eta(service_code)
+        return data
 
     async def register(self, websocket):
+        queue = asyncio.Queue(maxsize=self.send_queue_size)
         async with self.lock:
-            self.clients.add(websocket)
+            self.clients[websocket] = queue
+            self.unfiltered.add(websocket)
             logger.info(f"Client connected. Total clients: {len(self.clients)}")
+        return asyncio.create_task(self.sender(websocket, queue))
 
     async def unregister(self, websocket):
         async with self.lock:
             if websocket in self.clients:
-                self.clients.remove(websocket)
+                self.unsubscribe(websocket)
+                self.unfiltered.discard(websocket)
+                self.encodings.pop(websocket, None)
+                del self.clients[websocket]
                 logger.info(f"Client disconnected. Total clients: {len(self.clients)}")
 
-    async def broadcast(self, message):
+    def subscribe(self, websocket, topics):
+        """Replace a client's topics, e.g. 'service:A', 'counter:3', 'type:call_number'"""
+        self.unsubscribe(websocket)
+        self.unfiltered.discard(websocket)
+        topics = set(topics)
+        self.subscriptions[websocket] = topics
+        for topic in topics:
+            self.topics.setdefault(topic, set()).add(websocket)
+        logger.info(f"Client subscribed to {sorted(topics)}")
+
+    def unsubscribe(self, websocket):
+        """Drop a client's topics so it receives every message again"""
+        if websocket in self.clients:
+            self.unfiltered.add(websocket)
+        for topic in self.subscriptions.pop(websocket, ()):
+            subscribers = self.topics.get(topic)
+            if subscribers:
+                subscribers.discard(websocket)
+                if not subscribers:
+                    del self.topics[topic]
+
+    @staticmethod
+    def message_topics(data):
+        """Get the topics a message is published under"""
+        topics = [f"type:{data.get('type')}"]
+        if data.get('service_code'):
+            topics.append(f"service:{data['service_code']}")
+        if data.get('counter_id') is not None:
+            topics.append(f"counter:{data['counter_id']}")
+        return topics
+
+    def recipients(self, topics):
+        """Get the clients that should receive a message with these topics"""
+        if topics is None:
+            return list(self.clients)
+        recipients = set(self.unfiltered)
+        for topic in topics:
+            recipients.update(self.topics.get(topic, ()))
+        return recipients
+
+    async def sender(self, websocket, queue):
+        """Drain one client's send queue so a slow client only delays itself"""
+        try:
+            while True:
+                message = await queue.get()
+                await websocket.send(message)
+        except websockets.exceptions.ConnectionClosed:
+            logger.warning("Client connection closed")
+        except Exception as e:
+            logger.error(f"Error sending to client: {str(e)}")
+
+    async def broadcast(self, data, sender=None, topics=None):
+        """Queue a message for its subscribers but the sender.
+
+        The message is serialized at most once per wire encoding and the
+        result shared by all clients. Without topics it goes to every client.
+        Never waits on a client. Clients whose send queue is full have fallen
+        too far behind and are disconnected.
+        """
         if not self.clients:
             logger.debug("No clients connected, message not broadcast")
             return
 
-        async with self.lock:
-            disconnected = set()
-            for client in self.clients:
-                try:
-                    await client.send(message)
-                    logger.debug(f"Message broadcast successfully")
-                except websockets.exceptions.ConnectionClosed:
-                    logger.warning(f"Client connection closed")
-                    disconnected.add(client)
-                except Exception as e:
-                    logger.error(f"Error broadcasting: {str(e)}")
-                    disconnected.add(client)
-            
-            # Remove disconnected clients
-            for client in disconnected:
-                await self.unregister(client)
+        payloads = {}
+        lagging = []
+        for client in self.recipients(topics):
+            if client is sender:
+                continue
+            queue = self.clients.get(client)
+            if queue is None:
+                continue
+            encoding = self.encodings.get(client, protocol.JSON)
+            payload = payloads.get(encoding)
+            if payload is None:
+                payload = payloads[encoding] = protocol.encode(data, encoding)
+            try:
+                queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                lagging.append(client)
+
+        await self.drop_lagging(lagging)
+
+    async def drop_lagging(self, lagging):
+        """Disconnect clients whose send queue overflowed"""
+        for client in lagging:
+            logger.warning(f"Client fell {self.send_queue_size} messages behind, disconnecting")
+            await self.unregister(client)
+            asyncio.create_task(client.close(code=1008, reason="Client too slow"))
+
+    async def publish(self, data, sender=None, topics=None):
+        """Broadcast an event now, or queue it for the next batch"""
+        if not self.batch_window:
+            await self.broadcast(data, sender=sender, topics=topics)
+            return
+
+        if data.get('type') == 'call_number' and data.get('counter_id') is not None:
+            # A newer call for the same counter replaces the pending one
+            key = ('counter', data['counter_id'])
+        else:
+            key = ('seq', data.get('seq'))
+        self.pending.pop(key, None)
+        self.pending[key] = (data, sender, topics)
+
+        if self.batch_handle is None:
+            loop = asyncio.get_running_loop()
+            self.batch_handle = loop.call_later(
+                self.batch_window, lambda: asyncio.create_task(self.flush_batch()))
+
+    async def flush_batch(self):
+        """Send each client the pending events it is subscribed to as one frame"""
+        events = list(self.pending.values())
+        self.pending.clear()
+        self.batch_handle = None
+        if not events:
+            return
+
+        payloads = {}
+        lagging = []
+        for client, queue in list(self.clients.items()):
+            topics = self.subscriptions.get(client)
+            selected = tuple(
+                i for i, (data, sender, event_topics) in enumerate(events)
+                if sender is not client and (topics is None or event_topics is None
+                                             or not topics.isdisjoint(event_topics)))
+            if not selected:
+                continue
+
+            # Clients with the same encoding and selection share one payload
+            encoding = self.encodings.get(client, protocol.JSON)
+            key = (encoding, selected)
+            payload = payloads.get(key)
+            if payload is None:
+                if len(selected) == 1:
+                    message = events[selected[0]][0]
+                else:
+                    message = {'type': 'batch', 'events': [events[i][0] for i in selected]}
+                payload = payloads[key] = protocol.encode(message, encoding)
+            try:
+                queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                lagging.append(client)
+
+        logger.debug(f"Flushed batch of {len(events)} events")
+        await self.drop_lagging(lagging)
+
+    async def emit(self, data, sender=None):
+        """Number an event, keep it for replay and publish it"""
+        self.seq += 1
+        data['seq'] = self.seq
+        topics = self.message_topics(data)
+        self.history.append((self.seq, data, topics))
+        await self.publish(data, sender=sender, topics=topics)
+
+    async def reload_state(self, sync=False):
+        """Run load_state(), after sync_counters() with sync, off the event loop.
+
+        Both wait on the database, up to its busy timeout, which would stall
+        the fan-out to every client if run on the loop.
+        """
+        loop = asyncio.get_running_loop()
+        if sync:
+            await loop.run_in_executor(self.rpc_executor, sync_counters)
+        await loop.run_in_executor(self.rpc_executor, self.load_state)
+
+    async def day_rollover(self, day):
+        """Reload the board after the queue table was rolled over"""
+        await self.reload_state()
+        await self.emit({'type': 'day_rollover', 'date': day.isoformat()})
+
+    async def rpc(self, websocket, data):
+        """Run a queue service call and send the result to the caller only"""
+        reply = {'type': protocol.RPC_RESULT, 'id': data.get('id')}
+        method = RPC_METHODS.get(data.get('method'))
+        if method is None:
+            reply['error'] = f"Unknown method: {data.get('method')}"
+        else:
+            try:
+                call = functools.partial(method, **(data.get('params') or {}))
+                loop = asyncio.get_running_loop()
+                reply['result'] = await loop.run_in_executor(self.rpc_executor, call)
+            except Exception as e:
+                logger.error(f"Error in queue service call {data.get('method')}: {e}")
+                reply['error'] = str(e)
+        self.send_to(websocket, json.dumps(reply))
 
     async def handler(self, websocket, path):
-        await self.register(websocket)
+        send_task = await self.register(websocket)
         try:
             async for message in websocket:
                 if not self.running:
                     break
                 try:
-                    data = json.loads(message)
+                    data = protocol.decode(message)
                     logger.debug(f"Received message: {data}")
-                    await self.broadcast(message)
-                except json.JSONDecodeError:
-                    logger.error(f"Invalid JSON received: {message}")
+                    if not isinstance(data, dict):
+                        await self.broadcast(data, sender=websocket)
+                        continue
+                    if data.get('type') == 'hello':
+                        self.set_encoding(websocket, data.get('encoding', protocol.JSON),
+                                          data.get('version', protocol.FIRST_VERSION))
+                        continue
+                    if data.get('type') == 'subscribe':
+                        self.subscribe(websocket, data.get('topics', []))
+                        continue
+                    if data.get('type') == 'sync':
+                        self.sync(websocket, data.get('epoch'), data.get('last_seq'))
+                        continue
+                    if data.get('type') == protocol.RPC:
+                        # Calls run concurrently, replies may come out of order
+                        task = asyncio.create_task(self.rpc(websocket, data))
+                        self.rpc_tasks.add(task)
+                        task.add_done_callback(self.rpc_tasks.discard)
+                        continue
+                    if data.get('type') == 'config_changed':
+                        # Counters were reconciled with the new config, by us
+                        # when we own the database, reload them and let every
+                        # client refresh itself
+                        await self.reload_state(sync=get_remote_queue())
+                    await self.emit(self.apply_event(data), sender=websocket)
+                except (json.JSONDecodeError, ValueError):
+                    logger.error(f"Invalid message received: {message!r}")
                 except Exception as e:
                     logger.error(f"Error handling message: {str(e)}")
         except websockets.exceptions.ConnectionClosed:
@@ -71,10 +499,13 @@ class WebSocketServer:
         except Exception as e:
             logger.error(f"Unexpected error: {str(e)}")
         finally:
+            send_task.cancel()
             await self.unregister(websocket)
 
     def stop(self):
         self.running = False
+        # Runs on the event loop, calls in flight finish on their own
+        self.rpc_executor.shutdown(wait=False)
         logger.info("Server stopping...")
 
 async def shutdown(server, ws_server):
@@ -83,14 +514,37 @@ async def shutdown(server, ws_server):
     if ws_server:
         ws_server.close()
         await ws_server.wait_closed()
+    stop_engine()
     logger.info("Server shutdown complete")
 
-async def main():
-    server = WebSocketServer()
+async def main(host, port):
+    # load_state() and the rollover need the migrated schema. With
+    # remote_queue the GUIs reach queue.db only through us, so the queue
+    # can be served from memory.
+    init_database()
+    if get_remote_queue():
+        start_engine()
+    
+    batch_ms = get_batch_window_ms()
+    server = WebSocketServer(batch_window=batch_ms / 1000 if batch_ms else None)
+    
+    # Pick up batching changes from queue_config.json without a restart
+    def on_config_change(config):
+        batch_ms = config['batch_window_ms']
+        server.batch_window = batch_ms / 1000 if batch_ms else None
+    add_config_listener(on_config_change)
+    start_watcher()
+    server.load_state()
+    
+    # Archive closed queue days in the background and refresh the boards
+    loop = asyncio.get_running_loop()
+    scheduler = RolloverScheduler(on_rollover=lambda day, archived, expired:
+        asyncio.run_coroutine_threadsafe(server.day_rollover(day), loop))
+    scheduler.start()
     
     # Create the WebSocket server
-    ws_server = await websockets.serve(server.handler, "localhost", 8765)
-    logger.info("WebSocket server started on ws://localhost:8765")
+    ws_server = await websockets.serve(server.handler, host, port)
+    logger.info(f"WebSocket server started on ws://{host}:{port}")
 
     # Setup shutdown handler
     if platform.system() == 'Windows':
@@ -118,7 +572,13 @@ async def main():
         await shutdown(server, ws_server)
 
 if __name__ == "__main__":
+    default_host, default_port = get_server_address()
+    parser = argparse.ArgumentParser(description='Server antrian')
+    parser.add_argument('--host', default=default_host,
+                        help='Address to listen on, e.g. 0.0.0.0 for all interfaces')
+    parser.add_argument('--port', type=int, default=default_port, help='Port to listen on')
+    args = parser.parse_args()
     try:
-        asyncio.run(main())
+        asyncio.run(main(args.host, args.port))
     except KeyboardInterrupt:
         logger.info("Server stopped by user")